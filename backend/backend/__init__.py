@@ -0,0 +1,4 @@
+# Load the Celery app when Django starts so shared_task uses the configured broker
+from config import celery_app
+
+__all__ = ('celery_app',)
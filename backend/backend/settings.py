@@ -2,6 +2,7 @@ from pathlib import Path
 import os
 from dotenv import load_dotenv
 from datetime import timedelta
+from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 load_dotenv()
@@ -28,6 +29,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "users",
     "bookmarks",
     "categorisation",
@@ -80,6 +82,10 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST', 'localhost'), # CHANGE
         'PORT': os.getenv('DB_PORT', '5432'),
+        'OPTIONS': {
+            # Word similarity needed for a fuzzy search match (pg_trgm default is 0.6, too strict for typos)
+            'options': f"-c pg_trgm.word_similarity_threshold={os.getenv('TRGM_WORD_SIMILARITY_THRESHOLD', '0.5')}",
+        },
     }
 }
 
@@ -146,6 +152,11 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Uploaded and generated files, e.g. image proxy thumbnails. In production the web server
+# can serve MEDIA_ROOT directly
+MEDIA_URL = "media/"
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", str(BASE_DIR / "media"))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -163,6 +174,161 @@ CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 
+# Embedding and tag classifier tasks are routed to ML_QUEUE. The default is Celery's own
+# queue; set it to e.g. "ml" and run dedicated workers for it with
+# `celery -A config worker -Q ml`, so the other workers never load the ML libraries
+ML_QUEUE = os.getenv('ML_QUEUE', 'celery')
+CELERY_TASK_ROUTES = {
+    'recommendations.tasks.*': {'queue': ML_QUEUE},
+    'categorisation.tasks.*': {'queue': ML_QUEUE},
+}
+
+# ML services each worker process loads as it boots instead of on first use, comma
+# separated (see config/ml_services.py). Only set it on the ML workers, e.g.
+# ML_PRELOAD=embedding_encoder,vector_indexes,tag_models
+ML_PRELOAD = [name.strip() for name in os.getenv('ML_PRELOAD', '').split(',') if name.strip()]
+
+# Periodic jobs, run with `celery -A config beat`
+CELERY_BEAT_SCHEDULE = {
+    # Keep bookmark metadata fresh (see bookmarks/services/refresh.py)
+    'sweep-stale-metadata': {
+        'task': 'bookmarks.tasks.sweep_stale_metadata',
+        'schedule': int(os.getenv('METADATA_SWEEP_INTERVAL', str(15 * 60))),
+    },
+    # Suggest tags for untagged bookmarks (see categorisation/services/categoriser.py)
+    'recategorise-untagged': {
+        'task': 'categorisation.tasks.recategorise_untagged',
+        'schedule': crontab(hour=int(os.getenv('RECATEGORISE_HOUR', '3')), minute=0),
+    },
+}
+
+# Caches, both in Redis. Errors are ignored so a Redis outage only means cache misses
+REDIS_CACHE_URL = os.getenv('REDIS_CACHE_URL', 'redis://localhost:6379')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': f'{REDIS_CACHE_URL}/1',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'IGNORE_EXCEPTIONS': True,
+            'SOCKET_CONNECT_TIMEOUT': 1,
+            'SOCKET_TIMEOUT': 1,
+        },
+    },
+    # Extracted page metadata shared between users (see bookmarks/services/metadata_cache.py)
+    'metadata': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': f'{REDIS_CACHE_URL}/2',
+        'KEY_PREFIX': 'metadata',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'IGNORE_EXCEPTIONS': True,
+            'SOCKET_CONNECT_TIMEOUT': 1,
+            'SOCKET_TIMEOUT': 1,
+        },
+    },
+}
+DJANGO_REDIS_LOG_IGNORED_EXCEPTIONS = True
+
+METADATA_CACHE = {
+    'TTL': int(os.getenv('METADATA_CACHE_TTL', str(24 * 60 * 60))),
+    # Timeouts and non-200 responses are only cached briefly
+    'NEGATIVE_TTL': int(os.getenv('METADATA_CACHE_NEGATIVE_TTL', str(5 * 60))),
+    'LOCAL_MAX_ENTRIES': 1024,
+    'LOCAL_TTL': 60,
+}
+
+# HTML parser for metadata extraction (see bookmarks/services/html_signals.py),
+# 'auto' uses lxml when it's installed and falls back to Python's html.parser
+METADATA_PARSER_BACKEND = os.getenv('METADATA_PARSER_BACKEND', 'auto')
+
+# Shared HTTP client used for metadata extraction (see bookmarks/services/http_client.py)
+METADATA_HTTP_CLIENT = {
+    'TIMEOUT': 10,
+    'MAX_CONNECTIONS': int(os.getenv('METADATA_MAX_CONNECTIONS', '100')),
+    'MAX_KEEPALIVE_CONNECTIONS': int(os.getenv('METADATA_MAX_KEEPALIVE_CONNECTIONS', '20')),
+    'KEEPALIVE_EXPIRY': 30,
+    'MAX_CONNECTIONS_PER_HOST': int(os.getenv('METADATA_MAX_CONNECTIONS_PER_HOST', '6')),
+    # Fetches in flight for one extract_many call, the per-host limit above still applies
+    'BATCH_CONCURRENCY': int(os.getenv('METADATA_BATCH_CONCURRENCY', '20')),
+    'HTTP2': True,
+    'VERIFY_SSL': False,
+    # Metadata is read from the start of the page, stop downloading after this many bytes
+    'MAX_BODY_BYTES': int(os.getenv('METADATA_MAX_BODY_BYTES', str(1024 * 1024))),
+    'CHUNK_SIZE': 16 * 1024,
+}
+
+# Preview image and favicon proxy (see bookmarks/services/images.py)
+IMAGE_PROXY = {
+    'MAX_BYTES': int(os.getenv('IMAGE_PROXY_MAX_BYTES', str(5 * 1024 * 1024))),
+    'MAX_PIXELS': 40_000_000,
+    'SOURCE_SIZE': 1024,
+    # Requested sizes are rounded up to one of these, so each image has few thumbnails
+    'SIZES': (16, 32, 64, 128, 320, 640, 1024),
+    'DEFAULT_SIZES': {'preview': 320, 'favicon': 32},
+    'QUALITY': 80,
+    'RETRY_FAILED_AFTER': 24 * 60 * 60,
+    'TIMEOUT': 10,
+}
+
+# Scheduled metadata refresh (see bookmarks/services/refresh.py)
+METADATA_REFRESH = {
+    'MAX_AGE': int(os.getenv('METADATA_REFRESH_MAX_AGE', str(7 * 24 * 60 * 60))),
+    'FAILED_RETRY_AFTER': 24 * 60 * 60,
+    'STUCK_AFTER': 60 * 60,
+    'FAILED_PENALTY': 4,
+    'URLS_PER_SWEEP': int(os.getenv('METADATA_REFRESH_URLS_PER_SWEEP', '500')),
+    'BATCH_SIZE': 25,
+    # Token bucket per domain, shared by all workers through Redis
+    'DOMAIN_RATE': float(os.getenv('METADATA_REFRESH_DOMAIN_RATE', '0.5')),
+    'DOMAIN_BURST': 3,
+    'MAX_DEFER': 10 * 60,
+}
+
+# Bookmark embeddings and similar bookmarks (see recommendations/services/)
+RECOMMENDATIONS = {
+    'MODEL': os.getenv('EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2'),
+    'MAX_TEXT_LENGTH': 2000,
+    # Changed bookmarks are embedded in batches of up to BATCH_SIZE, each waiting at most
+    # BATCH_WINDOW seconds to fill up
+    'BATCH_SIZE': int(os.getenv('EMBEDDING_BATCH_SIZE', '256')),
+    'BATCH_WINDOW': 2,
+    'ENCODE_BATCH_SIZE': 64,
+    # Torch threads per worker process, set to cores / worker concurrency (0 for torch's default)
+    'THREADS': int(os.getenv('EMBEDDING_THREADS', '0')) or None,
+    'VECTOR_DTYPE': os.getenv('EMBEDDING_VECTOR_DTYPE', 'float16'),
+    # Per-user indexes search exactly up to this many bookmarks, through IVF above
+    'FLAT_MAX_VECTORS': 20_000,
+    'IVF_NPROBE': 16,
+    'MAX_INDEXES': int(os.getenv('RECOMMENDATIONS_MAX_INDEXES', '200')),
+    # Least recently used indexes are also dropped once their vectors take more than this
+    'MAX_INDEX_BYTES': int(os.getenv('RECOMMENDATIONS_MAX_INDEX_MB', '1024')) * 1024 * 1024,
+    'SYNC_INTERVAL': 1,
+    'SIMILAR_LIMIT': 10,
+    'MAX_SIMILAR_LIMIT': 50,
+    # ?mode=hybrid search fuses the top HYBRID_CANDIDATES full text and vector results
+    'HYBRID_CANDIDATES': 100,
+    'RRF_K': 60,
+    'HYBRID_MIN_SIMILARITY': 0.2,
+    'HYBRID_VECTOR_TIMEOUT_MS': int(os.getenv('HYBRID_VECTOR_TIMEOUT_MS', '250')),
+}
+
+# Per-user tag classifiers (see categorisation/services/classifier.py)
+CATEGORISATION = {
+    'MIN_TAG_EXAMPLES': 3,
+    'THRESHOLD': float(os.getenv('TAG_SUGGESTION_THRESHOLD', '0.5')),
+    'MAX_SUGGESTIONS': 5,
+    # Time a create request may spend suggesting tags
+    'SUGGEST_BUDGET_MS': int(os.getenv('TAG_SUGGESTION_BUDGET_MS', '25')),
+    'MAX_MODELS': int(os.getenv('CATEGORISATION_MAX_MODELS', '500')),
+    'CACHE_TTL': 60,
+    # Bookmarks are clustered into topics once this many are embedded, in up to MAX_TOPICS
+    'MIN_TOPIC_BOOKMARKS': int(os.getenv('MIN_TOPIC_BOOKMARKS', '50')),
+    'MAX_TOPICS': int(os.getenv('MAX_TOPICS', '40')),
+    'TOPICS_CACHE_TTL': 600,
+}
+
 AUTH_USER_MODEL = "users.CustomUser"  # Using our new user model
 
 
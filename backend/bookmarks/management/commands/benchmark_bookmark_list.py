@@ -0,0 +1,153 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from bookmarks.models import Bookmark
+from bookmarks.services.url_utils import hash_url
+
+User = get_user_model()
+
+BENCH_USER_PREFIX = 'bench-user-'
+PAGE_SIZE = 50
+
+# Indexes added for the list endpoint, dropped temporarily to measure the "before" numbers
+LIST_INDEXES = [
+    'bookmark_user_created_idx',
+    'bookmark_user_source_idx',
+    'bookmark_user_ctype_idx',
+]
+# Unique constraints whose index serves a benchmarked query
+LIST_CONSTRAINTS = [
+    'bookmark_user_url_hash_unique',
+]
+
+SOURCES = [choice for choice, _ in Bookmark.SOURCE_CHOICES]
+CONTENT_TYPES = ['article', 'video', 'image', 'social', 'document']
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic bookmarks and time the list endpoint queries with and without "
+        "the composite list indexes. Never run this against production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help="Total bookmarks to seed")
+        parser.add_argument('--users', type=int, default=100, help="Users the rows are spread across")
+        parser.add_argument('--iterations', type=int, default=20, help="Timed runs per query")
+        parser.add_argument('--cleanup', action='store_true', help="Delete the benchmark users and exit")
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            deleted = User.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()[0]
+            self.stdout.write(f"Deleted {deleted} benchmark rows")
+            return
+
+        users = self.seed(options['rows'], options['users'])
+        user = users[0]
+
+        queries = {
+            'list': Bookmark.objects.filter(user=user).order_by('-created_at'),
+            'source': Bookmark.objects.filter(user=user, source='twitter').order_by('-created_at'),
+            'content_type': Bookmark.objects.filter(user=user, content_type='video').order_by('-created_at'),
+            'url lookup': Bookmark.objects.filter(
+                user=user, url_hash__in=[hash_url(f'https://bench.example.com/{i}') for i in range(50)]
+            ),
+        }
+
+        after = self.time_queries(queries, options['iterations'])
+
+        # Drop the indexes inside a transaction so they come back on rollback
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for index in LIST_INDEXES:
+                    cursor.execute(f'DROP INDEX IF EXISTS "{index}"')
+                for constraint in LIST_CONSTRAINTS:
+                    cursor.execute(
+                        f'ALTER TABLE "{Bookmark._meta.db_table}" DROP CONSTRAINT IF EXISTS "{constraint}"'
+                    )
+                # The FK index that existed before the composite indexes replaced it
+                cursor.execute(
+                    f'CREATE INDEX bench_user_id_idx ON "{Bookmark._meta.db_table}" ("user_id")'
+                )
+            before = self.time_queries(queries, options['iterations'])
+            transaction.set_rollback(True)
+
+        total = Bookmark.objects.count()
+        self.stdout.write(f"\n{total:,} bookmarks, {options['users']} users, first page of {PAGE_SIZE}\n")
+        self.stdout.write(f"{'query':<14}{'before p50':>12}{'after p50':>12}{'before p95':>12}{'after p95':>12}")
+        for name in queries:
+            self.stdout.write(
+                f"{name:<14}"
+                f"{before[name]['p50']:>10.2f}ms{after[name]['p50']:>10.2f}ms"
+                f"{before[name]['p95']:>10.2f}ms{after[name]['p95']:>10.2f}ms"
+            )
+
+    def seed(self, rows, user_count):
+        """
+        Create the benchmark users and insert rows with generate_series, which is far
+        faster than bulk_create at this size. Existing benchmark data is reused.
+        """
+        users = []
+        for i in range(user_count):
+            user, _ = User.objects.get_or_create(
+                username=f'{BENCH_USER_PREFIX}{i}',
+                defaults={'email': f'{BENCH_USER_PREFIX}{i}@example.com', 'name': f'Bench {i}'}
+            )
+            users.append(user)
+
+        existing = Bookmark.objects.filter(user__in=users).count()
+        missing = rows - existing
+        if missing <= 0:
+            return users
+
+        self.stdout.write(f"Seeding {missing:,} bookmarks...")
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'''
+                INSERT INTO "{Bookmark._meta.db_table}"
+                    (url, canonical_url, url_hash, title, created_at, updated_at, user_id, source,
+                     content_type, metadata_status)
+                SELECT
+                    'https://bench.example.com/' || g,
+                    -- Already canonical, so canonical_url is the url and url_hash its sha256
+                    'https://bench.example.com/' || g,
+                    encode(sha256(convert_to('https://bench.example.com/' || g, 'UTF8')), 'hex'),
+                    'Benchmark bookmark ' || g,
+                    now() - (g || ' seconds')::interval,
+                    now(),
+                    (%s::bigint[])[1 + g %% %s],
+                    (%s::text[])[1 + g %% %s],
+                    (%s::text[])[1 + g %% %s],
+                    'complete'
+                FROM generate_series(%s, %s) AS g
+                ''',
+                [
+                    [user.id for user in users], len(users),
+                    SOURCES, len(SOURCES),
+                    CONTENT_TYPES, len(CONTENT_TYPES),
+                    existing + 1, rows,
+                ]
+            )
+            cursor.execute(f'ANALYZE "{Bookmark._meta.db_table}"')
+
+        return users
+
+    def time_queries(self, queries, iterations):
+        results = {}
+        for name, queryset in queries.items():
+            timings = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                list(queryset[:PAGE_SIZE].values_list('id', 'created_at'))
+                timings.append((time.perf_counter() - started) * 1000)
+
+            timings.sort()
+            results[name] = {
+                'p50': statistics.median(timings),
+                'p95': timings[max(0, int(len(timings) * 0.95) - 1)],
+            }
+        return results
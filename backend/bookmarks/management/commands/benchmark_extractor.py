@@ -0,0 +1,185 @@
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+import httpx
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand
+
+from bookmarks.services.html_signals import available_backends, parse_page
+from bookmarks.services.http_client import HTTPClientManager
+from bookmarks.services.metadata_extractor import MetadataExtractor
+
+CHUNK_SIZE = 16 * 1024
+
+HEAD_WITH_META = (
+    '<html><head><title>Benchmark article</title>'
+    '<meta property="og:title" content="Benchmark article">'
+    '<meta property="og:description" content="A long article with full Open Graph tags">'
+    '<meta property="og:image" content="/cover.png">'
+    '<link rel="icon" href="/icon.png">'
+    '</head><body>'
+)
+HEAD_WITHOUT_META = '<html><head><title>Benchmark article</title></head><body>'
+PARAGRAPH = '<p>' + 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 20 + '</p>\n'
+
+
+def build_pages(size):
+    """
+    Synthetic pages of roughly `size` bytes, keyed by path
+    """
+    body = PARAGRAPH * (size // len(PARAGRAPH) + 1)
+    script = '<script>' + 'var state = {"items": [1, 2, 3]};\n' * (size // 34 + 1) + '</script>'
+
+    return {
+        '/meta-head': HEAD_WITH_META + body + '</body></html>',
+        '/no-meta': HEAD_WITHOUT_META + body + '<img src="/photo.jpg" width="400" height="300"></body></html>',
+        '/spa': HEAD_WITH_META.replace('</head>', script + '</head>') + '<div id="root"></div></body></html>',
+    }
+
+
+class CountingStream(httpx.AsyncByteStream):
+    """
+    Serves a page in network sized chunks and counts how many bytes were pulled
+    """
+
+    def __init__(self, content, counter):
+        self.content = content
+        self.counter = counter
+        self.offset = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.offset >= len(self.content):
+            raise StopAsyncIteration
+
+        chunk = self.content[self.offset:self.offset + CHUNK_SIZE]
+        self.offset += len(chunk)
+        self.counter['bytes'] += len(chunk)
+        return chunk
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the streaming metadata extractor with reading and parsing the whole page, "
+        "and the HTML parser backends with a BeautifulSoup tree, using synthetic pages "
+        "served from memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=3 * 1024 * 1024, help="Approximate page size in bytes")
+        parser.add_argument('--iterations', type=int, default=10, help="Timed runs per page")
+        parser.add_argument('--batch', type=int, default=200, help="URLs for the sequential vs extract_many comparison")
+        parser.add_argument('--latency', type=float, default=0.05, help="Simulated response time in seconds for the batch comparison")
+
+    def handle(self, *args, **options):
+        pages = {path: html.encode() for path, html in build_pages(options['size']).items()}
+        counter = {'bytes': 0}
+
+        def handler(request):
+            return httpx.Response(
+                200,
+                headers={'content-type': 'text/html; charset=utf-8'},
+                stream=CountingStream(pages[request.url.path], counter),
+            )
+
+        manager = HTTPClientManager(transport=httpx.MockTransport(handler))
+        extractor = MetadataExtractor(client_manager=manager)
+
+        async def full_page(url):
+            # Download everything, then parse the whole page
+            response = await manager.get(url)
+            signals = parse_page(response.text)
+            return extractor._extract_title(signals, url), extractor._extract_description(signals)
+
+        paths = {
+            'full page': full_page,
+            'streaming': extractor.extract_metadata,
+        }
+
+        try:
+            self.stdout.write(f"\n{'page':<12}{'path':<12}{'p50':>10}{'peak mem':>12}{'downloaded':>12}")
+            for page, content in pages.items():
+                for name, extract in paths.items():
+                    url = f'https://bench.example.com{page}'
+                    timings, peak, downloaded = self.measure(manager, extract, url, counter, options['iterations'])
+                    self.stdout.write(
+                        f"{page:<12}{name:<12}{statistics.median(timings):>8.2f}ms"
+                        f"{peak / 1024:>10.0f}KB{downloaded / 1024:>10.0f}KB"
+                    )
+            self.stdout.write(f"\nPage sizes: {', '.join(f'{p} {len(c) / 1024:.0f}KB' for p, c in pages.items())}")
+        finally:
+            manager.close()
+
+        self.compare_parsers(pages, options['iterations'])
+        self.compare_batch(options['batch'], options['latency'])
+
+    def compare_parsers(self, pages, iterations):
+        """
+        Time a single pass over each whole page per backend. The BeautifulSoup row only
+        builds the tree, the find() calls the extractor used to make on it come on top.
+        """
+        parsers = {name: (lambda html, name=name: parse_page(html, name)) for name in available_backends()}
+        parsers['beautifulsoup'] = lambda html: BeautifulSoup(html, 'html.parser')
+
+        self.stdout.write(f"\n{'page':<12}{'parser':<16}{'p50':>10}")
+        for page, content in pages.items():
+            html = content.decode()
+            for name, parse in parsers.items():
+                timings = []
+                for _ in range(iterations):
+                    started = time.perf_counter()
+                    parse(html)
+                    timings.append((time.perf_counter() - started) * 1000)
+                self.stdout.write(f"{page:<12}{name:<16}{statistics.median(timings):>8.2f}ms")
+
+    def compare_batch(self, count, latency):
+        """
+        Time fetching `count` URLs spread over 10 hosts one after another and through
+        extract_many, against a server that takes `latency` seconds per response
+        """
+        page = HEAD_WITH_META.encode()
+
+        async def handler(request):
+            await asyncio.sleep(latency)
+            return httpx.Response(200, headers={'content-type': 'text/html'}, content=page)
+
+        manager = HTTPClientManager(transport=httpx.MockTransport(handler))
+        extractor = MetadataExtractor(client_manager=manager)
+        urls = [f'https://host{i % 10}.bench.example.com/{i}' for i in range(count)]
+
+        async def sequential():
+            for url in urls:
+                await extractor.extract_metadata(url)
+
+        async def batched():
+            async for _ in extractor.extract_many(urls):
+                pass
+
+        try:
+            self.stdout.write(f"\n{count} URLs, {latency * 1000:.0f}ms per response")
+            for name, run in (('sequential', sequential), ('extract_many', batched)):
+                started = time.perf_counter()
+                manager.run(run())
+                self.stdout.write(f"{name:<16}{(time.perf_counter() - started) * 1000:>10.0f}ms")
+        finally:
+            manager.close()
+
+    def measure(self, manager, extract, url, counter, iterations):
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            manager.run(extract(url))
+            timings.append((time.perf_counter() - started) * 1000)
+
+        # Memory and bytes are measured on a separate run so tracing doesn't skew the timings
+        counter['bytes'] = 0
+        tracemalloc.start()
+        manager.run(extract(url))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return timings, peak, counter['bytes']
@@ -0,0 +1,45 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from bookmarks.services.dedupe import duplicate_groups, merge_duplicates
+
+
+class Command(BaseCommand):
+    help = (
+        "Report bookmarks a user saved more than once under the same canonical URL. "
+        "Use --merge to fold each group into its oldest bookmark."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only this user's bookmarks (email)")
+        parser.add_argument('--merge', action='store_true', help="Merge the duplicates instead of listing them")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            User = get_user_model()
+            try:
+                user = User.objects.get(email=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"No user with email {options['user']}")
+
+        groups = list(duplicate_groups(user))
+        if not groups:
+            self.stdout.write("No duplicate bookmarks")
+            return
+
+        if not options['merge']:
+            self.stdout.write(f"{'user':>8}{'count':>7}  canonical url (bookmark ids, oldest first)")
+            for group in groups:
+                ids = ', '.join(str(pk) for pk in group['ids'])
+                self.stdout.write(f"{group['user']:>8}{group['count']:>7}  {group['canonical_url']} ({ids})")
+            self.stdout.write(f"{len(groups)} groups, {sum(group['count'] - 1 for group in groups)} duplicates")
+            return
+
+        # One transaction per group, an interrupted run keeps what it merged
+        removed = 0
+        for group in groups:
+            if merge_duplicates(group['ids']) is not None:
+                removed += group['count'] - 1
+
+        self.stdout.write(f"Merged {len(groups)} groups, removed {removed} duplicates")
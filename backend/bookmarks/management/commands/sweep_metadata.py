@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from bookmarks.services.refresh import get_refresh_settings, stale_urls
+from bookmarks.tasks import refresh_urls, sweep_stale_metadata
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh stale bookmark metadata now, the same sweep Celery beat runs. "
+        "Use --dry-run to list the URLs a sweep would pick, most urgent first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help="URLs to refresh (defaults to URLS_PER_SWEEP)")
+        parser.add_argument('--dry-run', action='store_true', help="Only list the stale URLs")
+        parser.add_argument('--queue', action='store_true', help="Queue the batches on Celery instead of running them here")
+
+    def handle(self, *args, **options):
+        config = get_refresh_settings()
+
+        if options['queue']:
+            queued = sweep_stale_metadata.delay()
+            self.stdout.write(f"Queued sweep {queued.id}")
+            return
+
+        rows = stale_urls(options['limit'] or config['URLS_PER_SWEEP'], config=config)
+
+        if options['dry_run']:
+            self.stdout.write(f"{'priority':>14}{'bookmarks':>11}{'failed':>8}  url")
+            for row in rows:
+                self.stdout.write(f"{row['priority']:>14.0f}{row['bookmarks']:>11}{row['failed']:>8}  {row['url']}")
+            return
+
+        totals = {}
+        urls = [row['url'] for row in rows]
+        for start in range(0, len(urls), config['BATCH_SIZE']):
+            counts, deferred, wait = refresh_urls(urls[start:start + config['BATCH_SIZE']])
+            for name, count in counts.items():
+                totals[name] = totals.get(name, 0) + count
+
+        self.stdout.write(', '.join(f"{count} {name}" for name, count in totals.items()))
+        if totals.get('deferred'):
+            self.stdout.write("Deferred URLs were rate limited and will be picked up by a later sweep")
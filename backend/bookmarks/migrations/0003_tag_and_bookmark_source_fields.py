@@ -0,0 +1,103 @@
+# Generated by Django 5.1.6 on 2026-10-17 04:20
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookmarks", "0002_bookmark_embed_code_bookmark_image"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Tag",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["name"],
+            },
+        ),
+        migrations.RemoveField(
+            model_name="bookmark",
+            name="embed_code",
+        ),
+        migrations.RemoveField(
+            model_name="bookmark",
+            name="image",
+        ),
+        migrations.AddField(
+            model_name="bookmark",
+            name="content_type",
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name="bookmark",
+            name="favicon",
+            field=models.URLField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name="bookmark",
+            name="preview_image",
+            field=models.URLField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name="bookmark",
+            name="source",
+            field=models.CharField(
+                choices=[
+                    ("manual", "Manual Addition"),
+                    ("twitter", "Twitter"),
+                    ("reddit", "Reddit"),
+                    ("instagram", "Instagram"),
+                    ("facebook", "Facebook"),
+                    ("pinterest", "Pinterest"),
+                    ("pocket", "Pocket"),
+                    ("tiktok", "TikTok"),
+                    ("youtube", "YouTube"),
+                ],
+                default="manual",
+                max_length=20,
+            ),
+        ),
+        migrations.AddField(
+            model_name="bookmark",
+            name="source_id",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name="bookmark",
+            name="description",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.RemoveField(
+            model_name="bookmark",
+            name="tags",
+        ),
+        migrations.AlterField(
+            model_name="bookmark",
+            name="url",
+            field=models.URLField(
+                max_length=500, validators=[django.core.validators.URLValidator]
+            ),
+        ),
+        migrations.AddField(
+            model_name="bookmark",
+            name="tags",
+            field=models.ManyToManyField(
+                blank=True, related_name="bookmarks", to="bookmarks.tag"
+            ),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.6 on 2026-10-17 04:20
+
+from django.db import migrations, models
+
+
+def mark_existing_complete(apps, schema_editor):
+    # Bookmarks created before the enrichment task already had their metadata fetched inline
+    Bookmark = apps.get_model("bookmarks", "Bookmark")
+    Bookmark.objects.update(metadata_status="complete")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookmarks", "0003_tag_and_bookmark_source_fields"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bookmark",
+            name="metadata_error",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name="bookmark",
+            name="metadata_fetched_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="bookmark",
+            name="metadata_status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("processing", "Processing"),
+                    ("complete", "Complete"),
+                    ("failed", "Failed"),
+                ],
+                default="pending",
+                max_length=20,
+            ),
+        ),
+        migrations.RunPython(mark_existing_complete, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-17 04:29
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookmarks", "0005_bookmark_search_vector"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name="bookmark",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper("url"), name="gin_trgm_ops"
+                ),
+                name="bookmark_url_trgm_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bookmark",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper("title"), name="gin_trgm_ops"
+                ),
+                name="bookmark_title_trgm_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.6 on 2026-10-17 04:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookmarks", "0006_bookmark_trigram_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="bookmark",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="bookmarks",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bookmark",
+            index=models.Index(
+                fields=["user", "-created_at"], name="bookmark_user_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bookmark",
+            index=models.Index(
+                fields=["user", "source", "-created_at"],
+                name="bookmark_user_source_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bookmark",
+            index=models.Index(
+                fields=["user", "content_type", "-created_at"],
+                name="bookmark_user_ctype_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bookmark",
+            index=models.Index(fields=["user", "url"], name="bookmark_user_url_idx"),
+        ),
+    ]
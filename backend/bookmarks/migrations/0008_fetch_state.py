@@ -0,0 +1,40 @@
+# Generated by Django 5.1.6 on 2026-10-17 04:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookmarks", "0007_bookmark_list_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FetchState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("url_hash", models.CharField(max_length=64, unique=True)),
+                ("url", models.URLField(max_length=500)),
+                ("etag", models.CharField(blank=True, max_length=255, null=True)),
+                (
+                    "last_modified",
+                    models.CharField(blank=True, max_length=64, null=True),
+                ),
+                (
+                    "content_hash",
+                    models.CharField(blank=True, max_length=64, null=True),
+                ),
+                ("content_length", models.PositiveIntegerField(default=0)),
+                ("fetched_at", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.6 on 2026-10-17 04:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookmarks", "0008_fetch_state"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="bookmark",
+            index=models.Index(
+                fields=["metadata_status", "metadata_fetched_at"],
+                name="bookmark_metadata_age_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,137 @@
+# Generated by Django 5.1.6 on 2026-10-17 05:08
+
+import hashlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 5000
+
+# Copy of url_utils.canonicalize_url as of this migration, so later changes to it
+# don't change what this migration writes
+
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "gbraid", "wbraid", "msclkid", "yclid", "igshid",
+    "mc_cid", "mc_eid", "_ga", "_gl", "ref_src",
+}
+TRACKING_PREFIXES = ("utm_",)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonicalize_url(url):
+    url = url.strip()
+
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+
+    scheme = parts.scheme.lower()
+    default_port = DEFAULT_PORTS.get(scheme)
+    if scheme == "http":
+        scheme = "https"
+
+    host = (parts.hostname or "").rstrip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    if ":" in host:
+        host = f"[{host}]"
+
+    netloc = host
+    if port is not None and port != default_port:
+        netloc = f"{netloc}:{port}"
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password else "")
+        netloc = f"{userinfo}@{netloc}"
+
+    query = sorted(
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not (name.lower() in TRACKING_PARAMS or name.lower().startswith(TRACKING_PREFIXES))
+    )
+
+    path = parts.path.rstrip("/") or "/"
+
+    return urlunsplit((scheme, netloc, path, urlencode(query), ""))
+
+
+def fill_canonical_urls(apps, schema_editor):
+    # Oldest bookmark of each duplicate group gets the hash, the rest keep NULL so the
+    # unique constraint can be added. Merge them with `manage.py dedupe_bookmarks`.
+    Bookmark = apps.get_model("bookmarks", "Bookmark")
+    table = schema_editor.quote_name(Bookmark._meta.db_table)
+
+    rows = (
+        Bookmark.objects.order_by("user_id", "created_at", "id")
+        .values_list("id", "user_id", "url")
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+
+    # One UPDATE per batch from arrays, bulk_update's CASE per row is far slower here
+    def write(batch):
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET canonical_url = v.canonical_url, url_hash = v.url_hash "
+                f"FROM unnest(%s::bigint[], %s::text[], %s::varchar[]) AS v(id, canonical_url, url_hash) "
+                f"WHERE {table}.id = v.id",
+                [list(column) for column in zip(*batch)],
+            )
+
+    batch = []
+    current_user, seen = None, set()
+    for pk, user_id, url in rows:
+        if user_id != current_user:
+            current_user, seen = user_id, set()
+
+        canonical_url = canonicalize_url(url)
+        url_hash = hashlib.sha256(canonical_url.encode()).hexdigest()
+        if url_hash in seen:
+            url_hash = None
+        else:
+            seen.add(url_hash)
+        batch.append((pk, canonical_url, url_hash))
+
+        if len(batch) >= BATCH_SIZE:
+            write(batch)
+            batch = []
+
+    if batch:
+        write(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookmarks", "0010_image_proxy"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="bookmark",
+            name="bookmark_user_url_idx",
+        ),
+        migrations.AddField(
+            model_name="bookmark",
+            name="canonical_url",
+            field=models.TextField(blank=True, default="", editable=False),
+        ),
+        migrations.AddField(
+            model_name="bookmark",
+            name="url_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=64, null=True
+            ),
+        ),
+        migrations.RunPython(fill_canonical_urls, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="bookmark",
+            constraint=models.UniqueConstraint(
+                fields=("user", "url_hash"),
+                name="bookmark_user_url_hash_unique",
+                violation_error_message="You have already bookmarked this URL.",
+            ),
+        ),
+    ]
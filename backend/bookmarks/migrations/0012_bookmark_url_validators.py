@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 05:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookmarks", "0011_bookmark_canonical_url"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="bookmark",
+            name="url",
+            field=models.URLField(max_length=500),
+        ),
+    ]
@@ -1,7 +1,11 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.contrib.auth import get_user_model
-from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
+from django.db.models.functions import Upper
+
+from .services.url_utils import canonicalize_url, hash_canonical_url, is_valid_url
 
 User = get_user_model()
 
@@ -20,7 +24,11 @@ class Tag(models.Model):
 
 class Bookmark(models.Model):
 
-    url = models.URLField(max_length=500, validators=[URLValidator]) # Ensure proper url
+    url = models.URLField(max_length=500) # URLField validates the format itself
+    # Normalized url and its sha256 for duplicate detection (see url_utils.canonicalize_url),
+    # set on save. url_hash is null on old duplicates until dedupe_bookmarks merges them
+    canonical_url = models.TextField(blank=True, default='', editable=False)
+    url_hash = models.CharField(max_length=64, blank=True, null=True, editable=False)
     title = models.CharField(max_length=255, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
 
@@ -28,7 +36,8 @@ class Bookmark(models.Model):
     updated_at = models.DateTimeField(auto_now =True)
 
     tags = models.ManyToManyField(Tag, related_name="bookmarks", blank=True) # Relation table auto created
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="bookmarks")
+    # No standalone index, the composite indexes in Meta all lead with user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="bookmarks", db_index=False)
 
     SOURCE_CHOICES = (
         ('manual', 'Manual Addition'),
@@ -49,24 +58,156 @@ class Bookmark(models.Model):
     preview_image = models.URLField(max_length=500, blank=True, null=True)
     favicon = models.URLField(max_length=500, blank=True, null=True)
 
+    # Metadata is filled in asynchronously by bookmarks.tasks.enrich_bookmark_metadata
+    METADATA_STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('complete', 'Complete'),
+        ('failed', 'Failed'),
+    )
+
+    metadata_status = models.CharField(max_length=20, choices=METADATA_STATUS_CHOICES, default='pending')
+    metadata_error = models.CharField(max_length=255, blank=True, null=True)
+    metadata_fetched_at = models.DateTimeField(blank=True, null=True)
+
+    # Full text search document, kept up to date by Postgres on every write (including bulk_create)
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector('title', weight='A', config='english')
+            + SearchVector('description', weight='B', config='english')
+            + SearchVector('url', weight='C', config='simple')
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            # Match BookmarkViewSet.get_queryset: always filtered by user, optionally by
+            # source or content_type, ordered newest first
+            models.Index(fields=['user', '-created_at'], name='bookmark_user_created_idx'),
+            models.Index(fields=['user', 'source', '-created_at'], name='bookmark_user_source_idx'),
+            models.Index(fields=['user', 'content_type', '-created_at'], name='bookmark_user_ctype_idx'),
+            # Refresh sweeps look for old or failed fetches across all users
+            models.Index(fields=['metadata_status', 'metadata_fetched_at'], name='bookmark_metadata_age_idx'),
+            GinIndex(fields=['search_vector'], name='bookmark_search_vector_idx'),
+            # Trigram indexes serve icontains (UPPER(col) LIKE ...) and the fuzzy search mode
+            GinIndex(OpClass(Upper('url'), name='gin_trgm_ops'), name='bookmark_url_trgm_idx'),
+            GinIndex(OpClass(Upper('title'), name='gin_trgm_ops'), name='bookmark_title_trgm_idx'),
+        ]
+        constraints = [
+            # One bookmark per page per user, also serves duplicate lookups (bulk import)
+            models.UniqueConstraint(
+                fields=['user', 'url_hash'],
+                name='bookmark_user_url_hash_unique',
+                violation_error_message='You have already bookmarked this URL.',
+            ),
+        ]
+
     def clean(self):
         """
-        Custom validation to ensure URL is valid and properly formatted
+        URL format is checked by the field, this only fills in the derived url fields
+        so constraint validation sees the current url_hash
+        """
+        self.set_canonical_url()
+
+    def set_canonical_url(self):
         """
+        Fill in canonical_url and url_hash from url, for code paths that skip save()
 
-        urlValidaitor = URLValidator()
+        Duplicates saved before the unique constraint have no url_hash, giving them
+        one would violate it. They keep none until their URL changes or
+        `manage.py dedupe_bookmarks` merges them.
+        """
+        canonical_url = canonicalize_url(self.url)
+        if self.pk is not None and self.url_hash is None and canonical_url == self.canonical_url:
+            return
+        self.canonical_url = canonical_url
+        self.url_hash = hash_canonical_url(canonical_url)
 
-        try:
-            urlValidaitor(self.url)
+    def prepare(self):
+        """
+        Light validation for rows already validated upstream (the API serializers, the
+        importer) or that only get metadata written: rejects bad URLs and sets the
+        derived url fields, without full_clean's per-field checks and queries.
+        Use before bulk_create / bulk_update.
 
-        except ValidationError:
+        Raises:
+            ValidationError if the URL is invalid
+        """
+        if not is_valid_url(self.url):
             raise ValidationError({'url': 'Enter a valid URL.'})
-    
-    def save(self, *args, **kwargs):
-        # Ensure validation is run
-        self.full_clean()
+        self.set_canonical_url()
+
+    def save(self, *args, validate=True, **kwargs):
+        """
+        Runs full_clean first, or only prepare() when validate is False
+        """
+        if validate:
+            self.full_clean()
+        else:
+            self.prepare()
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title if self.title else self.url
 
+
+
+class FetchState(models.Model):
+    """
+    HTTP validators from the last successful fetch of a URL, shared by every bookmark of it.
+    Refreshes send them back so unchanged pages cost a 304 or a hash comparison.
+    """
+    url_hash = models.CharField(max_length=64, unique=True)  # sha256 of the canonical url, see url_utils.hash_url
+    url = models.URLField(max_length=500)
+
+    etag = models.CharField(max_length=255, blank=True, null=True)
+    last_modified = models.CharField(max_length=64, blank=True, null=True)  # Raw header, sent back as is
+    content_hash = models.CharField(max_length=64, blank=True, null=True)  # sha256 of the bytes the extractor read
+    content_length = models.PositiveIntegerField(default=0)  # Number of bytes content_hash covers
+
+    fetched_at = models.DateTimeField()  # When the content these validators describe was fetched
+
+    def __str__(self):
+        return self.url
+
+
+class StoredImage(models.Model):
+    """
+    An image fetched by the image proxy, stored once per distinct content.
+    Files live under images/<hash[:2]>/<hash>/ in the default storage (see services/images.py).
+    """
+    content_hash = models.CharField(max_length=64, unique=True)  # sha256 of the downloaded bytes
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.content_hash
+
+
+class ImageSource(models.Model):
+    """
+    Where a proxied image came from. Images are keyed by their URL, except a host's
+    default /favicon.ico which is keyed by the host so every bookmark from a site shares it.
+    """
+    KIND_CHOICES = (
+        ('preview', 'Preview image'),
+        ('favicon', 'Favicon'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    key = models.CharField(max_length=255)  # url_utils.hash_url of the image, the host for default favicons
+    url = models.URLField(max_length=500)  # URL the image was last fetched from
+    image = models.ForeignKey(StoredImage, on_delete=models.SET_NULL, related_name='sources', blank=True, null=True)
+    error = models.CharField(max_length=255, blank=True, null=True)  # Why the last fetch failed, image is null then
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'key'], name='image_source_kind_key_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind}: {self.key}'
@@ -0,0 +1,185 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder drops microseconds, which would make the cursor skip rows
+    created within the same millisecond
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (ordering field, tiebreaker), (created_at, id) by default.
+
+    Each page filters on the last row's key instead of using OFFSET, so fetching page
+    1000 costs the same as page 1. The ordering field is the first field the queryset is
+    ordered by (e.g. from OrderingFilter or the model's Meta.ordering) and the tiebreaker
+    breaks ties, so the key is unique.
+
+    NULLs sort as Postgres does by default: last ascending, first descending.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    default_ordering = '-created_at'
+    tiebreaker = 'pk'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        field, descending = self.get_ordering(queryset)
+        position = self.decode_cursor(request)
+
+        # Going backwards scans in the opposite direction and flips the rows afterwards
+        reverse = bool(position and position[2])
+        scan_descending = descending != reverse
+
+        prefix = '-' if scan_descending else ''
+        queryset = queryset.order_by(f'{prefix}{field}', f'{prefix}{self.tiebreaker}')
+
+        if position is not None:
+            nullable = self.is_nullable(queryset.model, field)
+            queryset = queryset.filter(self.after(field, scan_descending, position[0], position[1], nullable))
+
+        # Fetch one extra row to know whether there is another page
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if reverse:
+            rows.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.field = field
+        self.rows = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering(self, queryset):
+        """
+        Return (field, descending) for the first field the queryset is ordered by
+        """
+        ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering) or [self.default_ordering]
+
+        first = ordering[0]
+        if not isinstance(first, str):
+            raise TypeError("KeysetPagination only supports ordering by field names")
+
+        return first.lstrip('-'), first.startswith('-')
+
+    def is_nullable(self, model, field):
+        try:
+            return model._meta.get_field(field).null
+        except FieldDoesNotExist:
+            # Annotations and lookups across relations
+            return False
+
+    def after(self, field, descending, value, key, nullable):
+        """
+        Filter for rows that come after (value, key) in the given direction.
+
+        The redundant lte/gte bound lets Postgres turn the condition into an index range.
+        """
+        tiebreaker = self.tiebreaker
+        op, bound = ('lt', 'lte') if descending else ('gt', 'gte')
+
+        if value is None:
+            condition = Q(**{f'{field}__isnull': True, f'{tiebreaker}__{op}': key})
+            if descending:
+                # NULLs come first descending, so every non-NULL row is after them
+                condition |= Q(**{f'{field}__isnull': False})
+            return condition
+
+        condition = Q(**{f'{field}__{bound}': value}) & (
+            Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'{tiebreaker}__{op}': key})
+        )
+        if nullable and not descending:
+            # NULLs come last ascending
+            condition |= Q(**{f'{field}__isnull': True})
+        return condition
+
+    # Cursors
+
+    def encode_cursor(self, row, reverse):
+        position = [self.get_value(row, self.field), self.get_value(row, self.tiebreaker), reverse]
+        payload = json.dumps(position, cls=CursorEncoder).encode()
+        return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            payload = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            value, key, reverse = json.loads(payload)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return value, key, bool(reverse)
+
+    def get_value(self, row, field):
+        if isinstance(row, dict):
+            return row[field]
+        return getattr(row, field)
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.rows[-1], False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        url = self.request.build_absolute_uri()
+        if not self.rows:
+            return remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.rows[0], True))
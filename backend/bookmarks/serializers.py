@@ -1,5 +1,11 @@
+from urllib.parse import urlsplit
+
+from django.urls import reverse
 from rest_framework import serializers
 from .models import Bookmark, Tag
+from .services.images import make_token
+from .services.tags import sync_bookmark_tags
+from .services.url_utils import hash_url
 
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
@@ -18,15 +24,53 @@ class BookmarkSerializer(serializers.ModelSerializer):
         required=False
     )
 
+    # Same images served through the local image proxy
+    preview_image_proxy = serializers.SerializerMethodField()
+    favicon_proxy = serializers.SerializerMethodField()
+
     class Meta:
         model = Bookmark
         fields = [
             'id', 'url', 'title', 'description', 'created_at', 'updated_at',
             'user', 'tags', 'tag_names', 'source', 'source_id', 'content_type',
-            'preview_image', 'favicon'
+            'preview_image', 'favicon', 'metadata_status', 'metadata_fetched_at',
+            'preview_image_proxy', 'favicon_proxy'
         ]
-        read_only_fields = ('user', 'id', 'created_at', 'updated_at')
+        read_only_fields = ('user', 'id', 'created_at', 'updated_at', 'metadata_status', 'metadata_fetched_at')
     
+    def _proxy_url(self, token):
+        path = reverse('image-proxy', args=[token])
+        request = self.context.get('request')
+        return request.build_absolute_uri(path) if request else path
+
+    def get_preview_image_proxy(self, obj):
+        if not obj.preview_image:
+            return None
+        return self._proxy_url(make_token('preview', obj.preview_image))
+
+    def get_favicon_proxy(self, obj):
+        # The host's /favicon.ico unless the page named another, the proxy checks it exists
+        parts = urlsplit(obj.url)
+        if not parts.hostname:
+            return None
+        favicon = obj.favicon or f'{parts.scheme}://{parts.netloc}/favicon.ico'
+        return self._proxy_url(make_token('favicon', favicon, parts.hostname.lower()))
+
+    def validate_url(self, value):
+        """
+        Reject URLs the user already bookmarked, compared by canonical URL
+        """
+        request = self.context.get('request')
+        if request is None:
+            return value
+
+        duplicates = Bookmark.objects.filter(user=request.user, url_hash=hash_url(value))
+        if self.instance is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise serializers.ValidationError('You have already bookmarked this URL.')
+        return value
+
     def create(self, validated_data):
         """
         Override create method to handle tag creation/assignment
@@ -34,11 +78,13 @@ class BookmarkSerializer(serializers.ModelSerializer):
         # Extract tag_names from validated data (if present)
         tag_names = validated_data.pop('tag_names', [])
         
-        # Create the bookmark
-        bookmark = Bookmark.objects.create(**validated_data)
+        # Create the bookmark, the fields were validated above so full_clean is skipped
+        bookmark = Bookmark(**validated_data)
+        bookmark.save(validate=False)
         
         # Add tags
-        self._get_or_create_tags(bookmark, tag_names)
+        if tag_names:
+            sync_bookmark_tags(bookmark, tag_names)
         
         return bookmark
     
@@ -52,24 +98,71 @@ class BookmarkSerializer(serializers.ModelSerializer):
         # Update the bookmark with all other fields
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
-        instance.save()
+        instance.save(validate=False)
         
-        # Update tags if provided
+        # Update tags if provided, only adding and removing what changed
         if tag_names is not None:
-            # Clear existing tags
-            instance.tags.clear()
-            # Add new tags
-            self._get_or_create_tags(instance, tag_names)
+            sync_bookmark_tags(instance, tag_names)
         
         return instance
-    
-    def _get_or_create_tags(self, bookmark, tag_names):
-        """
-        Helper method to get existing tags or create new ones
-        and associate them with the bookmark
-        """
-        for tag_name in tag_names:
-            tag_name = tag_name.strip().lower()
-            if tag_name:
-                tag, _ = Tag.objects.get_or_create(name=tag_name)
-                bookmark.tags.add(tag)
+
+
+class BookmarkSearchResultSerializer(BookmarkSerializer):
+    """
+    Bookmark plus the ranking details added by the search service.
+    rank and highlight are null for modes that don't compute them, scores only
+    comes with hybrid search: the keyword and vector score the fused rank came from.
+    """
+    rank = serializers.SerializerMethodField()
+    highlight = serializers.SerializerMethodField()
+    scores = serializers.SerializerMethodField()
+
+    class Meta(BookmarkSerializer.Meta):
+        fields = BookmarkSerializer.Meta.fields + ['rank', 'highlight', 'scores']
+
+    def get_rank(self, obj):
+        return getattr(obj, 'rank', None)
+
+    def get_scores(self, obj):
+        if not hasattr(obj, 'vector_score'):
+            return None
+        return {
+            'keyword': obj.keyword_score,
+            'vector': obj.vector_score,
+        }
+
+    def get_highlight(self, obj):
+        if not hasattr(obj, 'title_highlight'):
+            return None
+        return {
+            'title': obj.title_highlight,
+            'description': obj.description_highlight,
+        }
+
+
+class SimilarBookmarkSerializer(BookmarkSerializer):
+    """
+    Bookmark plus its cosine similarity to the bookmark it was found for
+    """
+    similarity = serializers.FloatField(read_only=True)
+
+    class Meta(BookmarkSerializer.Meta):
+        fields = BookmarkSerializer.Meta.fields + ['similarity']
+
+
+class BookmarkImportSerializer(serializers.ModelSerializer):
+    """
+    Validates a single row of a bulk import. Rows are written with bulk_create
+    by the importer, so this serializer is never saved.
+    """
+    tag_names = serializers.ListField(
+        child=serializers.CharField(max_length=50),
+        required=False
+    )
+
+    class Meta:
+        model = Bookmark
+        fields = [
+            'url', 'title', 'description', 'tag_names', 'source', 'source_id',
+            'content_type', 'preview_image', 'favicon'
+        ]
@@ -0,0 +1,72 @@
+# bookmarks/services/dedupe.py
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import transaction
+from django.db.models import Count
+
+from ..models import Bookmark
+
+# Filled in on the kept bookmark from its duplicates when it has no value of its own
+MERGE_FIELDS = ('title', 'description', 'source_id', 'content_type', 'preview_image', 'favicon')
+
+
+def duplicate_groups(user=None):
+    """
+    Bookmarks a user saved more than once under the same canonical URL. These predate
+    the unique (user, url_hash) constraint, only the oldest of each group has a url_hash.
+
+    Returns:
+        Queryset of dicts with user, canonical_url, count and ids (oldest first)
+    """
+    bookmarks = Bookmark.objects.all()
+    if user is not None:
+        bookmarks = bookmarks.filter(user=user)
+
+    return (
+        bookmarks
+        .values('user', 'canonical_url')
+        .annotate(count=Count('id'), ids=ArrayAgg('id', ordering=('created_at', 'id')))
+        .filter(count__gt=1)
+        .order_by('user', 'canonical_url')
+    )
+
+
+def merge_duplicates(ids):
+    """
+    Merge bookmarks of one duplicate group into the oldest one: empty fields are filled
+    in from the others (newest last), tags are combined and the others are deleted.
+
+    Returns:
+        The kept Bookmark, or None if the bookmarks no longer exist
+    """
+    with transaction.atomic():
+        bookmarks = list(
+            Bookmark.objects.select_for_update().filter(id__in=ids).order_by('created_at', 'id')
+        )
+        if not bookmarks:
+            return None
+
+        keep, duplicates = bookmarks[0], bookmarks[1:]
+        for duplicate in duplicates:
+            for field in MERGE_FIELDS:
+                if not getattr(keep, field) and getattr(duplicate, field):
+                    setattr(keep, field, getattr(duplicate, field))
+
+            if keep.metadata_status != 'complete' and duplicate.metadata_status == 'complete':
+                keep.metadata_status = 'complete'
+                keep.metadata_error = None
+                keep.metadata_fetched_at = duplicate.metadata_fetched_at
+
+        Through = Bookmark.tags.through
+        tag_ids = set(
+            Through.objects.filter(bookmark_id__in=[duplicate.id for duplicate in duplicates])
+            .values_list('tag_id', flat=True)
+        )
+
+        Bookmark.objects.filter(id__in=[duplicate.id for duplicate in duplicates]).delete()
+
+        # Only the kept bookmark is left, save() gives it the url_hash
+        keep.save()
+        if tag_ids:
+            keep.tags.add(*tag_ids)
+
+    return keep
@@ -0,0 +1,73 @@
+# bookmarks/services/fetch_state.py
+from django.utils import timezone
+
+from ..models import FetchState
+from .url_utils import hash_url
+
+VALIDATOR_FIELDS = ('etag', 'last_modified', 'content_hash', 'content_length')
+
+
+def get_validators(url, since=None):
+    """
+    Validators stored from the last fetch of a URL, to make the next fetch conditional.
+
+    Args:
+        url: The fetched URL
+        since: Only return them if that fetch happened at or before this time, i.e. the
+            caller has already applied the content they describe
+
+    Returns:
+        Dict of VALIDATOR_FIELDS, or None
+    """
+    return get_validators_many({url: since}).get(url)
+
+
+def get_validators_many(since_by_url):
+    """
+    get_validators for several URLs in one query
+
+    Args:
+        since_by_url: Dict mapping each url to its since (or None)
+
+    Returns:
+        Dict mapping url to its validators, for the URLs that have usable ones
+    """
+    urls_by_hash = {hash_url(url): url for url in since_by_url}
+    states = (
+        FetchState.objects
+        .filter(url_hash__in=urls_by_hash)
+        .values('url_hash', 'fetched_at', *VALIDATOR_FIELDS)
+    )
+
+    validators = {}
+    for state in states:
+        url = urls_by_hash[state.pop('url_hash')]
+        fetched_at = state.pop('fetched_at')
+        since = since_by_url[url]
+        if since is None or fetched_at <= since:
+            validators[url] = state
+
+    return validators
+
+
+def record_fetch(url, result, previous=None):
+    """
+    Store the validators of a FetchResult, skipping the write when nothing changed.
+
+    fetched_at only moves forward when new content was fetched, a 304 or an unchanged
+    hash with a rotated ETag just updates the validators.
+    """
+    validators = result.validators()
+    if validators is None or validators == previous:
+        return
+
+    defaults = {'url': url, **validators}
+    create_defaults = dict(defaults, fetched_at=timezone.now())
+    if not result.not_modified:
+        defaults['fetched_at'] = create_defaults['fetched_at']
+
+    FetchState.objects.update_or_create(
+        url_hash=hash_url(url),
+        defaults=defaults,
+        create_defaults=create_defaults,
+    )
@@ -0,0 +1,332 @@
+# bookmarks/services/html_signals.py
+from html.parser import HTMLParser
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Elements that never have content, they're closed as soon as they open
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+    'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame',
+    'image', 'isindex', 'nextid', 'spacer',
+}
+
+# Strings inside these elements aren't counted as text of the elements around them
+NON_TEXT_ELEMENTS = {'script', 'style', 'template', 'rt', 'rp'}
+
+# Tags that only appear in the body, used to spot the end of pages that leave out </head>
+BODY_TAGS = {'body', 'p', 'div', 'img', 'h1', 'h2', 'article', 'main', 'section', 'header', 'nav'}
+
+VIDEO_PLATFORMS = ('youtube', 'vimeo', 'dailymotion')
+
+# Smallest width and height for an <img> to count as the page's main image
+MIN_IMAGE_SIZE = 100
+
+
+class PageSignals:
+    """
+    Everything the metadata extractor reads from a page, collected in one pass over its tags.
+
+    Parser backends call start/end/data/comment as they go. Each signal keeps the first
+    match in document order, like BeautifulSoup's find() did, so results are the same as
+    walking a full tree. Element nesting follows BeautifulSoup's html.parser rules: an end
+    tag closes the most recent open element with that name and stray end tags are ignored.
+    """
+
+    def __init__(self):
+        # First content seen for each <meta property> and <meta name>, None if it had none
+        self.meta_properties = {}
+        self.meta_names = {}
+        self.og_type_image = False
+
+        self.title = None
+        self.first_paragraph = None
+        self.main_image = None
+        self.fallback_image = None
+        self.favicon = None
+        self.has_video = False
+        self.head_done = False
+
+        self._stack = []
+        self._non_text_depth = 0
+        self._paragraph_depth = None
+        self._paragraph_parts = None
+        self._title_depth = None
+        self._title_nodes = None
+
+    @property
+    def complete(self):
+        """
+        True once the head has ended and covered every field the body could fill in
+        """
+        has_description = any(
+            self.meta_properties.get('og:description') or self.meta_names.get(name)
+            for name in ('twitter:description', 'description')
+        )
+        has_image = self.meta_properties.get('og:image') or self.meta_names.get('twitter:image')
+        return bool(self.head_done and has_description and has_image)
+
+    # Parser events
+
+    def start(self, tag, attrs):
+        if tag == 'meta':
+            self._meta(attrs)
+        elif tag == 'link':
+            rel = (attrs.get('rel') or '').split()
+            if self.favicon is None and 'icon' in rel and attrs.get('href'):
+                self.favicon = attrs['href']
+        elif tag == 'img' and 'src' in attrs:
+            self._image(attrs)
+        elif tag == 'iframe':
+            src = (attrs.get('src') or '').lower()
+            if any(platform in src for platform in VIDEO_PLATFORMS):
+                self.has_video = True
+        elif tag == 'video':
+            self.has_video = True
+
+        if tag in BODY_TAGS:
+            self.head_done = True
+
+        if self._title_nodes is not None and self._title_depth is not None:
+            self._title_nodes[-1].append([])
+            self._title_nodes.append(self._title_nodes[-1][-1])
+
+        if tag in VOID_ELEMENTS:
+            if self._title_nodes is not None and self._title_depth is not None:
+                self._title_nodes.pop()
+            return
+
+        self._stack.append(tag)
+        if tag in NON_TEXT_ELEMENTS:
+            self._non_text_depth += 1
+
+        if tag == 'p' and self.first_paragraph is None and self._paragraph_depth is None:
+            self._paragraph_depth = len(self._stack) - 1
+            self._paragraph_parts = []
+        elif tag == 'title' and self._title_nodes is None:
+            self._title_depth = len(self._stack) - 1
+            self._title_nodes = [[]]
+
+    def end(self, tag):
+        if tag == 'head':
+            self.head_done = True
+
+        # Close the most recent open element with this name, ignoring stray end tags
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index] == tag:
+                self._pop_to(index)
+                return
+
+    def data(self, text):
+        if self._paragraph_depth is not None and not self._non_text_depth:
+            self._paragraph_parts.append(text)
+
+        if self._title_depth is not None:
+            children = self._title_nodes[-1]
+            if children and isinstance(children[-1], str):
+                # Adjacent text is one string, even when the parser delivers it in pieces
+                children[-1] += text
+            else:
+                children.append(text)
+
+    def comment(self, text):
+        if self._title_depth is not None:
+            self._title_nodes[-1].append(None)
+
+    def close(self):
+        self._pop_to(0)
+
+    # Helpers
+
+    def _meta(self, attrs):
+        content = attrs.get('content')
+
+        prop = attrs.get('property')
+        if prop is not None:
+            self.meta_properties.setdefault(prop, content)
+            if prop == 'og:type' and content == 'image':
+                self.og_type_image = True
+
+        name = attrs.get('name')
+        if name is not None:
+            self.meta_names.setdefault(name, content)
+
+    def _image(self, attrs):
+        src = attrs['src']
+
+        if self.main_image is None:
+            try:
+                width, height = int(attrs.get('width')), int(attrs.get('height'))
+            except (TypeError, ValueError):
+                pass
+            else:
+                if width >= MIN_IMAGE_SIZE and height >= MIN_IMAGE_SIZE:
+                    self.main_image = src
+
+        if self.fallback_image is None and not src.endswith(('.ico', '.svg')) and 'logo' not in src.lower():
+            self.fallback_image = src
+
+    def _pop_to(self, index):
+        """
+        Close every open element from stack position index upwards
+        """
+        for tag in self._stack[index:]:
+            if tag in NON_TEXT_ELEMENTS:
+                self._non_text_depth -= 1
+        del self._stack[index:]
+
+        if self._paragraph_depth is not None and self._paragraph_depth >= index:
+            self.first_paragraph = ''.join(self._paragraph_parts)
+            self._paragraph_depth = None
+            self._paragraph_parts = None
+
+        if self._title_depth is not None:
+            if self._title_depth >= index:
+                self.title = self._single_string(self._title_nodes[0])
+                self._title_depth = None
+            else:
+                # Closed elements inside the title
+                depth = len(self._stack) - self._title_depth
+                del self._title_nodes[depth:]
+
+    def _single_string(self, children):
+        """
+        The element's only string, following nested single children like Tag.string
+        """
+        if len(children) != 1:
+            return None
+        child = children[0]
+        if isinstance(child, list):
+            return self._single_string(child)
+        return child
+
+
+# Backends
+
+class HTMLParserBackend(HTMLParser):
+    """
+    Feeds PageSignals from Python's built in html.parser
+    """
+    name = 'html.parser'
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.signals = PageSignals()
+        self._raw_element = None
+        self._skipped_tail = ''
+
+    def feed(self, data):
+        # HTMLParser rescans an unclosed <script> or <style> on every feed, which is slow for
+        # the large inline scripts some apps put in the head. Their contents aren't signals,
+        # so chunks that can't close the element are skipped, keeping the end in case a
+        # closing tag is split across chunks
+        if self._raw_element:
+            data = self._skipped_tail + data
+            if f'</{self._raw_element}' not in data.lower():
+                self._skipped_tail = data[-len(self._raw_element) - 2:]
+                return
+            self._skipped_tail = ''
+
+        super().feed(data)
+
+    def close(self):
+        super().close()
+        self.signals.close()
+        return self.signals
+
+    def handle_starttag(self, tag, attrs):
+        # Later duplicates win and valueless attributes are empty strings
+        self.signals.start(tag, {key: value or '' for key, value in attrs})
+        if tag in ('script', 'style'):
+            self._raw_element = tag
+
+    def handle_startendtag(self, tag, attrs):
+        self.signals.start(tag, {key: value or '' for key, value in attrs})
+        self.signals.end(tag)
+
+    def handle_endtag(self, tag):
+        if tag == self._raw_element:
+            self._raw_element = None
+        self.signals.end(tag)
+
+    def handle_data(self, data):
+        self.signals.data(data)
+
+    def handle_comment(self, data):
+        self.signals.comment(data)
+
+
+class LxmlBackend:
+    """
+    Feeds PageSignals from libxml2's HTML parser, using it directly as lxml's parser target.
+
+    libxml2 fixes up broken markup the way browsers do, for example a <p> is closed when
+    a block element starts, so badly nested pages can differ slightly from html.parser.
+    """
+    name = 'lxml'
+
+    def __init__(self):
+        self.signals = PageSignals()
+        self._parser = etree.HTMLParser(target=self.signals, recover=True, no_network=True)
+
+    def feed(self, data):
+        self._parser.feed(data)
+
+    def close(self):
+        try:
+            self._parser.close()
+        except etree.XMLSyntaxError:
+            # Raised for empty documents, there's nothing to collect anyway
+            self.signals.close()
+        return self.signals
+
+
+PARSER_BACKENDS = {
+    'html.parser': HTMLParserBackend,
+    'lxml': LxmlBackend,
+}
+
+
+def available_backends():
+    """
+    Names of the backends whose dependencies are installed, fastest first
+    """
+    names = ['html.parser']
+    if etree is not None:
+        names.insert(0, 'lxml')
+    return names
+
+
+def get_parser_backend(name=None):
+    """
+    Return the parser backend class for name, or for settings.METADATA_PARSER_BACKEND.
+    'auto' picks the fastest installed backend.
+    """
+    name = name or getattr(settings, 'METADATA_PARSER_BACKEND', 'auto')
+
+    if name == 'auto':
+        return PARSER_BACKENDS[available_backends()[0]]
+
+    if name not in available_backends():
+        raise ImproperlyConfigured(
+            f"Unknown or unavailable metadata parser backend '{name}'. "
+            f"Available: {', '.join(available_backends())}"
+        )
+    return PARSER_BACKENDS[name]
+
+
+def parse_page(html, backend=None):
+    """
+    Collect the signals for a whole document in one pass
+
+    Returns:
+        PageSignals
+    """
+    parser = get_parser_backend(backend)()
+    parser.feed(html)
+    return parser.close()
@@ -0,0 +1,326 @@
+# bookmarks/services/http_client.py
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import ssl
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from urllib.parse import urlparse
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable through settings.METADATA_HTTP_CLIENT
+DEFAULT_CLIENT_SETTINGS = {
+    'TIMEOUT': 10,
+    'MAX_CONNECTIONS': 100,
+    'MAX_KEEPALIVE_CONNECTIONS': 20,
+    'KEEPALIVE_EXPIRY': 30,
+    'MAX_CONNECTIONS_PER_HOST': 6,
+    'BATCH_CONCURRENCY': 20,
+    'HTTP2': True,
+    'VERIFY_SSL': False,
+    'MAX_BODY_BYTES': 1024 * 1024,
+    'CHUNK_SIZE': 16 * 1024,
+}
+
+
+def get_client_settings():
+    """
+    Merge the configured client settings over the defaults
+    """
+    config = dict(DEFAULT_CLIENT_SETTINGS)
+    config.update(getattr(settings, 'METADATA_HTTP_CLIENT', {}))
+    return config
+
+
+@lru_cache(maxsize=2)
+def get_ssl_context(verify=False):
+    """
+    Build an SSL context once per verification mode and reuse it.
+    Creating a context loads the CA bundle from disk, so doing it per request is expensive.
+    """
+    ssl_context = ssl.create_default_context()
+
+    if not verify:
+        # Ignore certificate errors for cases where sites have invalid certs
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+
+    return ssl_context
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class HTTPClientManager:
+    """
+    Owns a single long-lived httpx.AsyncClient and the event loop it runs on.
+
+    The client keeps connections alive between requests, so repeated fetches to the same
+    host reuse the TCP/TLS session instead of handshaking every time. The event loop runs
+    in a background thread so synchronous callers (Django views, Celery tasks) can submit
+    work without creating a new loop for every call.
+    """
+
+    def __init__(self, config=None, transport=None):
+        """
+        Args:
+            config: Optional dict overriding get_client_settings()
+            transport: Optional httpx transport (used by tests to avoid the network)
+        """
+        self.config = config or get_client_settings()
+        self.transport = transport
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._host_semaphores = {}
+
+        self._requests_total = 0
+        self._errors_total = 0
+        self._in_flight = 0
+        self._in_flight_by_host = defaultdict(int)
+
+    # Event loop management
+
+    def _start(self):
+        """
+        Start the background loop and client if they aren't running in this process.
+        Checking the pid means a forked worker (gunicorn, celery prefork) builds its own
+        instead of inheriting a dead thread from the parent.
+        """
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid():
+                return
+
+            self._pid = os.getpid()
+            self._host_semaphores = {}
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._loop.run_forever,
+                name='metadata-http-client',
+                daemon=True,
+            )
+            self._thread.start()
+            self._client = self._build_client()
+
+    def _build_client(self):
+        limits = httpx.Limits(
+            max_connections=self.config['MAX_CONNECTIONS'],
+            max_keepalive_connections=self.config['MAX_KEEPALIVE_CONNECTIONS'],
+            keepalive_expiry=self.config['KEEPALIVE_EXPIRY'],
+        )
+
+        kwargs = {
+            'timeout': self.config['TIMEOUT'],
+            'limits': limits,
+            'http2': self.config['HTTP2'] and _http2_available(),
+            'verify': get_ssl_context(self.config['VERIFY_SSL']),
+        }
+        if self.transport is not None:
+            kwargs['transport'] = self.transport
+
+        return httpx.AsyncClient(**kwargs)
+
+    @property
+    def loop(self):
+        self._start()
+        return self._loop
+
+    def run(self, coro):
+        """
+        Run a coroutine on the manager's loop and block until it finishes.
+        Used by synchronous code in place of asyncio.new_event_loop().
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return future.result()
+
+    def iterate(self, agen):
+        """
+        Iterate an async generator from synchronous code, running it on the manager's loop.
+        Items are handed over as soon as they're produced. Stopping early cancels the
+        generator, which lets it clean up its work.
+        """
+        items = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put((item, None))
+            except BaseException as e:
+                items.put((None, e))
+                raise
+            finally:
+                items.put((done, None))
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self.loop)
+        try:
+            while True:
+                item, error = items.get()
+                if error is not None:
+                    if isinstance(error, asyncio.CancelledError):
+                        break
+                    raise error
+                if item is done:
+                    break
+                yield item
+        finally:
+            future.cancel()
+
+    async def _on_own_loop(self, coro):
+        """
+        Await a coroutine on the manager's loop, even if the caller runs another loop.
+        The pooled client is bound to the loop it was created on.
+        """
+        loop = self.loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is loop:
+            return await coro
+
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def _host_semaphore(self, host):
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.config['MAX_CONNECTIONS_PER_HOST'])
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    # Requests
+
+    @asynccontextmanager
+    async def _track(self, url):
+        """
+        Hold the per-host slot and keep the counters reported by stats()
+        """
+        host = urlparse(url).netloc.lower()
+
+        async with self._host_semaphore(host):
+            self._requests_total += 1
+            self._in_flight += 1
+            self._in_flight_by_host[host] += 1
+            try:
+                yield
+            except Exception:
+                self._errors_total += 1
+                raise
+            finally:
+                self._in_flight -= 1
+                self._in_flight_by_host[host] -= 1
+                if not self._in_flight_by_host[host]:
+                    del self._in_flight_by_host[host]
+
+    async def _get(self, url, **kwargs):
+        async with self._track(url):
+            return await self._client.get(url, **kwargs)
+
+    async def get(self, url, **kwargs):
+        """
+        Send a GET request through the shared client, respecting the per-host limit
+        """
+        return await self._on_own_loop(self._get(url, **kwargs))
+
+    async def _stream(self, url, consume, **kwargs):
+        async with self._track(url):
+            async with self._client.stream('GET', url, **kwargs) as response:
+                return await consume(response)
+
+    async def stream(self, url, consume, **kwargs):
+        """
+        Send a GET request and hand the unread response to `await consume(response)`.
+
+        The response is closed as soon as consume returns, so it can stop reading
+        part way through and the rest of the body is never downloaded.
+
+        Returns:
+            Whatever consume returns
+        """
+        return await self._on_own_loop(self._stream(url, consume, **kwargs))
+
+    # Introspection
+
+    def stats(self):
+        """
+        Snapshot of pool usage, used to size the limits in settings.METADATA_HTTP_CLIENT
+        """
+        connections = []
+        if self._client is not None:
+            # httpx doesn't expose the pool publicly, so read it defensively
+            pool = getattr(getattr(self._client, '_transport', None), '_pool', None)
+            connections = list(getattr(pool, 'connections', []))
+
+        return {
+            'running': self._loop is not None and self._pid == os.getpid(),
+            'http2': bool(self._client is not None and self.config['HTTP2'] and _http2_available()),
+            'limits': {
+                'max_connections': self.config['MAX_CONNECTIONS'],
+                'max_keepalive_connections': self.config['MAX_KEEPALIVE_CONNECTIONS'],
+                'max_connections_per_host': self.config['MAX_CONNECTIONS_PER_HOST'],
+                'keepalive_expiry': self.config['KEEPALIVE_EXPIRY'],
+            },
+            'requests_total': self._requests_total,
+            'errors_total': self._errors_total,
+            'in_flight': self._in_flight,
+            'in_flight_by_host': dict(self._in_flight_by_host),
+            'connections_open': len(connections),
+            'connections_idle': sum(1 for conn in connections if conn.is_idle()),
+        }
+
+    def close(self):
+        """
+        Close the client and stop the background loop
+        """
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                return
+
+            try:
+                asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result(timeout=5)
+            except Exception:
+                logger.exception("Error closing metadata HTTP client")
+
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop.close()
+
+            self._loop = None
+            self._thread = None
+            self._client = None
+
+
+_client_manager = None
+_client_manager_lock = threading.Lock()
+
+
+def get_client_manager():
+    """
+    Return the process-wide client manager, creating it on first use
+    """
+    global _client_manager
+
+    if _client_manager is None:
+        with _client_manager_lock:
+            if _client_manager is None:
+                _client_manager = HTTPClientManager()
+                atexit.register(_client_manager.close)
+
+    return _client_manager
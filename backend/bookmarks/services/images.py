@@ -0,0 +1,351 @@
+# bookmarks/services/images.py
+import datetime
+import hashlib
+import io
+import ipaddress
+import logging
+import socket
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from ..models import ImageSource, StoredImage
+from .http_client import get_client_manager
+from .url_utils import hash_url
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable through settings.IMAGE_PROXY
+DEFAULT_PROXY_SETTINGS = {
+    'MAX_BYTES': 5 * 1024 * 1024,        # Larger downloads are abandoned
+    'MAX_PIXELS': 40_000_000,            # Guards against decompression bombs
+    'SOURCE_SIZE': 1024,                 # Longest side of the stored copy thumbnails are made from
+    'SIZES': (16, 32, 64, 128, 320, 640, 1024),
+    'DEFAULT_SIZES': {'preview': 320, 'favicon': 32},
+    'QUALITY': 80,
+    'RETRY_FAILED_AFTER': 24 * 60 * 60,
+    'TIMEOUT': 10,
+    'MAX_REDIRECTS': 5,
+}
+
+TOKEN_SALT = 'bookmarks.image-proxy'
+
+# Tried in order after the favicon URL the bookmark has, which may be a guess
+FAVICON_FALLBACK_PATHS = ('/favicon.ico', '/apple-touch-icon.png')
+
+
+class ImageFetchError(Exception):
+    """Raised when a remote image can't be downloaded or decoded"""
+
+
+def get_proxy_settings():
+    """
+    Merge the configured proxy settings over the defaults
+    """
+    config = dict(DEFAULT_PROXY_SETTINGS)
+    config.update(getattr(settings, 'IMAGE_PROXY', {}))
+    return config
+
+
+# Tokens
+
+def make_token(kind, url, host=None):
+    """
+    Signed reference to a remote image, so the proxy only fetches URLs this app handed out
+    """
+    value = [kind, url] if host is None else [kind, url, host]
+    return signing.dumps(value, salt=TOKEN_SALT)
+
+
+def read_token(token):
+    """
+    Returns:
+        (kind, url, host or None)
+
+    Raises:
+        signing.BadSignature for tokens this app didn't sign
+    """
+    value = signing.loads(token, salt=TOKEN_SALT)
+    kind, url, host = (value + [None])[:3]
+    if kind not in dict(ImageSource.KIND_CHOICES):
+        raise signing.BadSignature('Unknown image kind')
+    return kind, url, host
+
+
+def is_default_favicon(url, host):
+    parts = urlsplit(url)
+    return parts.hostname == host and parts.port is None and parts.path == '/favicon.ico' and not parts.query
+
+
+def source_key(kind, url, host=None):
+    """
+    Images are stored under the hash of their URL. A host's own /favicon.ico is keyed
+    by the host instead so its bookmarks share it, any other favicon URL is user
+    editable and only applies to the bookmarks that have it.
+    """
+    if kind == 'favicon' and host and is_default_favicon(url, host.lower()):
+        return host.lower()
+    return hash_url(url)
+
+
+# Storage layout
+
+def image_dir(content_hash):
+    return f'images/{content_hash[:2]}/{content_hash}'
+
+
+def source_path(content_hash):
+    return f'{image_dir(content_hash)}/source.webp'
+
+
+def thumbnail_path(content_hash, size):
+    return f'{image_dir(content_hash)}/{size}.webp'
+
+
+def pick_size(requested, kind, config=None):
+    """
+    Snap a requested size to the smallest configured size that covers it, so only a
+    handful of thumbnails exist per image
+    """
+    config = config or get_proxy_settings()
+    sizes = sorted(config['SIZES'])
+
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        return config['DEFAULT_SIZES'][kind]
+
+    for size in sizes:
+        if size >= requested:
+            return size
+    return sizes[-1]
+
+
+def _save(path, data):
+    # Another request may have written the same file in the meantime, keep theirs
+    saved = default_storage.save(path, ContentFile(data))
+    if saved != path:
+        default_storage.delete(saved)
+
+
+def _encode_webp(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, 'WEBP', quality=quality, method=4)
+    return buffer.getvalue()
+
+
+# Fetching
+
+def resolve_host(host, port):
+    return {info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)}
+
+
+def check_public(url):
+    """
+    Refuse URLs that resolve to loopback, link-local, private or otherwise reserved
+    addresses, the proxy is public and mustn't reach the internal network
+
+    Raises:
+        ImageFetchError
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ImageFetchError('Not an http(s) URL')
+
+    try:
+        addresses = resolve_host(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+    except (OSError, ValueError) as e:
+        raise ImageFetchError(f'Could not resolve {parts.hostname}: {e}')
+
+    if not all(is_public(address) for address in addresses):
+        raise ImageFetchError(f'{parts.hostname} resolves to a non public address')
+
+
+def is_public(address):
+    ip = ipaddress.ip_address(address.split('%')[0])
+    return ip.is_global and not ip.is_multicast
+
+
+def peer_address(response):
+    """
+    The address the response actually came from, None if the transport doesn't say
+    """
+    stream = response.extensions.get('network_stream')
+    server_addr = stream.get_extra_info('server_addr') if stream is not None else None
+    return server_addr[0] if server_addr else None
+
+
+async def _read_image(response, max_bytes):
+    # The client resolves the host again, or reuses a pooled connection, so the answer
+    # check_public saw may not be the one it connected to (DNS rebinding). Checked
+    # before anything is read.
+    address = peer_address(response)
+    if address is None or not is_public(address):
+        raise ImageFetchError(f'{response.url.host} connected to a non public address')
+
+    if response.is_redirect:
+        return None, urljoin(str(response.url), response.headers['location'])
+
+    if response.status_code != 200:
+        raise ImageFetchError(f'Request failed with status {response.status_code}')
+
+    content_type = response.headers.get('content-type', '').lower()
+    if content_type.startswith(('text/html', 'image/svg')):
+        # Error pages served with 200, and SVGs which can't be rasterized safely here
+        raise ImageFetchError(f'Not a raster image ({content_type})')
+
+    data = bytearray()
+    async for chunk in response.aiter_bytes():
+        data += chunk
+        if len(data) > max_bytes:
+            raise ImageFetchError('Image too large')
+    return bytes(data), None
+
+
+def download_image(url, config=None):
+    """
+    Download an image through the shared HTTP client, reading at most MAX_BYTES.
+    Redirects are followed here so every hop is checked by check_public.
+
+    Raises:
+        ImageFetchError
+    """
+    config = config or get_proxy_settings()
+    manager = get_client_manager()
+
+    for _ in range(config['MAX_REDIRECTS'] + 1):
+        check_public(url)
+        try:
+            data, url = manager.run(manager.stream(
+                url,
+                lambda response: _read_image(response, config['MAX_BYTES']),
+                timeout=config['TIMEOUT'],
+            ))
+        except ImageFetchError:
+            raise
+        except Exception as e:
+            raise ImageFetchError(str(e) or e.__class__.__name__)
+        if data is not None:
+            return data
+
+    raise ImageFetchError('Too many redirects')
+
+
+def store_image(data, config=None):
+    """
+    Decode downloaded bytes and store a WebP copy, unless the same content is already stored
+
+    Returns:
+        StoredImage
+
+    Raises:
+        ImageFetchError if the bytes aren't a usable image
+    """
+    config = config or get_proxy_settings()
+    content_hash = hashlib.sha256(data).hexdigest()
+
+    existing = StoredImage.objects.filter(content_hash=content_hash).first()
+    if existing is not None:
+        return existing
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.width * image.height > config['MAX_PIXELS']:
+            raise ImageFetchError('Image has too many pixels')
+        # ICO files hold several sizes, Pillow opens the largest
+        image = image.convert('RGBA')
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ImageFetchError(f'Unreadable image: {e}')
+
+    width, height = image.size
+    image.thumbnail((config['SOURCE_SIZE'], config['SOURCE_SIZE']))
+    _save(source_path(content_hash), _encode_webp(image, config['QUALITY']))
+
+    try:
+        stored, _ = StoredImage.objects.get_or_create(
+            content_hash=content_hash,
+            defaults={'width': width, 'height': height},
+        )
+    except IntegrityError:
+        stored = StoredImage.objects.get(content_hash=content_hash)
+    return stored
+
+
+def resolve_image(kind, url, host=None, config=None):
+    """
+    Return the StoredImage for a remote image, fetching it on first use.
+
+    Favicons fall back to /favicon.ico and /apple-touch-icon.png when the given URL
+    doesn't exist, and the default /favicon.ico is shared by every bookmark from the
+    host (see source_key). Failures are remembered for RETRY_FAILED_AFTER.
+
+    Returns:
+        StoredImage, or None if no image could be fetched
+    """
+    config = config or get_proxy_settings()
+    key = source_key(kind, url, host)
+    now = timezone.now()
+
+    source = ImageSource.objects.filter(kind=kind, key=key).select_related('image').first()
+    if source is not None:
+        retry_after = datetime.timedelta(seconds=config['RETRY_FAILED_AFTER'])
+        if source.image is not None or source.fetched_at > now - retry_after:
+            return source.image
+
+    candidates = [url]
+    if kind == 'favicon':
+        parts = urlsplit(url)
+        origin = f'{parts.scheme or "https"}://{host or parts.netloc}'
+        candidates += [origin + path for path in FAVICON_FALLBACK_PATHS]
+
+    image, error, fetched_from = None, None, url
+    for candidate in dict.fromkeys(candidates):
+        try:
+            image = store_image(download_image(candidate, config), config)
+        except ImageFetchError as e:
+            error = str(e)
+            continue
+        fetched_from, error = candidate, None
+        break
+
+    if error:
+        logger.info(f"Image proxy could not fetch {kind} {url}: {error}")
+
+    ImageSource.objects.update_or_create(
+        kind=kind,
+        key=key,
+        defaults={'url': fetched_from[:500], 'image': image, 'error': error and error[:255], 'fetched_at': now},
+    )
+    return image
+
+
+def get_thumbnail(content_hash, size, config=None):
+    """
+    Storage path of the WebP thumbnail fitting in size x size, generated on first request
+
+    Returns:
+        The path, or None if the image isn't stored
+    """
+    config = config or get_proxy_settings()
+    path = thumbnail_path(content_hash, size)
+    if default_storage.exists(path):
+        return path
+
+    source = source_path(content_hash)
+    if not default_storage.exists(source):
+        return None
+
+    with default_storage.open(source) as f:
+        image = Image.open(f)
+        image.load()
+
+    if max(image.size) > size:
+        image.thumbnail((size, size))
+    _save(path, _encode_webp(image, config['QUALITY']))
+    return path
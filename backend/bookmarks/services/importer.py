@@ -0,0 +1,341 @@
+# bookmarks/services/importer.py
+import codecs
+import json
+from html.parser import HTMLParser
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from ..models import Bookmark
+from ..serializers import BookmarkImportSerializer
+from ..signals import bookmark_tags_changed, bookmarks_updated
+from .metadata_extractor import extract_many_sync
+from .tags import normalize_tag_names, resolve_tags
+from .url_utils import hash_url
+from ..tasks import METADATA_FIELDS, enrich_bookmark_metadata, metadata_updates
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_METADATA_CONCURRENCY = 10
+CHUNK_SIZE = 64 * 1024
+
+
+# Parsing
+
+class NetscapeBookmarkParser(HTMLParser):
+    """
+    Incremental parser for the Netscape bookmark file format exported by browsers.
+
+    Each bookmark is a <DT><A HREF="..." TAGS="a,b">Title</A> optionally followed by a
+    <DD>description. Rows are collected in self.rows as they complete so the caller can
+    feed the file in chunks and drain rows without holding the whole document.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self._current = None
+        self._in_anchor = False
+        self._in_description = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self._finish_row()
+            attrs = dict(attrs)
+            tags = attrs.get('tags') or ''
+            self._current = {
+                'url': attrs.get('href') or '',
+                'title': '',
+                'description': '',
+                'tag_names': [name for name in tags.split(',') if name.strip()],
+            }
+            self._in_anchor = True
+        elif tag == 'dd' and self._current is not None:
+            self._in_description = True
+        elif tag in ('dt', 'dl', 'h3'):
+            # A new entry or folder ends the previous bookmark's description
+            self._finish_row()
+
+    def handle_endtag(self, tag):
+        if tag == 'a':
+            self._in_anchor = False
+        elif tag == 'dl':
+            self._finish_row()
+
+    def handle_data(self, data):
+        if self._current is None:
+            return
+        if self._in_anchor:
+            self._current['title'] += data
+        elif self._in_description:
+            self._current['description'] += data
+
+    def close(self):
+        super().close()
+        self._finish_row()
+
+    def pop_rows(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def _finish_row(self):
+        if self._current is not None:
+            self._current['title'] = self._current['title'].strip()
+            self._current['description'] = self._current['description'].strip()
+            self.rows.append(self._current)
+
+        self._current = None
+        self._in_anchor = False
+        self._in_description = False
+
+
+def iter_netscape_bookmarks(stream, chunk_size=CHUNK_SIZE):
+    """
+    Yield bookmark rows from a Netscape bookmark HTML file, reading it in chunks
+    """
+    parser = NetscapeBookmarkParser()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+
+        parser.feed(decoder.decode(chunk) if isinstance(chunk, bytes) else chunk)
+        yield from parser.pop_rows()
+
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    yield from parser.pop_rows()
+
+
+def iter_json_lines(stream):
+    """
+    Yield bookmark rows from a JSON lines file (one object per line).
+    Lines that aren't valid JSON are passed through as strings so they show up
+    as row errors in the report.
+    """
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield line.decode('utf-8', errors='replace') if isinstance(line, bytes) else line
+
+
+def iter_uploaded_bookmarks(upload):
+    """
+    Pick a parser for an uploaded file by sniffing its first non-blank character:
+    '<' is Netscape HTML, '[' is a JSON array and '{' is JSON lines.
+
+    JSON arrays have to be loaded whole, so large imports should use JSON lines or HTML.
+    """
+    head = upload.read(1024)
+    upload.seek(0)
+
+    first_char = head.lstrip()[:1]
+    if isinstance(first_char, bytes):
+        first_char = first_char.decode('ascii', errors='ignore')
+
+    if first_char == '<':
+        return iter_netscape_bookmarks(upload)
+    if first_char == '[':
+        return iter(json.load(upload))
+    if first_char == '{':
+        return iter_json_lines(upload)
+
+    raise ValueError("Unsupported file format. Upload a JSON or Netscape bookmark HTML file.")
+
+
+# Metadata
+
+def fetch_metadata_concurrently(urls, concurrency=DEFAULT_METADATA_CONCURRENCY):
+    """
+    Fetch metadata for many URLs at once, at most `concurrency` in flight.
+    URLs already in the metadata cache aren't fetched again.
+
+    Returns:
+        Dict mapping url to its extracted metadata
+    """
+    if not urls:
+        return {}
+
+    return dict(extract_many_sync(urls, concurrency=concurrency))
+
+
+# Import
+
+class BookmarkImporter:
+    """
+    Validates rows and writes them in batches.
+
+    Each batch costs a fixed number of queries regardless of its size: one to find
+    URLs the user already saved, one bulk insert for the bookmarks, up to three to
+    resolve tags and one bulk insert for the bookmark-tag rows.
+    """
+
+    def __init__(self, user, batch_size=DEFAULT_BATCH_SIZE, fetch_metadata=False,
+                 concurrency=DEFAULT_METADATA_CONCURRENCY):
+        """
+        Args:
+            user: Owner of the imported bookmarks
+            batch_size: Rows per bulk_create
+            fetch_metadata: Fetch metadata during the import instead of queueing enrichment tasks
+            concurrency: Max metadata fetches in flight when fetch_metadata is set
+        """
+        self.user = user
+        self.batch_size = batch_size
+        self.fetch_metadata = fetch_metadata
+        self.concurrency = concurrency
+        self._seen_hashes = set()
+
+    def run(self, rows):
+        """
+        Import an iterable of row dicts.
+
+        Returns:
+            List with one result dict per row, in input order
+        """
+        results = []
+        batch = []
+
+        for row_number, row in enumerate(rows, start=1):
+            serializer = BookmarkImportSerializer(data=row)
+
+            if not serializer.is_valid():
+                results.append({
+                    'row': row_number,
+                    'url': row.get('url') if isinstance(row, dict) else None,
+                    'status': 'error',
+                    'errors': serializer.errors,
+                })
+                continue
+
+            batch.append((row_number, serializer.validated_data))
+            if len(batch) >= self.batch_size:
+                results.extend(self._import_batch(batch))
+                batch = []
+
+        if batch:
+            results.extend(self._import_batch(batch))
+
+        # Invalid rows are reported straight away, valid ones once their batch is written
+        return sorted(results, key=lambda result: result['row'])
+
+    def _import_batch(self, batch):
+        results = {}
+
+        # Skip URLs the user already saved and repeats within this import, compared by
+        # canonical URL so http/https, www. and tracking parameter variants count
+        hashes = {row_number: hash_url(data['url']) for row_number, data in batch}
+        existing_hashes = set(
+            Bookmark.objects.filter(user=self.user, url_hash__in=set(hashes.values()))
+            .values_list('url_hash', flat=True)
+        )
+
+        pending = []
+        for row_number, data in batch:
+            url_hash = hashes[row_number]
+            if url_hash in existing_hashes or url_hash in self._seen_hashes:
+                results[row_number] = {'row': row_number, 'url': data['url'], 'status': 'duplicate'}
+                continue
+
+            self._seen_hashes.add(url_hash)
+            pending.append((row_number, data))
+
+        if not pending:
+            return [results[row_number] for row_number, _ in batch]
+
+        metadata = {}
+        if self.fetch_metadata:
+            metadata = fetch_metadata_concurrently(
+                [data['url'] for _, data in pending if self._needs_metadata(data)],
+                concurrency=self.concurrency,
+            )
+
+        rows = []
+        for row_number, data in pending:
+            data = dict(data)
+            tag_names = normalize_tag_names(data.pop('tag_names', []))
+            rows.append((row_number, data['url'], self._build_bookmark(data, metadata.get(data['url'])), tag_names))
+
+        created = []
+        while rows:
+            try:
+                created = self._write_batch(rows)
+                break
+            except IntegrityError:
+                # The URL was saved elsewhere after the check above. Only this batch's
+                # savepoint rolled back, report those rows as duplicates and retry the rest
+                saved = set(
+                    Bookmark.objects.filter(user=self.user, url_hash__in=[bookmark.url_hash for _, _, bookmark, _ in rows])
+                    .values_list('url_hash', flat=True)
+                )
+                if not saved:
+                    raise
+                for row_number, url, bookmark, _ in rows:
+                    if bookmark.url_hash in saved:
+                        results[row_number] = {'row': row_number, 'url': url, 'status': 'duplicate'}
+                rows = [row for row in rows if row[2].url_hash not in saved]
+
+        for (row_number, url, _, _), bookmark in zip(rows, created):
+            results[row_number] = {'row': row_number, 'url': url, 'status': 'created', 'id': bookmark.id}
+
+        return [results[row_number] for row_number, _ in batch]
+
+    def _write_batch(self, rows):
+        """
+        Insert a batch of built bookmarks with their tags, in a savepoint so a conflicting
+        row only rolls back this batch
+
+        Returns:
+            The created bookmarks, in row order
+        """
+        tag_names = [names for _, _, _, names in rows]
+        with transaction.atomic():
+            # bulk_create skips Bookmark.save(), the serializer has already validated each row
+            created = Bookmark.objects.bulk_create([bookmark for _, _, bookmark, _ in rows])
+
+            tags = resolve_tags(name for names in tag_names for name in names)
+            Through = Bookmark.tags.through
+            Through.objects.bulk_create([
+                Through(bookmark_id=bookmark.id, tag_id=tags[name].id)
+                for bookmark, names in zip(created, tag_names)
+                for name in names
+                if name in tags
+            ], ignore_conflicts=True)
+
+            bookmarks_updated.send(sender=Bookmark, bookmark_ids=[bookmark.id for bookmark in created])
+            tagged = [bookmark.id for bookmark, names in zip(created, tag_names) if names]
+            if tagged:
+                bookmark_tags_changed.send(sender=Bookmark, bookmark_ids=tagged)
+
+            queued = [bookmark.id for bookmark in created if bookmark.metadata_status == 'pending']
+            if queued:
+                transaction.on_commit(lambda: self._queue_enrichment(queued))
+
+        return created
+
+    def _needs_metadata(self, data):
+        return any(not data.get(field) for field in METADATA_FIELDS)
+
+    def _build_bookmark(self, data, metadata):
+        bookmark = Bookmark(user=self.user, **data)
+        bookmark.prepare()
+
+        if not self._needs_metadata(data):
+            bookmark.metadata_status = 'complete'
+        elif metadata is not None:
+            for field, value in metadata_updates(bookmark, metadata).items():
+                setattr(bookmark, field, value)
+
+            bookmark.metadata_status = 'failed' if metadata.get('error') else 'complete'
+            bookmark.metadata_error = metadata['error'][:255] if metadata.get('error') else None
+            bookmark.metadata_fetched_at = timezone.now()
+
+        return bookmark
+
+    def _queue_enrichment(self, bookmark_ids):
+        for bookmark_id in bookmark_ids:
+            enrich_bookmark_metadata.delay(bookmark_id)
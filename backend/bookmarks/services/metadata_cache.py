@@ -0,0 +1,226 @@
+# bookmarks/services/metadata_cache.py
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .url_utils import hash_url
+
+# Defaults, overridable through settings.METADATA_CACHE
+DEFAULT_CACHE_SETTINGS = {
+    'CACHE_ALIAS': 'metadata',
+    'TTL': 24 * 60 * 60,
+    'NEGATIVE_TTL': 5 * 60,
+    'LOCAL_MAX_ENTRIES': 1024,
+    'LOCAL_TTL': 60,
+}
+
+# Errors that depend only on the URL itself, they're cheap to recompute and never cached
+UNCACHED_ERRORS = {'Invalid URL format'}
+
+
+def get_cache_settings():
+    """
+    Merge the configured cache settings over the defaults
+    """
+    config = dict(DEFAULT_CACHE_SETTINGS)
+    config.update(getattr(settings, 'METADATA_CACHE', {}))
+    return config
+
+
+class MetadataCache:
+    """
+    Two level cache for extracted metadata, keyed by the canonical form of the URL.
+
+    Lookups go to a small in-process LRU first and then to the shared cache (Redis in
+    production), so the same popular URL is fetched once for all users and workers.
+    Failed fetches (timeouts, non-200 responses) are cached for NEGATIVE_TTL only, so a
+    broken site isn't hammered but recovers quickly. Local entries live at most LOCAL_TTL
+    seconds so deletes and refreshes in other processes show up soon.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_cache_settings()
+
+        self._lock = threading.Lock()
+        self._local = OrderedDict()
+        self._counters = {
+            'local_hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'negative_hits': 0,
+            'sets': 0,
+            'negative_sets': 0,
+        }
+
+    @property
+    def shared(self):
+        return caches[self.config['CACHE_ALIAS']]
+
+    def make_key(self, url):
+        return 'url:' + hash_url(url)
+
+    def ttl_for(self, metadata):
+        """
+        Seconds to keep a result for, or None if it shouldn't be cached
+        """
+        error = metadata.get('error')
+        if not error:
+            return self.config['TTL']
+        if error in UNCACHED_ERRORS:
+            return None
+        return self.config['NEGATIVE_TTL']
+
+    # Lookups
+
+    def get(self, url):
+        """
+        Return the cached metadata for url, or None on a miss
+        """
+        return self.get_many([url]).get(url)
+
+    def get_many(self, urls):
+        """
+        Look up several URLs with at most one round trip to the shared cache
+
+        Returns:
+            Dict mapping each url that was found to its metadata
+        """
+        found = {}
+        missing = {}
+
+        for url in urls:
+            key = self.make_key(url)
+            metadata = self._local_get(key)
+            if metadata is not None:
+                self._count_hit('local_hits', metadata)
+                found[url] = dict(metadata)
+            else:
+                missing.setdefault(key, []).append(url)
+
+        if missing:
+            shared = self.shared.get_many(list(missing))
+            for key, url_list in missing.items():
+                metadata = shared.get(key)
+                if metadata is None:
+                    self._count('misses', len(url_list))
+                    continue
+
+                self._local_set(key, metadata)
+                for url in url_list:
+                    self._count_hit('shared_hits', metadata)
+                    found[url] = dict(metadata)
+
+        return found
+
+    def set(self, url, metadata):
+        """
+        Store the result of a fetch, using the negative TTL for failures
+        """
+        ttl = self.ttl_for(metadata)
+        if ttl is None:
+            return
+
+        key = self.make_key(url)
+        self.shared.set(key, metadata, ttl)
+        self._local_set(key, dict(metadata), ttl)
+        self._count('negative_sets' if metadata.get('error') else 'sets')
+
+    def delete(self, url):
+        key = self.make_key(url)
+        self.shared.delete(key)
+        with self._lock:
+            self._local.pop(key, None)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    # Local LRU
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+
+            expires_at, metadata = entry
+            if expires_at <= time.monotonic():
+                del self._local[key]
+                return None
+
+            self._local.move_to_end(key)
+            return metadata
+
+    def _local_set(self, key, metadata, ttl=None):
+        ttl = min(ttl or self.config['LOCAL_TTL'], self.config['LOCAL_TTL'])
+        if metadata.get('error'):
+            ttl = min(ttl, self.config['NEGATIVE_TTL'])
+
+        with self._lock:
+            self._local[key] = (time.monotonic() + ttl, metadata)
+            self._local.move_to_end(key)
+            while len(self._local) > self.config['LOCAL_MAX_ENTRIES']:
+                self._local.popitem(last=False)
+
+    # Metrics
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _count_hit(self, name, metadata):
+        self._count(name)
+        if metadata.get('error'):
+            self._count('negative_hits')
+
+    def stats(self):
+        """
+        Hit/miss counters for this process, reported by the metadata_stats endpoint
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            local_entries = len(self._local)
+
+        lookups = counters['local_hits'] + counters['shared_hits'] + counters['misses']
+        hits = counters['local_hits'] + counters['shared_hits']
+
+        return {
+            **counters,
+            'lookups': lookups,
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+            'local_entries': local_entries,
+            'ttl': self.config['TTL'],
+            'negative_ttl': self.config['NEGATIVE_TTL'],
+        }
+
+
+_metadata_cache = None
+_metadata_cache_lock = threading.Lock()
+
+
+def get_metadata_cache():
+    """
+    Return the process-wide metadata cache, creating it on first use
+    """
+    global _metadata_cache
+
+    if _metadata_cache is None:
+        with _metadata_cache_lock:
+            if _metadata_cache is None:
+                _metadata_cache = MetadataCache()
+
+    return _metadata_cache
+
+
+@receiver(setting_changed)
+def reset_metadata_cache(setting, **kwargs):
+    # Pick up overridden settings in tests, and drop any locally cached entries with them
+    global _metadata_cache
+
+    if setting in ('CACHES', 'METADATA_CACHE'):
+        _metadata_cache = None
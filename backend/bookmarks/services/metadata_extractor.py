@@ -1,33 +1,75 @@
 # bookmarks/services/metadata_extractor.py
+import codecs
+import hashlib
+from contextlib import aclosing
 import httpx
 import logging
-from bs4 import BeautifulSoup
 from urllib.parse import urlparse
 import re
-from django.core.validators import URLValidator
-from django.core.exceptions import ValidationError
 import asyncio
-from typing import Dict, Any, Optional, Tuple
-import ssl
+from typing import Dict, Any, NamedTuple, Optional, Tuple
+
+from .fetch_state import record_fetch
+from .html_signals import get_parser_backend
+from .http_client import get_client_manager
+from .metadata_cache import get_metadata_cache
+from .url_utils import is_valid_url
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+
+class FetchResult(NamedTuple):
+    """
+    Outcome of MetadataExtractor.fetch along with the validators for the next conditional fetch
+    """
+    metadata: Optional[Dict[str, Any]]  # None when the page hasn't changed
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    content_length: int = 0
+
+    @property
+    def not_modified(self):
+        return self.metadata is None
+
+    def validators(self):
+        """
+        Values to store for the next fetch of the URL, None if there's nothing to store
+        """
+        if self.metadata is not None and self.metadata.get('error'):
+            return None
+        if not (self.etag or self.last_modified or self.content_hash):
+            return None
+
+        return {
+            'etag': (self.etag or '')[:255] or None,
+            'last_modified': (self.last_modified or '')[:64] or None,
+            'content_hash': self.content_hash,
+            'content_length': self.content_length,
+        }
+
 class MetadataExtractor:
     """
     Service for extracting metadata from URLs including title, description,
     preview image, favicon, and content type detection.
     """
     
-    def __init__(self, timeout = 10):
+    def __init__(self, timeout = 10, client_manager = None, max_bytes = None, parser_backend = None):
         """
         Initialize the extractor with configurable timeout.
         
         Args:
             timeout: Request timeout in seconds
+            client_manager: HTTPClientManager to send requests through (defaults to the shared one)
+            max_bytes: Stop reading the body after this many bytes (defaults to MAX_BODY_BYTES)
+            parser_backend: HTML parser backend name (defaults to settings.METADATA_PARSER_BACKEND)
         """
         self.timeout = timeout
-        self.url_validator = URLValidator()
+        self.client_manager = client_manager or get_client_manager()
+        self.parser_class = get_parser_backend(parser_backend)
+        self.max_bytes = max_bytes or self.client_manager.config['MAX_BODY_BYTES']
+        self.chunk_size = self.client_manager.config['CHUNK_SIZE']
     
     async def extract_metadata(self, url):
         """
@@ -39,113 +81,274 @@ class MetadataExtractor:
         Returns:
             Dictionary containing extracted metadata
         """
+        result = await self.fetch(url)
+        return result.metadata
+    
+    async def fetch(self, url, validators=None):
+        """
+        Fetch a URL and extract its metadata, conditionally when validators are given.
+        
+        Args:
+            url: The URL to extract metadata from
+            validators: Dict with the etag, last_modified, content_hash and content_length
+                of an earlier fetch (see FetchResult.validators)
+            
+        Returns:
+            FetchResult, whose metadata is None if the server answered 304 Not Modified or
+            the bytes the extractor reads hash the same as last time
+        """
+        validators = validators or {}
+        
         # Validate URL
-        try:
-            self.url_validator(url)
-        except ValidationError:
+        if not is_valid_url(url):
             logger.error(f"Invalid URL provided: {url}")
-            return {
+            return FetchResult({
                 'title': None,
                 'description': None,
                 'preview_image': None,
                 'favicon': None,
                 'content_type': None,
                 'error': 'Invalid URL format'
-            }
+            })
+        
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
         
         try:
-            # Create SSL context that ignores certificate errors for cases where sites have invalid certs
-            ssl_context = ssl.create_default_context()
-            ssl_context.check_hostname = False
-            ssl_context.verify_mode = ssl.CERT_NONE
+            # Stream the response through the shared, pooled client
+            return await self.client_manager.stream(
+                url,
+                lambda response: self._read_response(url, response, validators),
+                headers=headers,
+                follow_redirects=True,
+                timeout=self.timeout
+            )
             
-            # Use httpx for async HTTP requests with a timeout
-            async with httpx.AsyncClient(timeout=self.timeout, verify=ssl_context) as client: # set httpx.A... to client
-                # Asynch sends an HTTP request to the specified url using the client object.
-                response = await client.get(url, follow_redirects=True)
-                
-                if response.status_code != 200:
-                    logger.warning(f"Non-200 response ({response.status_code}) from URL: {url}")
-                    return {
-                        'title': None,
-                        'description': None,
-                        'preview_image': None,
-                        'favicon': None,
-                        'content_type': None,
-                        'error': f'Request failed with status {response.status_code}'
-                    }
-                
-                # Check content type from headers
-                content_type_header = response.headers.get('content-type', '').lower()
-                detected_type = self._detect_content_type(url, content_type_header)
-                
-                # For non-HTML content, return minimal metadata
-                if detected_type != 'article' and 'text/html' not in content_type_header:
-                    return {
-                        'title': self._extract_title_from_url(url),
-                        'description': None,
-                        'preview_image': None, 
-                        'favicon': self._get_favicon_from_domain(url),
-                        'content_type': detected_type
-                    }
-                
-                # Parse HTML content
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Extract metadata
-                title = self._extract_title(soup, url)
-                description = self._extract_description(soup)
-                preview_image = self._extract_preview_image(soup, url)
-                favicon = self._extract_favicon(soup, url)
-                
-                # Final content type detection with HTML content info
-                content_type = self._refine_content_type(detected_type, soup)
-                
-                return {
-                    'title': title,
-                    'description': description,
-                    'preview_image': preview_image,
-                    'favicon': favicon,
-                    'content_type': content_type
-                }
-                
         except httpx.TimeoutException:
             logger.warning(f"Request timed out for URL: {url}")
-            return {
+            return FetchResult({
                 'title': self._extract_title_from_url(url),
                 'description': None,
                 'preview_image': None,
                 'favicon': self._get_favicon_from_domain(url),
                 'content_type': None,
                 'error': 'Request timed out'
-            }
+            })
         except Exception as e:
             logger.exception(f"Error extracting metadata from {url}: {str(e)}")
-            return {
+            return FetchResult({
                 'title': self._extract_title_from_url(url),
                 'description': None,
                 'preview_image': None,
                 'favicon': self._get_favicon_from_domain(url),
                 'content_type': None,
                 'error': str(e)
-            }
+            })
     
-    def _extract_title(self, soup, url):
+    async def fetch_many(self, urls, validators=None, concurrency=None):
+        """
+        Fetch many URLs concurrently, yielding (url, FetchResult) as each one completes.
+        
+        At most `concurrency` fetches are in flight (BATCH_CONCURRENCY by default) and the
+        client manager's per-host semaphore keeps each site to MAX_CONNECTIONS_PER_HOST.
+        Tasks are only created as slots free up, so urls can be long or lazy. Repeated
+        URLs are fetched once.
+        
+        Args:
+            urls: Iterable of URLs
+            validators: Optional dict mapping url to the validators for a conditional fetch
+            concurrency: Max fetches in flight
+        """
+        validators = validators or {}
+        concurrency = concurrency or self.client_manager.config['BATCH_CONCURRENCY']
+        
+        urls = iter(urls)
+        seen = set()
+        pending = {}
+        
+        def start_next():
+            for url in urls:
+                if url not in seen:
+                    seen.add(url)
+                    pending[asyncio.ensure_future(self.fetch(url, validators.get(url)))] = url
+                    return True
+            return False
+        
+        try:
+            while len(pending) < concurrency and start_next():
+                pass
+            
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                finished = [(pending.pop(task), task.result()) for task in done]
+                
+                # Refill before handing results over, so slow consumers don't idle the slots
+                while len(pending) < concurrency and start_next():
+                    pass
+                
+                for item in finished:
+                    yield item
+        finally:
+            # The caller stopped early
+            for task in pending:
+                task.cancel()
+    
+    async def extract_many(self, urls, concurrency=None):
+        """
+        Extract metadata for many URLs concurrently, yielding (url, metadata) as each completes.
+        See fetch_many.
+        """
+        async with aclosing(self.fetch_many(urls, concurrency=concurrency)) as results:
+            async for url, result in results:
+                yield url, result.metadata
+    
+    async def _read_response(self, url, response, validators):
+        """
+        Build the metadata from a streamed response, reading as little of the body as possible
+        """
+        etag = response.headers.get('etag')
+        last_modified = response.headers.get('last-modified')
+        
+        if response.status_code == 304:
+            # Servers may leave the validators out of a 304, keep the ones we sent then
+            return FetchResult(
+                None,
+                etag=etag or validators.get('etag'),
+                last_modified=last_modified or validators.get('last_modified'),
+                content_hash=validators.get('content_hash'),
+                content_length=validators.get('content_length') or 0,
+            )
+        
+        if response.status_code != 200:
+            logger.warning(f"Non-200 response ({response.status_code}) from URL: {url}")
+            return FetchResult({
+                'title': None,
+                'description': None,
+                'preview_image': None,
+                'favicon': None,
+                'content_type': None,
+                'error': f'Request failed with status {response.status_code}',
+                'status_code': response.status_code
+            })
+        
+        # Check content type from headers
+        content_type_header = response.headers.get('content-type', '').lower()
+        detected_type = self._detect_content_type(url, content_type_header)
+        
+        # For non-HTML content, return minimal metadata without downloading the body
+        if detected_type != 'article' and 'text/html' not in content_type_header:
+            return FetchResult({
+                'title': self._extract_title_from_url(url),
+                'description': None,
+                'preview_image': None, 
+                'favicon': self._get_favicon_from_domain(url),
+                'content_type': detected_type
+            }, etag=etag, last_modified=last_modified)
+        
+        # Collect the page signals from the head, or as much of the page as the heuristics below need
+        signals, content_hash, content_length = await self._read_signals(
+            response, validators.get('content_hash'), validators.get('content_length') or 0
+        )
+        
+        if signals is None:
+            # Same bytes as last time, so the metadata would come out the same
+            return FetchResult(
+                None,
+                etag=etag,
+                last_modified=last_modified,
+                content_hash=content_hash,
+                content_length=content_length,
+            )
+        
+        # Extract metadata
+        title = self._extract_title(signals, url)
+        description = self._extract_description(signals)
+        preview_image = self._extract_preview_image(signals, url)
+        favicon = self._extract_favicon(signals, url)
+        
+        # Final content type detection with HTML content info
+        content_type = self._refine_content_type(detected_type, signals)
+        
+        return FetchResult({
+            'title': title,
+            'description': description,
+            'preview_image': preview_image,
+            'favicon': favicon,
+            'content_type': content_type
+        }, etag=etag, last_modified=last_modified, content_hash=content_hash, content_length=content_length)
+    
+    async def _read_signals(self, response, known_hash=None, known_length=0):
+        """
+        Parse the HTML up to max_bytes in a single pass, stopping early once the head is complete.
+
+        If the head has no description or preview image meta tags, parsing carries on
+        into the body so the <p> and <img> fallbacks have something to work with.
+
+        The bytes read are hashed. When known_hash is given, the first known_length bytes
+        are held back from the parser, and if they hash to known_hash the page is not
+        parsed at all. Parsing stops at the same byte for the same content, so this only
+        misses changes the extractor wouldn't have read.
+
+        Returns:
+            (PageSignals or None if unchanged, content hash, number of bytes hashed)
+        """
+        try:
+            decoder = codecs.getincrementaldecoder(response.charset_encoding or 'utf-8')(errors='replace')
+        except LookupError:
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        
+        parser = self.parser_class()
+        hasher = hashlib.sha256()
+        remaining = self.max_bytes
+        read = 0
+        held = [] if known_hash else None
+        
+        # aclosing finishes the byte iterator straight away when reading stops early
+        async with aclosing(response.aiter_bytes(chunk_size=self.chunk_size)) as chunks:
+            async for chunk in chunks:
+                chunk = chunk[:remaining]
+                remaining -= len(chunk)
+                read += len(chunk)
+                hasher.update(chunk)
+                
+                if held is not None:
+                    held.append(chunk)
+                    if read < known_length and remaining > 0:
+                        continue
+                    if read == known_length and hasher.hexdigest() == known_hash:
+                        return None, known_hash, read
+                    # Changed, parse what was held back and carry on as usual
+                    chunk, held = b''.join(held), None
+                
+                parser.feed(decoder.decode(chunk))
+                if parser.signals.complete or remaining <= 0:
+                    break
+        
+        if held:
+            # The body ended before known_length, so it changed
+            parser.feed(decoder.decode(b''.join(held)))
+        
+        parser.feed(decoder.decode(b'', final=True))
+        return parser.close(), hasher.hexdigest(), read
+    
+    def _extract_title(self, signals, url):
         """Extract page title from HTML"""
         # Try Open Graph title first
-        og_title = soup.find('meta', property='og:title')
-        if og_title and og_title.get('content'):
-            return og_title['content'].strip()
+        og_title = signals.meta_properties.get('og:title')
+        if og_title:
+            return og_title.strip()
         
         # Try Twitter card title
-        twitter_title = soup.find('meta', {'name': 'twitter:title'})
-        if twitter_title and twitter_title.get('content'):
-            return twitter_title['content'].strip()
+        twitter_title = signals.meta_names.get('twitter:title')
+        if twitter_title:
+            return twitter_title.strip()
         
         # Try HTML title tag
-        title_tag = soup.find('title')
-        if title_tag and title_tag.string:
-            return title_tag.string.strip()
+        if signals.title:
+            return signals.title.strip()
         
         # Fallback to URL-based title
         return self._extract_title_from_url(url)
@@ -168,80 +371,58 @@ class MetadataExtractor:
         domain = parsed_url.netloc
         return domain
     
-    def _extract_description(self, soup):
+    def _extract_description(self, signals):
         """Extract page description from HTML"""
         # Try Open Graph description
-        og_desc = soup.find('meta', property='og:description')
-        if og_desc and og_desc.get('content'):
-            return og_desc['content'].strip()
+        og_desc = signals.meta_properties.get('og:description')
+        if og_desc:
+            return og_desc.strip()
         
         # Try Twitter card description
-        twitter_desc = soup.find('meta', {'name': 'twitter:description'})
-        if twitter_desc and twitter_desc.get('content'):
-            return twitter_desc['content'].strip()
+        twitter_desc = signals.meta_names.get('twitter:description')
+        if twitter_desc:
+            return twitter_desc.strip()
         
         # Try meta description
-        meta_desc = soup.find('meta', {'name': 'description'})
-        if meta_desc and meta_desc.get('content'):
-            return meta_desc['content'].strip()
+        meta_desc = signals.meta_names.get('description')
+        if meta_desc:
+            return meta_desc.strip()
         
         # Try to extract from first paragraph
-        first_p = soup.find('p')
-        if first_p and first_p.text:
+        if signals.first_paragraph:
             # Limit to reasonable length
-            desc = first_p.text.strip()
+            desc = signals.first_paragraph.strip()
             return desc[:300] + ('...' if len(desc) > 300 else '')
         
         return None
     
-    def _extract_preview_image(self, soup, url):
+    def _extract_preview_image(self, signals, url):
         """Extract preview image URL from HTML"""
         # Try Open Graph image
-        og_img = soup.find('meta', property='og:image')
-        if og_img and og_img.get('content'):
-            return self._make_absolute_url(og_img['content'], url)
+        og_img = signals.meta_properties.get('og:image')
+        if og_img:
+            return self._make_absolute_url(og_img, url)
         
         # Try Twitter card image
-        twitter_img = soup.find('meta', {'name': 'twitter:image'})
-        if twitter_img and twitter_img.get('content'):
-            return self._make_absolute_url(twitter_img['content'], url)
-        
-        # Look for a large image in the page
-        main_img = None
-        min_size = 100  # Minimum dimensions to consider
-        
-        # Find images with width and height attributes
-        for img in soup.find_all('img', src=True):
-            width = img.get('width')
-            height = img.get('height')
-            
-            if width and height:
-                try:
-                    width, height = int(width), int(height)
-                    if width >= min_size and height >= min_size:
-                        main_img = img
-                        break
-                except (ValueError, TypeError):
-                    pass
+        twitter_img = signals.meta_names.get('twitter:image')
+        if twitter_img:
+            return self._make_absolute_url(twitter_img, url)
         
-        # If found, return the image URL
-        if main_img and main_img.get('src'):
-            return self._make_absolute_url(main_img['src'], url)
+        # The first image with width and height of at least MIN_IMAGE_SIZE
+        if signals.main_image:
+            return self._make_absolute_url(signals.main_image, url)
         
-        # Fallback: just get the first image of reasonable size
-        for img in soup.find_all('img', src=True):
-            if not img.get('src').endswith(('.ico', '.svg')) and 'logo' not in img.get('src').lower():
-                return self._make_absolute_url(img['src'], url)
+        # Fallback: the first image that doesn't look like an icon or logo
+        if signals.fallback_image is not None:
+            return self._make_absolute_url(signals.fallback_image, url)
         
         return None
     
-    def _extract_favicon(self, soup, url):
+    def _extract_favicon(self, signals, url):
         """Extract favicon URL from HTML"""
         # Check for link tags that specify favicon
-        for link in soup.find_all('link', rel=True):
-            if any(rel in link.get('rel') for rel in ['icon', 'shortcut icon']):
-                if link.get('href'):
-                    return self._make_absolute_url(link['href'], url)
+        if signals.favicon:
+            return self._make_absolute_url(signals.favicon, url)
         
         # Fallback to default favicon location
         return self._get_favicon_from_domain(url)
@@ -340,35 +521,30 @@ class MetadataExtractor:
         
         return 'unknown'
     
-    def _refine_content_type(self, initial_type, soup):
+    def _refine_content_type(self, initial_type, signals):
         """
         Refine content type detection using HTML content analysis
         """
         if initial_type != 'article' and initial_type != 'unknown':
             return initial_type
         
-        # Check for video embeds
-        video_elements = soup.find_all(['video', 'iframe'])
-        for video in video_elements:
-            # Check for common video platforms in iframes
-            if video.name == 'iframe' and video.get('src'):
-                src = video['src'].lower()
-                if any(platform in src for platform in ['youtube', 'vimeo', 'dailymotion']):
-                    return 'video'
-            
-            # Check for HTML5 video element
-            if video.name == 'video':
-                return 'video'
+        # Check for video embeds from common platforms and HTML5 video elements
+        if signals.has_video:
+            return 'video'
         
         # Check if the page seems to be primarily an image
-        if soup.find('meta', {'property': 'og:type', 'content': 'image'}):
+        if signals.og_type_image:
             return 'image'
         
+        # Video pages say so in the head, which matters when the body wasn't read
+        og_type = signals.meta_properties.get('og:type')
+        if og_type and og_type.lower().startswith('video'):
+            return 'video'
+        
         # Check if the page seems to be primarily social media content
-        social_meta = soup.find('meta', {'property': 'og:site_name'})
-        if social_meta and social_meta.get('content'):
-            site_name = social_meta['content'].lower()
-            if site_name in ['twitter', 'instagram', 'facebook', 'reddit', 'linkedin']:
+        site_name = signals.meta_properties.get('og:site_name')
+        if site_name:
+            if site_name.lower() in ['twitter', 'instagram', 'facebook', 'reddit', 'linkedin']:
                 return 'social'
         
         # Default to article for HTML content
@@ -391,12 +567,57 @@ async def extract_url_metadata(url):
 
 
 # For synchronous contexts (like Django views that aren't async)
-def extract_url_metadata_sync(url):
+def extract_url_metadata_sync(url, bypass_cache=False, validators=None):
     """
-    Synchronous wrapper for the async metadata extractor
+    Synchronous wrapper for the async metadata extractor.
+    Runs on the shared client's event loop rather than starting a new loop per call.
+
+    Results are cached by canonical URL (see metadata_cache). Pass bypass_cache=True
+    to always fetch, the fresh result still replaces the cached one.
+
+    Every fetch stores the response's validators (see fetch_state). Passing them back
+    as validators makes the fetch conditional, and None is returned if the page hasn't
+    changed since.
     """
-    loop = asyncio.new_event_loop()
-    try:
-        return loop.run_until_complete(extract_url_metadata(url))
-    finally:
-        loop.close()
\ No newline at end of file
+    cache = get_metadata_cache()
+
+    if not bypass_cache:
+        metadata = cache.get(url)
+        if metadata is not None:
+            return metadata
+
+    result = get_client_manager().run(MetadataExtractor().fetch(url, validators))
+    record_fetch(url, result, validators)
+
+    if result.not_modified:
+        return None
+
+    cache.set(url, result.metadata)
+    return result.metadata
+
+
+def extract_many_sync(urls, concurrency=None, bypass_cache=False):
+    """
+    Synchronous, batched extract_url_metadata_sync: yields (url, metadata) as results
+    become available, cache hits first and then fetches as they complete.
+
+    Fetches run concurrently on the shared client's loop (see MetadataExtractor.fetch_many),
+    their validators are stored and their results cached.
+    """
+    cache = get_metadata_cache()
+    urls = list(dict.fromkeys(urls))
+
+    missing = urls
+    if not bypass_cache:
+        cached = cache.get_many(urls)
+        yield from cached.items()
+        missing = [url for url in urls if url not in cached]
+
+    if not missing:
+        return
+
+    results = MetadataExtractor().fetch_many(missing, concurrency=concurrency)
+    for url, result in get_client_manager().iterate(results):
+        record_fetch(url, result)
+        cache.set(url, result.metadata)
+        yield url, result.metadata
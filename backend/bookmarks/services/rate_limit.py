@@ -0,0 +1,96 @@
+# bookmarks/services/rate_limit.py
+import logging
+import threading
+import time
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# Refill and take a token atomically. The clock is Redis' own so workers with skewed
+# clocks share one timeline. Returns the seconds to wait as a string, Lua numbers
+# would be truncated to integers.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """
+    Token bucket per key: up to `burst` takes at once, refilled at `rate` tokens a second.
+
+    Buckets live in Redis so every worker shares them. If the cache isn't Redis (tests)
+    or Redis is unreachable, each process falls back to its own buckets, which still
+    bounds the rate per worker.
+    """
+
+    def __init__(self, rate, burst, prefix='ratelimit', cache_alias='default'):
+        self.rate = rate
+        self.burst = burst
+        self.prefix = prefix
+        self.cache_alias = cache_alias
+
+        self._lock = threading.Lock()
+        self._local = {}
+        self._script = None
+
+    def take(self, key):
+        """
+        Take a token for key if one is available
+
+        Returns:
+            0 if a token was taken, otherwise the seconds until one will be
+        """
+        script = self._get_script()
+        if script is not None:
+            try:
+                return float(script(keys=[f'{self.prefix}:{key}'], args=[self.rate, self.burst]))
+            except RedisError as e:
+                logger.warning(f"Rate limiter falling back to local buckets: {e}")
+
+        return self._take_local(key)
+
+    def _get_script(self):
+        if self._script is None:
+            try:
+                connection = get_redis_connection(self.cache_alias)
+            except NotImplementedError:
+                # Not a django-redis cache
+                return None
+            self._script = connection.register_script(TOKEN_BUCKET_SCRIPT)
+        return self._script
+
+    def _take_local(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._local.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+
+            self._local[key] = (tokens, now)
+            return wait
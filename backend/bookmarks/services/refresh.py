@@ -0,0 +1,129 @@
+# bookmarks/services/refresh.py
+import datetime
+import threading
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.models import Case, Count, DateTimeField, F, FloatField, Max, Min, Q, Value, When
+from django.db.models.functions import Cast, Coalesce, Extract
+from django.dispatch import receiver
+from django.utils import timezone
+
+from ..models import Bookmark
+from .rate_limit import TokenBucket
+
+# Defaults, overridable through settings.METADATA_REFRESH
+DEFAULT_REFRESH_SETTINGS = {
+    'MAX_AGE': 7 * 24 * 60 * 60,             # Refresh complete metadata older than this
+    'FAILED_RETRY_AFTER': 24 * 60 * 60,      # Retry failed fetches after this long
+    'STUCK_AFTER': 60 * 60,                  # Pending bookmarks whose task was lost
+    'FAILED_PENALTY': 4,                     # Failed URLs rank this many times lower
+    'URLS_PER_SWEEP': 500,
+    'BATCH_SIZE': 25,
+    'DOMAIN_RATE': 0.5,                      # Fetches per second per domain, across workers
+    'DOMAIN_BURST': 3,
+    'MAX_DEFER': 10 * 60,                    # Rate limited URLs wait at most this, else the next sweep picks them up
+}
+
+
+def get_refresh_settings():
+    """
+    Merge the configured refresh settings over the defaults
+    """
+    config = dict(DEFAULT_REFRESH_SETTINGS)
+    config.update(getattr(settings, 'METADATA_REFRESH', {}))
+    return config
+
+
+def stale_filter(now=None, config=None):
+    """
+    Bookmarks due for a refresh: complete ones older than MAX_AGE, failed ones older
+    than FAILED_RETRY_AFTER and pending ones whose task never ran.
+
+    Complete bookmarks that were never fetched had all their metadata given by the
+    user and are left alone.
+    """
+    now = now or timezone.now()
+    config = config or get_refresh_settings()
+
+    def ago(seconds):
+        return now - datetime.timedelta(seconds=seconds)
+
+    return (
+        Q(metadata_status='complete', metadata_fetched_at__lt=ago(config['MAX_AGE']))
+        | Q(metadata_status='failed', metadata_fetched_at__lt=ago(config['FAILED_RETRY_AFTER']))
+        | Q(metadata_status__in=['pending', 'processing'], created_at__lt=ago(config['STUCK_AFTER']))
+    )
+
+
+def stale_urls(limit, now=None, config=None):
+    """
+    URLs with stale bookmarks, most urgent first.
+
+    A refresh is per canonical URL since one fetch updates every bookmark of it, from
+    any user and in any spelling. Priority is the age of the oldest stale bookmark
+    times how many stale bookmarks share the URL, divided by FAILED_PENALTY if its
+    last fetch failed.
+
+    Returns:
+        List of dicts with canonical_url, url (one of the saved spellings, the one
+        to fetch), bookmarks, oldest, failed and priority
+    """
+    now = now or timezone.now()
+    config = config or get_refresh_settings()
+
+    age = Extract(
+        Value(now, output_field=DateTimeField()) - Min(Coalesce('metadata_fetched_at', 'created_at')),
+        'epoch',
+    )
+    penalty = Value(1.0) + Value(config['FAILED_PENALTY'] - 1.0) * F('failed')
+
+    return list(
+        Bookmark.objects
+        .filter(stale_filter(now, config))
+        .values('canonical_url')
+        .annotate(
+            url=Min('url'),
+            bookmarks=Count('id'),
+            oldest=Min(Coalesce('metadata_fetched_at', 'created_at')),
+            failed=Max(Case(When(metadata_status='failed', then=Value(1)), default=Value(0))),
+        )
+        .annotate(priority=Cast(age, FloatField()) * F('bookmarks') / penalty)
+        .order_by('-priority', 'canonical_url')[:limit]
+    )
+
+
+def domain_of(url):
+    return (urlsplit(url).hostname or '').lower()
+
+
+_domain_limiter = None
+_domain_limiter_lock = threading.Lock()
+
+
+def get_domain_limiter():
+    """
+    Return the process-wide per-domain token bucket used by refresh sweeps
+    """
+    global _domain_limiter
+
+    if _domain_limiter is None:
+        with _domain_limiter_lock:
+            if _domain_limiter is None:
+                config = get_refresh_settings()
+                _domain_limiter = TokenBucket(
+                    config['DOMAIN_RATE'],
+                    config['DOMAIN_BURST'],
+                    prefix='refresh-domain',
+                )
+
+    return _domain_limiter
+
+
+@receiver(setting_changed)
+def reset_domain_limiter(setting, **kwargs):
+    global _domain_limiter
+
+    if setting in ('CACHES', 'METADATA_REFRESH'):
+        _domain_limiter = None
@@ -0,0 +1,155 @@
+# bookmarks/services/search.py
+import re
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db.models import Case, Exists, F, FloatField, OuterRef, Q, Value, When
+from django.db.models.functions import Greatest, Upper
+
+from ..models import Bookmark
+
+# Text search configuration used for the title and description parts of search_vector
+SEARCH_CONFIG = 'english'
+
+# Extra rank given to bookmarks whose tags match, tags aren't part of search_vector
+TAG_MATCH_BOOST = 0.1
+
+SEARCH_MODES = ('fts', 'fuzzy', 'basic', 'hybrid')
+
+TERM_RE = re.compile(r'\w+')
+
+
+def get_search_terms(text):
+    return TERM_RE.findall(text.lower())
+
+
+def build_search_query(text):
+    """
+    Build a tsquery that ANDs every word in text as a prefix match, so "djan rest"
+    matches "Django REST framework" while the user is still typing.
+
+    Only word characters are kept, which means user input can't inject tsquery syntax.
+
+    Returns:
+        SearchQuery, or None if text has no searchable words
+    """
+    terms = get_search_terms(text)
+    if not terms:
+        return None
+
+    raw_query = ' & '.join(f'{term}:*' for term in terms)
+    return SearchQuery(raw_query, search_type='raw', config=SEARCH_CONFIG)
+
+
+def highlights(query):
+    """
+    Annotations wrapping the matches of query in <mark> tags, in the title and a snippet
+    of the description. Postgres only evaluates them for the rows on the returned page.
+    """
+    return {
+        'title_highlight': SearchHeadline(
+            'title', query, config=SEARCH_CONFIG,
+            start_sel='<mark>', stop_sel='</mark>', highlight_all=True
+        ),
+        'description_highlight': SearchHeadline(
+            'description', query, config=SEARCH_CONFIG,
+            start_sel='<mark>', stop_sel='</mark>', max_words=35, min_words=15
+        ),
+    }
+
+
+def basic_search(queryset, text):
+    """
+    Substring search over title, description, url and tag names.
+    This is the original search path, kept for comparison with full text search.
+    """
+    # Match tags with EXISTS rather than a join, so no .distinct() is needed
+    tag_match = Bookmark.tags.through.objects.filter(
+        bookmark_id=OuterRef('pk'),
+        tag__name__icontains=text
+    )
+
+    return queryset.filter(
+        Q(title__icontains=text) |
+        Q(description__icontains=text) |
+        Q(url__icontains=text) |
+        Exists(tag_match)
+    ).order_by('-created_at', '-id')
+
+
+def full_text_search(queryset, text):
+    """
+    Ranked full text search using the GIN indexed search_vector column.
+
+    Results are annotated with `rank` and with `title_highlight` / `description_highlight`
+    snippets where matches are wrapped in <mark> tags. Snippets contain the raw stored
+    text, so clients must escape them before rendering as HTML.
+    """
+    query = build_search_query(text)
+    if query is None:
+        return queryset.none()
+
+    tag_terms = Q()
+    for term in get_search_terms(text):
+        tag_terms |= Q(tag__name__startswith=term)
+
+    tag_match = Exists(
+        Bookmark.tags.through.objects.filter(tag_terms, bookmark_id=OuterRef('pk'))
+    )
+
+    return (
+        queryset
+        .annotate(tag_match=tag_match)
+        .filter(Q(search_vector=query) | Q(tag_match=True))
+        .annotate(
+            rank=SearchRank(F('search_vector'), query) + Case(
+                When(tag_match=True, then=Value(TAG_MATCH_BOOST)),
+                default=Value(0.0),
+                output_field=FloatField(),
+            ),
+            **highlights(query),
+        )
+        .order_by('-rank', '-id')
+    )
+
+
+def fuzzy_search(queryset, text):
+    """
+    Typo tolerant search over title and url using pg_trgm.
+
+    Matches bookmarks whose title or url contains the text, or contains a word
+    similar enough to it (pg_trgm.word_similarity_threshold, set in DATABASES OPTIONS), ranked by the best
+    word similarity. Both checks are served by the UPPER(col) trigram indexes.
+    """
+    text = text.strip()
+
+    return (
+        queryset
+        .alias(title_upper=Upper('title'), url_upper=Upper('url'))
+        .filter(
+            Q(url__icontains=text) |
+            Q(title__icontains=text) |
+            Q(url_upper__trigram_word_similar=text) |
+            Q(title_upper__trigram_word_similar=text)
+        )
+        .annotate(rank=Greatest(
+            TrigramWordSimilarity(text, Upper('title')),
+            TrigramWordSimilarity(text, Upper('url')),
+        ))
+        .order_by('-rank', '-id')
+    )
+
+
+def search_bookmarks(queryset, text, mode='fts', user_id=None):
+    """
+    Search a bookmark queryset with the given mode (see SEARCH_MODES). Hybrid search
+    also needs the id of the user whose bookmarks these are, for their vector index.
+    """
+    if mode == 'hybrid':
+        # Imported here, recommendations builds on the bookmarks app
+        from recommendations.services.hybrid_search import hybrid_search
+        return hybrid_search(queryset, text, user_id)
+    if mode == 'basic':
+        return basic_search(queryset, text)
+    if mode == 'fuzzy':
+        return fuzzy_search(queryset, text)
+    return full_text_search(queryset, text)
@@ -0,0 +1,90 @@
+# bookmarks/services/tags.py
+from ..models import Bookmark, Tag
+from ..signals import bookmark_tags_changed
+
+
+def normalize_tag_names(tag_names):
+    """
+    Clean a list of tag names the same way the serializer does (strip + lowercase),
+    dropping blanks and duplicates while keeping the original order.
+    """
+    normalized = []
+    seen = set()
+
+    for tag_name in tag_names:
+        tag_name = tag_name.strip().lower()
+        if tag_name and tag_name not in seen:
+            seen.add(tag_name)
+            normalized.append(tag_name)
+
+    return normalized
+
+
+def resolve_tags(tag_names):
+    """
+    Get or create every tag in tag_names using a fixed number of queries.
+
+    Existing tags are fetched with a single name__in query, the missing ones are
+    inserted with one bulk_create and then read back (ignore_conflicts means
+    bulk_create can't return their ids, and another request may have created them).
+
+    Args:
+        tag_names: Iterable of tag names, normalized or not
+
+    Returns:
+        Dict mapping normalized tag name to Tag
+    """
+    names = normalize_tag_names(tag_names)
+    if not names:
+        return {}
+
+    tags = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+
+    missing = [name for name in names if name not in tags]
+    if missing:
+        Tag.objects.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+        tags.update({tag.name: tag for tag in Tag.objects.filter(name__in=missing)})
+
+    return tags
+
+
+def sync_bookmark_tags(bookmark, tag_names):
+    """
+    Make a bookmark's tags match tag_names, only touching the through rows that change.
+
+    Unchanged tag lists cost a single query (none if the tags were prefetched), and
+    additions and removals are each one bulk statement instead of a query per tag.
+
+    Args:
+        bookmark: Saved Bookmark instance
+        tag_names: Desired tag names, normalized or not
+    """
+    names = normalize_tag_names(tag_names)
+    Through = bookmark.tags.through
+
+    prefetched = getattr(bookmark, '_prefetched_objects_cache', {}).get('tags')
+    if prefetched is not None:
+        current = {tag.name: tag.id for tag in prefetched}
+    else:
+        current = dict(
+            Through.objects.filter(bookmark_id=bookmark.id).values_list('tag__name', 'tag_id')
+        )
+
+    to_add = [name for name in names if name not in current]
+    wanted = set(names)
+    to_remove = [tag_id for name, tag_id in current.items() if name not in wanted]
+
+    if to_add:
+        tags = resolve_tags(to_add)
+        Through.objects.bulk_create(
+            [Through(bookmark_id=bookmark.id, tag_id=tags[name].id) for name in to_add],
+            ignore_conflicts=True
+        )
+
+    if to_remove:
+        Through.objects.filter(bookmark_id=bookmark.id, tag_id__in=to_remove).delete()
+
+    if to_add or to_remove:
+        # Drop any prefetched tags so the response doesn't show the old set
+        getattr(bookmark, '_prefetched_objects_cache', {}).pop('tags', None)
+        bookmark_tags_changed.send(sender=Bookmark, bookmark_ids=[bookmark.id])
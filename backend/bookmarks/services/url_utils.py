@@ -0,0 +1,103 @@
+# bookmarks/services/url_utils.py
+import hashlib
+from functools import lru_cache
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+
+# Query parameters that only track where a click came from, they never change the page
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'gbraid', 'wbraid', 'msclkid', 'yclid', 'igshid',
+    'mc_cid', 'mc_eid', '_ga', '_gl', 'ref_src',
+}
+TRACKING_PREFIXES = ('utm_',)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Shared instance, URLValidator builds its regexes on first use
+_url_validator = URLValidator()
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonicalize_url(url):
+    """
+    Normalize a URL so different spellings of the same page compare equal.
+
+    Lowercases the host, treats http and https as the same, drops a leading "www.",
+    default ports, the fragment, a trailing slash and tracking parameters (utm_*,
+    fbclid, ...), and sorts the remaining query parameters. Path case is kept since
+    servers may treat it differently.
+
+    The result is a key for duplicate detection and per-URL data (metadata cache,
+    fetch state), not necessarily a URL that can be fetched.
+
+    Returns:
+        The canonical URL, or the stripped input if it can't be parsed
+    """
+    url = url.strip()
+
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+
+    scheme = parts.scheme.lower()
+    default_port = DEFAULT_PORTS.get(scheme)
+    if scheme == 'http':
+        scheme = 'https'
+
+    host = (parts.hostname or '').rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    if ':' in host:
+        # IPv6 literal, hostname strips the brackets
+        host = f'[{host}]'
+
+    netloc = host
+    if port is not None and port != default_port:
+        netloc = f'{netloc}:{port}'
+    if parts.username:
+        userinfo = parts.username + (f':{parts.password}' if parts.password else '')
+        netloc = f'{userinfo}@{netloc}'
+
+    query = sorted(
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not is_tracking_param(name)
+    )
+
+    path = parts.path.rstrip('/') or '/'
+
+    return urlunsplit((scheme, netloc, path, urlencode(query), ''))
+
+
+def hash_url(url):
+    """
+    sha256 hex digest of the canonical URL, a fixed size key for per-URL data
+    """
+    return hash_canonical_url(canonicalize_url(url))
+
+
+def hash_canonical_url(canonical_url):
+    """
+    hash_url for a URL that is already canonical
+    """
+    return hashlib.sha256(canonical_url.encode()).hexdigest()
+
+
+@lru_cache(maxsize=4096)
+def is_valid_url(url):
+    """
+    Same check as URLField, cached since refreshes and imports see the same URLs again
+    """
+    try:
+        _url_validator(url)
+    except ValidationError:
+        return False
+    return True
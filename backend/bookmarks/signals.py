@@ -0,0 +1,10 @@
+# bookmarks/signals.py
+from django.dispatch import Signal
+
+# Sent with bookmark_ids after writes that skip Bookmark.save() and so post_save:
+# bulk imports and metadata filled in with queryset updates
+bookmarks_updated = Signal()
+
+# Sent with bookmark_ids when tags were added to or removed from bookmarks, by
+# sync_bookmark_tags and bulk imports
+bookmark_tags_changed = Signal()
@@ -0,0 +1,267 @@
+# bookmarks/tasks.py
+import logging
+import math
+
+from celery import shared_task
+from django.db.models import Count, F, Min, Q, Value
+from django.db.models.functions import Coalesce, NullIf
+from django.utils import timezone
+
+from .models import Bookmark
+from .signals import bookmarks_updated
+from .services.fetch_state import get_validators_many, record_fetch
+from .services.http_client import get_client_manager
+from .services.metadata_cache import get_metadata_cache
+from .services.metadata_extractor import MetadataExtractor, extract_url_metadata_sync
+from .services.refresh import domain_of, get_domain_limiter, get_refresh_settings, stale_filter, stale_urls
+from .services.url_utils import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+# Fields the enrichment task is allowed to fill in
+METADATA_FIELDS = ('title', 'description', 'preview_image', 'favicon', 'content_type')
+
+
+class MetadataFetchError(Exception):
+    """Raised when a metadata fetch failed in a way that is worth retrying"""
+
+
+def is_retryable(metadata):
+    """
+    Decide whether a failed extraction should be retried.
+    Invalid URLs and 4xx responses won't change on a retry, timeouts and 5xx/429 might.
+    """
+    if metadata.get('error') == 'Invalid URL format':
+        return False
+
+    status_code = metadata.get('status_code')
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+
+    return True
+
+
+def metadata_updates(bookmark, metadata):
+    """
+    Work out which metadata values to copy onto a bookmark: only fields the user left
+    empty, truncating text that is too long and dropping URLs that wouldn't fit.
+    """
+    updates = {}
+
+    for field in METADATA_FIELDS:
+        value = metadata.get(field)
+        if not value or getattr(bookmark, field):
+            continue
+
+        max_length = Bookmark._meta.get_field(field).max_length
+        if max_length and len(value) > max_length:
+            if field in ('preview_image', 'favicon'):
+                continue
+            value = value[:max_length]
+
+        updates[field] = value
+
+    return updates
+
+
+def fill_empty(values):
+    """
+    update() expressions setting each field only where it's NULL or blank, so values
+    the user saved since the row was read are kept. A sweep updates every user's
+    bookmarks of a URL, it mustn't replace what they set either.
+    """
+    return {field: Coalesce(NullIf(F(field), Value('')), Value(value)) for field, value in values.items()}
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=(MetadataFetchError,),
+    max_retries=3,
+    retry_backoff=5,          # 5s, 10s, 20s ...
+    retry_backoff_max=300,
+    retry_jitter=True,
+)
+def enrich_bookmark_metadata(self, bookmark_id):
+    """
+    Fetch metadata for a bookmark and fill in any fields the user left empty.
+    Progress is recorded on bookmark.metadata_status so clients can poll it.
+    """
+    bookmark = Bookmark.objects.filter(pk=bookmark_id).first()
+    if bookmark is None:
+        # Deleted before the task ran
+        return None
+
+    Bookmark.objects.filter(pk=bookmark_id).update(metadata_status='processing')
+
+    # Retries skip the cache, it would only hand back the failure being retried
+    metadata = extract_url_metadata_sync(bookmark.url, bypass_cache=self.request.retries > 0)
+    error = metadata.get('error')
+
+    if error and is_retryable(metadata) and self.request.retries < self.max_retries:
+        logger.info(f"Retrying metadata fetch for bookmark {bookmark_id}: {error}")
+        raise MetadataFetchError(error)
+
+    # Only set values that aren't already provided. The fetch can take seconds, the
+    # conditional update keeps fields the user filled in meanwhile.
+    updates = metadata_updates(bookmark, metadata)
+
+    Bookmark.objects.filter(pk=bookmark_id).update(
+        **fill_empty(updates),
+        metadata_status='failed' if error else 'complete',
+        metadata_error=error[:255] if error else None,
+        metadata_fetched_at=timezone.now(),
+    )
+    if updates:
+        bookmarks_updated.send(sender=Bookmark, bookmark_ids=[bookmark_id])
+
+    return bookmark_id
+
+
+# Scheduled refresh
+
+def refreshed_values(metadata):
+    """
+    Values the refresh_metadata action overwrites: every field the page has a value
+    for, truncated to fit
+    """
+    values = {}
+
+    for field in METADATA_FIELDS:
+        value = metadata.get(field)
+        if not value:
+            continue
+
+        max_length = Bookmark._meta.get_field(field).max_length
+        if max_length and len(value) > max_length:
+            if field in ('preview_image', 'favicon'):
+                continue
+            value = value[:max_length]
+
+        values[field] = value
+
+    return values
+
+
+def refresh_urls(urls, limiter=None):
+    """
+    Refetch the given URLs and update their stale bookmarks.
+
+    URLs are skipped if another sweep got to them first, and deferred if their domain
+    is out of tokens. Fetches are conditional for URLs whose stale bookmarks all hold
+    the last fetched content, so unchanged pages only cost a 304 or a hash comparison
+    and a single UPDATE of metadata_fetched_at. Every write is its own short statement,
+    no transaction is held across the fetches.
+
+    Returns:
+        (counts dict, deferred urls, seconds until the first deferred url can go)
+    """
+    limiter = limiter or get_domain_limiter()
+    counts = {'refreshed': 0, 'unchanged': 0, 'failed': 0, 'skipped': 0, 'deferred': 0}
+
+    # Bookmarks are matched by canonical URL, each URL refreshes all its spellings
+    canonical = {url: canonicalize_url(url) for url in urls}
+    urls = list({key: url for url, key in canonical.items()}.values())
+
+    # Still stale? Bookmarks may have been refreshed since the sweep picked them
+    rows = (
+        Bookmark.objects
+        .filter(stale_filter(), canonical_url__in=set(canonical.values()))
+        .values('canonical_url')
+        .annotate(
+            fetched_at=Min('metadata_fetched_at'),
+            incomplete=Count('id', filter=~Q(metadata_status='complete')),
+        )
+    )
+    by_key = {row['canonical_url']: row for row in rows}
+    stale = {url: by_key[canonical[url]] for url in urls if canonical[url] in by_key}
+    counts['skipped'] = len(set(urls) - set(stale))
+
+    ready, deferred, wait = [], [], None
+    for url in stale:
+        delay = limiter.take(domain_of(url))
+        if delay:
+            deferred.append(url)
+            wait = delay if wait is None else min(wait, delay)
+        else:
+            ready.append(url)
+    counts['deferred'] = len(deferred)
+
+    if not ready:
+        return counts, deferred, wait
+
+    since = {url: stale[url]['fetched_at'] for url in ready if not stale[url]['incomplete']}
+    validators = get_validators_many(since)
+
+    now = timezone.now()
+    cache = get_metadata_cache()
+    unchanged, refreshed = [], []
+
+    # Bookmarks are updated as each fetch completes rather than after the slowest one
+    results = MetadataExtractor().fetch_many(ready, validators)
+    for url, result in get_client_manager().iterate(results):
+        record_fetch(url, result, validators.get(url))
+
+        if result.not_modified:
+            unchanged.append(url)
+            continue
+
+        metadata = result.metadata
+        error = metadata.get('error')
+        cache.set(url, metadata)
+
+        # Failed fetches still return values guessed from the URL, keep what's there
+        Bookmark.objects.filter(stale_filter(now), canonical_url=canonical[url]).update(
+            **({} if error else fill_empty(refreshed_values(metadata))),
+            metadata_status='failed' if error else 'complete',
+            metadata_error=error[:255] if error else None,
+            metadata_fetched_at=now,
+        )
+        counts['failed' if error else 'refreshed'] += 1
+        if not error:
+            refreshed.append(canonical[url])
+
+    if refreshed:
+        updated = Bookmark.objects.filter(canonical_url__in=refreshed, metadata_fetched_at=now)
+        bookmarks_updated.send(sender=Bookmark, bookmark_ids=list(updated.values_list('id', flat=True)))
+
+    if unchanged:
+        Bookmark.objects.filter(
+            stale_filter(now), canonical_url__in=[canonical[url] for url in unchanged],
+        ).update(metadata_fetched_at=now)
+        counts['unchanged'] = len(unchanged)
+
+    return counts, deferred, wait
+
+
+@shared_task
+def refresh_metadata_batch(urls):
+    """
+    Refresh one chunk of a sweep. URLs whose domain is rate limited are requeued for
+    when a token frees up, or left for the next sweep if that's too far off.
+    """
+    counts, deferred, wait = refresh_urls(urls)
+
+    if deferred:
+        if wait <= get_refresh_settings()['MAX_DEFER']:
+            refresh_metadata_batch.apply_async(args=[deferred], countdown=math.ceil(wait))
+        else:
+            logger.info(f"Leaving {len(deferred)} rate limited URLs for the next sweep")
+
+    return counts
+
+
+@shared_task
+def sweep_stale_metadata():
+    """
+    Celery beat job: queue refreshes for the most urgent stale URLs in small batches,
+    so no single task holds a worker for long.
+    """
+    config = get_refresh_settings()
+    urls = [row['url'] for row in stale_urls(config['URLS_PER_SWEEP'], config=config)]
+
+    batch_size = config['BATCH_SIZE']
+    for start in range(0, len(urls), batch_size):
+        refresh_metadata_batch.delay(urls[start:start + batch_size])
+
+    logger.info(f"Queued metadata refresh for {len(urls)} URLs")
+    return len(urls)
@@ -1,11 +1,40 @@
-from django.test import TestCase, RequestFactory
+from django.test import TestCase, TransactionTestCase, RequestFactory
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 from rest_framework_simplejwt.tokens import AccessToken
 from django.contrib.auth import get_user_model
-from .models import Bookmark, Tag
+from django.core import signing
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from .models import Bookmark, FetchState, ImageSource, StoredImage, Tag
 from .serializers import BookmarkSerializer, TagSerializer
+from .services.fetch_state import get_validators
+from .services.html_signals import available_backends, get_parser_backend, parse_page
+from .services.http_client import HTTPClientManager, get_ssl_context
+from .services.metadata_cache import MetadataCache, get_metadata_cache
+from .services.url_utils import canonicalize_url, hash_url, is_valid_url
+from .services.importer import BookmarkImporter, iter_netscape_bookmarks
+from .services.tags import resolve_tags, sync_bookmark_tags
+from .services.metadata_extractor import FetchResult, MetadataExtractor, extract_many_sync, extract_url_metadata_sync
+from .services.rate_limit import TokenBucket
+from .services.refresh import stale_urls
+from .tasks import enrich_bookmark_metadata, refresh_metadata_batch, refresh_urls, sweep_stale_metadata
+from pathlib import Path
+from PIL import Image
+from unittest.mock import Mock, patch
+import asyncio
+import datetime
+import httpx
+import io
 import json
+import shutil
+import tempfile
 
 # Create your tests here.
 User = get_user_model()
@@ -58,6 +87,18 @@ class BookmarkModelTest(TestCase):
                 user=self.user
             )
 
+    def test_save_without_full_clean(self):
+        # Only the INSERT, full_clean would also look up the user and the url_hash constraint
+        bookmark = Bookmark(url="http://www.example.com/page/", user=self.user)
+        with self.assertNumQueries(1):
+            bookmark.save(validate=False)
+        self.assertEqual(bookmark.canonical_url, "https://example.com/page")
+
+        # Bad URLs are still rejected
+        with self.assertRaises(ValidationError):
+            Bookmark(url="invalid-url", user=self.user).save(validate=False)
+        self.assertFalse(is_valid_url("invalid-url"))
+
 class TagSerializerTest(TestCase):
     def test_valid_tag_serializer(self):
         tag_data = {"name": "example"}
@@ -127,10 +168,22 @@ class BookmarkAPITest(APITestCase):
     def test_list_bookmarks(self):
         response = self.client.get("/api/bookmarks/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]["url"], "https://example.com")
-        self.assertEqual(len(response.data[0]["tags"]), 1)
-        self.assertEqual(response.data[0]["tags"][0]["name"], "example")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["url"], "https://example.com")
+        self.assertEqual(len(response.data["results"][0]["tags"]), 1)
+        self.assertEqual(response.data["results"][0]["tags"][0]["name"], "example")
+
+    def test_duplicate_urls_are_rejected(self):
+        self.assertEqual(self.bookmark.canonical_url, "https://example.com/")
+        self.assertEqual(self.bookmark.url_hash, hash_url("https://example.com"))
+
+        response = self.client.post("/api/bookmarks/", {"url": "http://www.example.com/"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("url", response.data)
+
+        # Saving a bookmark under its own URL is fine
+        response = self.client.patch(f"/api/bookmarks/{self.bookmark.id}/", {"url": "https://example.com/"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
 
     def test_update_bookmark_with_tags(self):
 
@@ -164,31 +217,31 @@ class BookmarkAPITest(APITestCase):
     def test_search_bookmarks(self):
         response = self.client.get("/api/bookmarks/search/?q=Example")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]["title"], "Example")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["title"], "Example")
         
         # Search by tag
         response = self.client.get("/api/bookmarks/search/?q=example")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data["results"]), 1)
         
     def test_filter_bookmarks_by_source(self):
         response = self.client.get("/api/bookmarks/?source=manual")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data["results"]), 1)
         
         response = self.client.get("/api/bookmarks/?source=reddit")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data["results"]), 0)
         
     def test_filter_bookmarks_by_tag(self):
         response = self.client.get("/api/bookmarks/?tag=example")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data["results"]), 1)
         
         response = self.client.get("/api/bookmarks/?tag=nonexistent")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data["results"]), 0)
         
     def test_bulk_delete_bookmarks(self):
         # Create a second bookmark
@@ -218,7 +271,1444 @@ class BookmarkAPITest(APITestCase):
         
         response = self.client.get("/api/bookmarks/by_tag/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertTrue("example" in response.data)
-        self.assertTrue("test" in response.data)
-        self.assertEqual(len(response.data["example"]), 1)
-        self.assertEqual(len(response.data["test"]), 1)
\ No newline at end of file
+        results = response.data["results"]
+        self.assertTrue("example" in results)
+        self.assertTrue("test" in results)
+        self.assertEqual(len(results["example"]["bookmarks"]), 1)
+        self.assertEqual(len(results["test"]["bookmarks"]), 1)
+        self.assertIsNone(response.data["next"])
+
+class HTTPClientManagerTest(TestCase):
+    def setUp(self):
+        self.requested_urls = []
+
+        def handler(request):
+            self.requested_urls.append(str(request.url))
+            return httpx.Response(200, html="<html><head><title>Mocked</title></head></html>")
+
+        self.manager = HTTPClientManager(transport=httpx.MockTransport(handler))
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_client_is_reused_across_calls(self):
+        self.manager.run(self.manager.get("https://example.com/a"))
+        client = self.manager._client
+        loop = self.manager._loop
+
+        self.manager.run(self.manager.get("https://example.com/b"))
+
+        self.assertIs(self.manager._client, client)
+        self.assertIs(self.manager._loop, loop)
+        self.assertEqual(len(self.requested_urls), 2)
+
+    def test_get_from_another_event_loop(self):
+        # Callers on their own loop are delegated to the manager's loop
+        response = asyncio.run(self.manager.get("https://example.com/"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_stats(self):
+        self.manager.run(self.manager.get("https://example.com/"))
+        stats = self.manager.stats()
+
+        self.assertTrue(stats["running"])
+        self.assertEqual(stats["requests_total"], 1)
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertEqual(stats["limits"]["max_connections_per_host"], self.manager.config["MAX_CONNECTIONS_PER_HOST"])
+
+    def test_extractor_uses_manager(self):
+        extractor = MetadataExtractor(client_manager=self.manager)
+        metadata = self.manager.run(extractor.extract_metadata("https://example.com/page"))
+
+        self.assertEqual(metadata["title"], "Mocked")
+        self.assertEqual(self.requested_urls, ["https://example.com/page"])
+
+    def test_ssl_context_is_cached(self):
+        self.assertIs(get_ssl_context(False), get_ssl_context(False))
+
+
+class MetadataStreamingTest(TestCase):
+    HEAD = (
+        '<html><head><title>Streamed</title>'
+        '<meta property="og:description" content="From the head">'
+        '<meta property="og:image" content="/cover.png">'
+        '</head><body>'
+    )
+
+    def setUp(self):
+        self.pages = {}
+        self.chunks_sent = 0
+        test = self
+
+        class Body(httpx.AsyncByteStream):
+            # Sends the page 1KB at a time and counts how much the extractor pulled
+            def __init__(self, content):
+                self.chunks = iter([content[start:start + 1024] for start in range(0, len(content), 1024)])
+
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                test.chunks_sent += 1
+                try:
+                    return next(self.chunks)
+                except StopIteration:
+                    raise StopAsyncIteration
+
+        def handler(request):
+            content_type, content = self.pages[request.url.path]
+            return httpx.Response(200, headers={"content-type": content_type}, stream=Body(content))
+
+        config = dict(HTTPClientManager().config, CHUNK_SIZE=1024)
+        self.manager = HTTPClientManager(config=config, transport=httpx.MockTransport(handler))
+        self.extractor = MetadataExtractor(client_manager=self.manager)
+
+    def tearDown(self):
+        self.manager.close()
+
+    def extract(self, path, content, content_type="text/html; charset=utf-8"):
+        self.pages[path] = (content_type, content.encode() if isinstance(content, str) else content)
+        return self.manager.run(self.extractor.extract_metadata(f"https://example.com{path}"))
+
+    def test_stops_after_head(self):
+        metadata = self.extract("/long", self.HEAD + "<p>filler</p>" * 50000 + "</body></html>")
+
+        self.assertEqual(metadata["title"], "Streamed")
+        self.assertEqual(metadata["description"], "From the head")
+        self.assertEqual(metadata["preview_image"], "https://example.com/cover.png")
+        self.assertLess(self.chunks_sent, 5)
+
+    def test_falls_back_to_body(self):
+        page = (
+            "<html><head><title>No meta</title></head><body>"
+            + "<div>spacer</div>" * 500
+            + '<p>First paragraph</p><img src="/photo.jpg" width="400" height="300"></body></html>'
+        )
+        metadata = self.extract("/plain", page)
+
+        self.assertEqual(metadata["description"], "First paragraph")
+        self.assertEqual(metadata["preview_image"], "https://example.com/photo.jpg")
+
+    def test_body_is_capped(self):
+        self.extractor.max_bytes = 4096
+        metadata = self.extract("/huge", "<html><head><title>Huge</title></head><body>" + "x" * 100000)
+
+        self.assertEqual(metadata["title"], "Huge")
+        self.assertLessEqual(self.chunks_sent, 5)
+
+    def test_large_inline_script_in_head(self):
+        page = self.HEAD.replace("</head>", "<script>" + "var a = 1;" * 20000 + "</script></head>")
+        metadata = self.extract("/spa", page + "<p>body</p>" * 20000)
+
+        self.assertEqual(metadata["description"], "From the head")
+        self.assertLess(self.chunks_sent, 250)
+
+    def test_non_html_body_is_not_read(self):
+        metadata = self.extract("/file.pdf", b"%PDF" + b"0" * 100000, content_type="application/pdf")
+
+        self.assertEqual(metadata["content_type"], "document")
+        self.assertLessEqual(self.chunks_sent, 1)
+
+
+class MetadataGoldenTest(TestCase):
+    """
+    Every parser backend must give the same metadata as the original BeautifulSoup
+    extractor, which produced testdata/metadata/expected.json
+    """
+    corpus = Path(__file__).parent / "testdata" / "metadata"
+
+    def test_matches_golden_files(self):
+        expected = json.loads((self.corpus / "expected.json").read_text())
+        extractor = MetadataExtractor(client_manager=HTTPClientManager())
+
+        for backend in available_backends():
+            for name, case in expected.items():
+                with self.subTest(backend=backend, page=name):
+                    signals = parse_page((self.corpus / name).read_text(), backend)
+                    url = case["url"]
+
+                    self.assertEqual({
+                        "title": extractor._extract_title(signals, url),
+                        "description": extractor._extract_description(signals),
+                        "preview_image": extractor._extract_preview_image(signals, url),
+                        "favicon": extractor._extract_favicon(signals, url),
+                        "content_type": extractor._refine_content_type("article", signals),
+                    }, case["metadata"])
+
+    def test_html_parser_nesting_matches_beautifulsoup(self):
+        # BeautifulSoup's html.parser tree keeps the first <p> open until its own </p>
+        signals = parse_page("<p>one<p>two</p>three</p>four<title>a<b>b</b></title>", "html.parser")
+
+        self.assertEqual(signals.first_paragraph, "onetwothree")
+        self.assertIsNone(signals.title)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_parser_backend("nope")
+
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "default"},
+    "metadata": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "metadata"},
+}
+
+
+class CanonicalizeUrlTest(TestCase):
+    def test_equivalent_urls_match(self):
+        canonical = canonicalize_url("https://example.com/page?a=1&b=2")
+        for url in (
+            "HTTPS://Example.COM:443/page?b=2&a=1",
+            "https://example.com/page?a=1&b=2#section",
+            "https://example.com/page?utm_source=x&a=1&fbclid=abc&b=2",
+            " https://example.com./page?a=1&b=2 ",
+            "http://www.example.com/page/?a=1&b=2",
+            "http://example.com:80/page?a=1&b=2",
+        ):
+            self.assertEqual(canonicalize_url(url), canonical)
+
+    def test_meaningful_differences_are_kept(self):
+        self.assertNotEqual(canonicalize_url("https://example.com/Page"), canonicalize_url("https://example.com/page"))
+        self.assertNotEqual(canonicalize_url("https://blog.example.com/"), canonicalize_url("https://example.com/"))
+        self.assertNotEqual(canonicalize_url("https://example.com/?page=2"), canonicalize_url("https://example.com/"))
+        self.assertEqual(canonicalize_url("http://example.com:8443"), "https://example.com:8443/")
+        self.assertEqual(canonicalize_url("http://www.example.com"), "https://example.com/")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MetadataCacheTest(APITestCase):
+    metadata = {"title": "Cached title", "description": "Cached description", "content_type": "article"}
+
+    def setUp(self):
+        self.cache = get_metadata_cache()
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.client.force_authenticate(user=self.user)
+        # Embeddings and tag learning are queued on commit too, there's no broker in tests
+        for target in ("recommendations.signals.enqueue_embeddings", "categorisation.signals.enqueue_tag_changes"):
+            patcher = patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        caches["metadata"].clear()
+        self.cache.clear_local()
+
+    def test_local_and_shared_hits(self):
+        cache = MetadataCache()
+        cache.set("https://example.com/a?utm_source=x", self.metadata)
+        self.assertEqual(cache.get("https://EXAMPLE.com/a"), self.metadata)
+
+        # Another process only has the shared cache
+        other = MetadataCache()
+        self.assertEqual(other.get("https://example.com/a"), self.metadata)
+        self.assertIsNone(other.get("https://example.com/b"))
+
+        stats = other.stats()
+        self.assertEqual((stats["shared_hits"], stats["misses"]), (1, 1))
+        self.assertEqual(cache.stats()["local_hits"], 1)
+
+    def test_ttls(self):
+        self.assertEqual(self.cache.ttl_for(self.metadata), self.cache.config["TTL"])
+        self.assertEqual(self.cache.ttl_for({"error": "Request timed out"}), self.cache.config["NEGATIVE_TTL"])
+        self.assertIsNone(self.cache.ttl_for({"error": "Invalid URL format"}))
+
+        self.cache.set("notaurl", {"error": "Invalid URL format"})
+        self.assertIsNone(self.cache.get("notaurl"))
+
+    def test_local_lru_is_bounded(self):
+        cache = MetadataCache(dict(self.cache.config, LOCAL_MAX_ENTRIES=2))
+        for i in range(3):
+            cache.set(f"https://example.com/{i}", self.metadata)
+        self.assertEqual(cache.stats()["local_entries"], 2)
+
+    @patch("bookmarks.services.metadata_extractor.MetadataExtractor.fetch")
+    def test_sync_extraction_is_cached(self, mock_extract):
+        mock_extract.return_value = FetchResult(dict(self.metadata))
+
+        extract_url_metadata_sync("https://example.com/page")
+        extract_url_metadata_sync("https://example.com/page#top")
+        self.assertEqual(mock_extract.call_count, 1)
+
+        extract_url_metadata_sync("https://example.com/page", bypass_cache=True)
+        self.assertEqual(mock_extract.call_count, 2)
+
+    @patch("bookmarks.views.enrich_bookmark_metadata.delay")
+    def test_create_uses_cached_metadata(self, mock_delay):
+        self.cache.set("https://example.com/popular", self.metadata)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/bookmarks/", {"url": "https://example.com/popular"}, format="json")
+
+        self.assertEqual(response.data["title"], "Cached title")
+        self.assertEqual(response.data["metadata_status"], "complete")
+        mock_delay.assert_not_called()
+
+    @patch("bookmarks.views.enrich_bookmark_metadata.delay")
+    def test_create_ignores_cached_failures(self, mock_delay):
+        self.cache.set("https://example.com/down", {"error": "Request timed out"})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/bookmarks/", {"url": "https://example.com/down"}, format="json")
+
+        self.assertEqual(response.data["metadata_status"], "pending")
+        mock_delay.assert_called_once()
+
+    @patch("bookmarks.views.extract_url_metadata_sync")
+    def test_refresh_bypass(self, mock_extract):
+        mock_extract.return_value = self.metadata
+        bookmark = Bookmark.objects.create(url="https://example.com/r", user=self.user)
+
+        self.client.post(f"/api/bookmarks/{bookmark.id}/refresh_metadata/")
+        mock_extract.assert_called_with(bookmark.url, bypass_cache=False, validators=None)
+
+        self.client.post(f"/api/bookmarks/{bookmark.id}/refresh_metadata/?bypass_cache=true")
+        mock_extract.assert_called_with(bookmark.url, bypass_cache=True, validators=None)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExtractManyTest(TestCase):
+    def setUp(self):
+        self.in_flight = 0
+        self.peak = 0
+        self.peak_by_host = {}
+        self.in_flight_by_host = {}
+
+        async def handler(request):
+            host = request.url.host
+            self.in_flight += 1
+            self.in_flight_by_host[host] = self.in_flight_by_host.get(host, 0) + 1
+            self.peak = max(self.peak, self.in_flight)
+            self.peak_by_host[host] = max(self.peak_by_host.get(host, 0), self.in_flight_by_host[host])
+
+            # Later paths answer sooner, so completion order differs from input order
+            await asyncio.sleep(0.05 - int(request.url.path.strip("/")) * 0.001)
+
+            self.in_flight -= 1
+            self.in_flight_by_host[host] -= 1
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/html"},
+                content=f"<html><head><title>{request.url}</title></head></html>".encode(),
+            )
+
+        config = dict(HTTPClientManager().config, MAX_CONNECTIONS_PER_HOST=2, BATCH_CONCURRENCY=5)
+        self.manager = HTTPClientManager(config=config, transport=httpx.MockTransport(handler))
+        self.extractor = MetadataExtractor(client_manager=self.manager)
+        self.urls = [f"https://host{i % 4}.example.com/{i}" for i in range(20)]
+
+    def tearDown(self):
+        self.manager.close()
+        caches["metadata"].clear()
+        get_metadata_cache().clear_local()
+
+    def test_bounded_concurrency(self):
+        results = list(self.manager.iterate(self.extractor.extract_many(self.urls + self.urls[:3])))
+
+        self.assertEqual(sorted(url for url, _ in results), sorted(self.urls))
+        self.assertTrue(all(metadata["title"] == url for url, metadata in results))
+        self.assertEqual(self.peak, 5)
+        self.assertLessEqual(max(self.peak_by_host.values()), 2)
+        self.assertNotEqual([url for url, _ in results], self.urls)
+
+    def test_stopping_early_cancels_the_rest(self):
+        for url, metadata in self.manager.iterate(self.extractor.extract_many(self.urls)):
+            break
+
+        self.manager.run(asyncio.sleep(0.1))
+        self.assertEqual(self.manager.stats()["in_flight"], 0)
+        self.assertLess(self.manager.stats()["requests_total"], len(self.urls))
+
+    def test_sync_adapter_uses_cache(self):
+        get_metadata_cache().set(self.urls[0], {"title": "Cached"})
+
+        with patch("bookmarks.services.metadata_extractor.get_client_manager", return_value=self.manager), \
+                patch("bookmarks.services.metadata_extractor.MetadataExtractor", return_value=self.extractor):
+            results = list(extract_many_sync(self.urls[:6]))
+
+        self.assertEqual(results[0], (self.urls[0], {"title": "Cached"}))
+        self.assertEqual(len(results), 6)
+        self.assertEqual(self.manager.stats()["requests_total"], 5)
+        self.assertEqual(FetchState.objects.count(), 5)
+        self.assertEqual(get_metadata_cache().get(self.urls[5])["title"], self.urls[5])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalRefreshTest(APITestCase):
+    PAGE = (
+        '<html><head><title>Versioned</title>'
+        '<meta property="og:description" content="Version {}">'
+        '<meta property="og:image" content="/cover.png">'
+        '</head><body>' + '<p>filler</p>' * 5000 + '</body></html>'
+    )
+
+    def setUp(self):
+        self.version = 1
+        self.honor_etag = True
+        self.requests = []
+
+        def handler(request):
+            self.requests.append(request)
+            etag = f'"v{self.version}"'
+            if self.honor_etag and request.headers.get("if-none-match") == etag:
+                return httpx.Response(304, headers={"etag": etag})
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/html; charset=utf-8", "etag": etag},
+                content=self.PAGE.format(self.version).encode(),
+            )
+
+        self.manager = HTTPClientManager(transport=httpx.MockTransport(handler))
+        patcher = patch("bookmarks.services.metadata_extractor.get_client_manager", return_value=self.manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.client.force_authenticate(user=self.user)
+        self.bookmark = Bookmark.objects.create(url="https://example.com/page", user=self.user)
+
+    def tearDown(self):
+        self.manager.close()
+        caches["metadata"].clear()
+        get_metadata_cache().clear_local()
+
+    def refresh(self):
+        return self.client.post(f"/api/bookmarks/{self.bookmark.id}/refresh_metadata/?bypass_cache=true")
+
+    def test_not_modified_skips_writes(self):
+        self.assertEqual(self.refresh().data["description"], "Version 1")
+        state = FetchState.objects.get()
+        self.assertEqual(state.etag, '"v1"')
+
+        updated_at = Bookmark.objects.get(pk=self.bookmark.pk).updated_at
+        with CaptureQueriesContext(connection) as queries:
+            self.refresh()
+
+        self.assertEqual(self.requests[-1].headers["if-none-match"], '"v1"')
+        self.assertEqual(Bookmark.objects.get(pk=self.bookmark.pk).updated_at, updated_at)
+        self.assertFalse([q for q in queries if q["sql"].startswith(("UPDATE", "INSERT"))])
+
+    def test_unchanged_hash_skips_parsing(self):
+        self.honor_etag = False
+        self.refresh()
+
+        with patch.object(get_parser_backend(), "feed") as mock_feed:
+            self.refresh()
+        mock_feed.assert_not_called()
+
+        self.version = 2
+        self.assertEqual(self.refresh().data["description"], "Version 2")
+        self.assertEqual(FetchState.objects.get().etag, '"v2"')
+
+    def test_failed_bookmark_is_not_conditional(self):
+        self.refresh()
+        Bookmark.objects.filter(pk=self.bookmark.pk).update(metadata_status="failed")
+
+        self.assertEqual(self.refresh().data["metadata_status"], "complete")
+        self.assertNotIn("if-none-match", self.requests[-1].headers)
+
+    def test_validators(self):
+        extractor = MetadataExtractor(client_manager=self.manager)
+        result = self.manager.run(extractor.fetch(self.bookmark.url))
+        validators = result.validators()
+
+        self.assertEqual(validators["etag"], '"v1"')
+        self.assertEqual(len(validators["content_hash"]), 64)
+        self.assertLess(validators["content_length"], len(self.PAGE))
+        self.assertTrue(self.manager.run(extractor.fetch(self.bookmark.url, validators)).not_modified)
+        self.assertIsNone(self.manager.run(extractor.fetch("not a url")).validators())
+
+        # Stored validators only apply to bookmarks that already have that content
+        extract_url_metadata_sync(self.bookmark.url, bypass_cache=True)
+        self.assertEqual(get_validators(self.bookmark.url)["etag"], '"v1"')
+        self.assertIsNone(get_validators(self.bookmark.url, since=timezone.now() - datetime.timedelta(days=1)))
+
+
+class TokenBucketTest(TestCase):
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_local_fallback(self):
+        bucket = TokenBucket(rate=1, burst=2)
+        self.assertEqual(bucket.take("example.com"), 0)
+        self.assertEqual(bucket.take("example.com"), 0)
+        self.assertGreater(bucket.take("example.com"), 0.5)
+
+        # Domains have their own buckets
+        self.assertEqual(bucket.take("other.com"), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MetadataSweepTest(TestCase):
+    def setUp(self):
+        self.requests = []
+
+        def handler(request):
+            self.requests.append(request)
+            if request.headers.get("if-none-match") == '"v1"':
+                return httpx.Response(304, headers={"etag": '"v1"'})
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/html; charset=utf-8", "etag": '"v1"'},
+                content=f"<html><head><title>Fresh {request.url.path}</title></head><body></body></html>".encode(),
+            )
+
+        self.manager = HTTPClientManager(transport=httpx.MockTransport(handler))
+        for target in ("bookmarks.tasks.get_client_manager", "bookmarks.services.metadata_extractor.get_client_manager"):
+            patcher = patch(target, return_value=self.manager)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.users = [
+            User.objects.create_user(username=f"user{i}", email=f"user{i}@example.com", password="testpass")
+            for i in range(3)
+        ]
+        self.now = timezone.now()
+
+    def tearDown(self):
+        self.manager.close()
+        caches["metadata"].clear()
+        get_metadata_cache().clear_local()
+
+    def bookmark(self, url, user=0, status="complete", days_ago=30):
+        bookmark = Bookmark.objects.create(url=url, user=self.users[user], title="Old title")
+        Bookmark.objects.filter(pk=bookmark.pk).update(
+            metadata_status=status,
+            metadata_fetched_at=self.now - datetime.timedelta(days=days_ago),
+            created_at=self.now - datetime.timedelta(days=days_ago),
+        )
+        return bookmark
+
+    def test_priority(self):
+        self.bookmark("https://a.example.com/popular", user=0, days_ago=10)
+        self.bookmark("http://a.example.com/popular/", user=1, days_ago=10)
+        self.bookmark("https://b.example.com/old", days_ago=15)
+        self.bookmark("https://c.example.com/failed", status="failed", days_ago=30)
+        self.bookmark("https://d.example.com/fresh", days_ago=1)
+        Bookmark.objects.create(url="https://e.example.com/user-provided", user=self.users[0])
+        Bookmark.objects.filter(url__contains="user-provided").update(
+            metadata_status="complete", created_at=self.now - datetime.timedelta(days=30)
+        )
+
+        urls = [row["canonical_url"] for row in stale_urls(10, now=self.now)]
+        self.assertEqual(urls, [
+            "https://a.example.com/popular",  # 2 x 10 days, counted across users and spellings
+            "https://b.example.com/old",      # 15 days
+            "https://c.example.com/failed",   # 30 days / 4
+        ])
+
+    def test_refresh_and_revalidate(self):
+        bookmark = self.bookmark("https://a.example.com/page")
+        untitled = self.bookmark("https://a.example.com/page", user=1)
+        Bookmark.objects.filter(pk=untitled.pk).update(title="")
+
+        counts, deferred, wait = refresh_urls([bookmark.url], limiter=TokenBucket(rate=1, burst=10))
+        self.assertEqual(counts["refreshed"], 1)
+        bookmark.refresh_from_db()
+        untitled.refresh_from_db()
+        # Only empty fields are filled in, titles users set are kept
+        self.assertEqual(bookmark.title, "Old title")
+        self.assertEqual(untitled.title, "Fresh /page")
+        self.assertEqual(bookmark.metadata_status, "complete")
+
+        # Fresh bookmarks are skipped, stale again ones are revalidated
+        counts, _, _ = refresh_urls([bookmark.url], limiter=TokenBucket(rate=1, burst=10))
+        self.assertEqual(counts["skipped"], 1)
+
+        Bookmark.objects.filter(pk=bookmark.pk).update(metadata_fetched_at=self.now - datetime.timedelta(days=30))
+        FetchState.objects.update(fetched_at=self.now - datetime.timedelta(days=31))
+        counts, _, _ = refresh_urls([bookmark.url], limiter=TokenBucket(rate=1, burst=10))
+        self.assertEqual(counts["unchanged"], 1)
+        self.assertEqual(self.requests[-1].headers["if-none-match"], '"v1"')
+        bookmark.refresh_from_db()
+        self.assertGreaterEqual(bookmark.metadata_fetched_at, self.now)
+
+    def test_timeout_keeps_metadata(self):
+        bookmark = self.bookmark("https://a.example.com/slow")
+        Bookmark.objects.filter(pk=bookmark.pk).update(favicon="https://a.example.com/icon.png")
+
+        def handler(request):
+            raise httpx.ReadTimeout("timed out", request=request)
+
+        manager = HTTPClientManager(transport=httpx.MockTransport(handler))
+        self.addCleanup(manager.close)
+        with patch("bookmarks.tasks.get_client_manager", return_value=manager), \
+                patch("bookmarks.services.metadata_extractor.get_client_manager", return_value=manager):
+            counts, _, _ = refresh_urls([bookmark.url], limiter=TokenBucket(rate=1, burst=10))
+
+        self.assertEqual(counts["failed"], 1)
+        bookmark.refresh_from_db()
+        self.assertEqual(bookmark.title, "Old title")
+        self.assertEqual(bookmark.favicon, "https://a.example.com/icon.png")
+        self.assertEqual(bookmark.metadata_status, "failed")
+        self.assertEqual(bookmark.metadata_error, "Request timed out")
+        self.assertGreaterEqual(bookmark.metadata_fetched_at, self.now)
+
+    @patch("bookmarks.tasks.refresh_metadata_batch.apply_async")
+    def test_rate_limited_domains_are_deferred(self, mock_apply_async):
+        for i in range(3):
+            self.bookmark(f"https://a.example.com/{i}")
+        self.bookmark("https://b.example.com/0")
+
+        with override_settings(METADATA_REFRESH={"DOMAIN_RATE": 0.1, "DOMAIN_BURST": 1}):
+            counts = refresh_metadata_batch.apply(args=[list(Bookmark.objects.values_list("url", flat=True))]).get()
+
+        self.assertEqual(counts["refreshed"], 2)
+        self.assertEqual(counts["deferred"], 2)
+        self.assertEqual(len(self.requests), 2)
+
+        deferred = mock_apply_async.call_args.kwargs["args"][0]
+        self.assertEqual(sorted(deferred), ["https://a.example.com/1", "https://a.example.com/2"])
+        self.assertLessEqual(mock_apply_async.call_args.kwargs["countdown"], 10)
+
+    @patch("bookmarks.tasks.refresh_metadata_batch.delay")
+    def test_sweep_queues_batches(self, mock_delay):
+        for i in range(5):
+            self.bookmark(f"https://example.com/{i}", days_ago=10 + i)
+
+        with override_settings(METADATA_REFRESH={"BATCH_SIZE": 2}):
+            self.assertEqual(sweep_stale_metadata.apply().get(), 5)
+
+        self.assertEqual([len(call.args[0]) for call in mock_delay.call_args_list], [2, 2, 1])
+        self.assertEqual(mock_delay.call_args_list[0].args[0][0], "https://example.com/4")
+
+    def test_command_dry_run(self):
+        self.bookmark("https://example.com/stale")
+        out = io.StringIO()
+        call_command("sweep_metadata", "--dry-run", stdout=out)
+        self.assertIn("https://example.com/stale", out.getvalue())
+        self.assertEqual(self.requests, [])
+
+
+class DedupeBookmarksTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.tags = resolve_tags(["python", "django"])
+
+    def legacy_duplicate(self, url, **fields):
+        # Saved before the unique constraint existed, so it never got a url_hash
+        bookmark = Bookmark.objects.create(url=f"https://placeholder.example.com/{url}", user=self.user, **fields)
+        Bookmark.objects.filter(pk=bookmark.pk).update(url=url, canonical_url=canonicalize_url(url), url_hash=None)
+        return bookmark
+
+    def test_report_and_merge(self):
+        keep = Bookmark.objects.create(url="https://example.com/page", user=self.user)
+        keep.tags.add(self.tags["python"])
+        duplicate = self.legacy_duplicate("http://www.example.com/page/", title="Page title")
+        duplicate.tags.add(self.tags["django"])
+        Bookmark.objects.create(url="https://example.com/other", user=self.user)
+
+        out = io.StringIO()
+        call_command("dedupe_bookmarks", stdout=out)
+        self.assertIn(f"https://example.com/page ({keep.id}, {duplicate.id})", out.getvalue())
+        self.assertEqual(Bookmark.objects.count(), 3)
+
+        call_command("dedupe_bookmarks", "--merge", stdout=io.StringIO())
+        self.assertFalse(Bookmark.objects.filter(pk=duplicate.pk).exists())
+        keep.refresh_from_db()
+        self.assertEqual(keep.title, "Page title")
+        self.assertEqual(sorted(tag.name for tag in keep.tags.all()), ["django", "python"])
+        self.assertEqual(keep.url_hash, hash_url(keep.url))
+
+        out = io.StringIO()
+        call_command("dedupe_bookmarks", stdout=out)
+        self.assertIn("No duplicate bookmarks", out.getvalue())
+
+    def test_legacy_duplicate_can_be_edited(self):
+        Bookmark.objects.create(url="https://example.com/page", user=self.user)
+        duplicate = self.legacy_duplicate("http://www.example.com/page/")
+
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.patch(f"/api/bookmarks/{duplicate.id}/", {"title": "Edited"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        duplicate.refresh_from_db()
+        self.assertEqual(duplicate.title, "Edited")
+        self.assertIsNone(duplicate.url_hash)
+
+        # Moving it to a URL of its own gives it a hash
+        response = client.patch(f"/api/bookmarks/{duplicate.id}/", {"url": "https://example.com/moved"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        duplicate.refresh_from_db()
+        self.assertEqual(duplicate.url_hash, hash_url("https://example.com/moved"))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ImageProxyTest(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.files = {}
+        self.redirects = {}
+        self.requests = []
+
+        def handler(request):
+            self.requests.append(str(request.url))
+            # The address the connection reached, which a rebinding host can make
+            # differ from the one resolved beforehand
+            address = self.peers.get(request.url.host, self.addresses.get(request.url.host, "93.184.215.14"))
+            extensions = {"network_stream": Mock(get_extra_info=lambda info: (address, 443))}
+            if str(request.url) in self.redirects:
+                return httpx.Response(302, headers={"location": self.redirects[str(request.url)]}, extensions=extensions)
+            if str(request.url) not in self.files:
+                return httpx.Response(404, extensions=extensions)
+            content_type, content = self.files[str(request.url)]
+            return httpx.Response(200, headers={"content-type": content_type}, content=content, extensions=extensions)
+
+        self.manager = HTTPClientManager(transport=httpx.MockTransport(handler))
+        self.addresses = {}
+        self.peers = {}
+        for target, kwargs in (
+            ("bookmarks.services.images.get_client_manager", {"return_value": self.manager}),
+            ("bookmarks.services.images.resolve_host", {"side_effect": lambda host, port: {self.addresses.get(host, "93.184.215.14")}}),
+        ):
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+
+    def tearDown(self):
+        self.manager.close()
+
+    def png(self, size=(800, 400), color="red"):
+        buffer = io.BytesIO()
+        Image.new("RGB", size, color).save(buffer, "PNG")
+        return buffer.getvalue()
+
+    def serialized(self, **fields):
+        bookmark = Bookmark.objects.create(user=self.user, **fields)
+        return BookmarkSerializer(bookmark).data
+
+    def test_preview_is_proxied_as_webp_thumbnail(self):
+        self.files["https://cdn.example.com/cover.png"] = ("image/png", self.png())
+        data = self.serialized(url="https://example.com/a", preview_image="https://cdn.example.com/cover.png")
+
+        # Public: <img> tags don't send the JWT
+        response = self.client.get(data["preview_image_proxy"] + "?size=300")
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertTrue(response["Location"].endswith("/320.webp"))
+
+        response = self.client.get(response["Location"])
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertIn("immutable", response["Cache-Control"])
+        image = Image.open(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual((image.format, image.size), ("WEBP", (320, 160)))
+
+        response = self.client.get(response.wsgi_request.path, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Fetched once
+        self.client.get(data["preview_image_proxy"])
+        self.assertEqual(self.requests, ["https://cdn.example.com/cover.png"])
+
+    def test_same_content_is_stored_once(self):
+        for name in ("a", "b"):
+            self.files[f"https://cdn.example.com/{name}.png"] = ("image/png", self.png())
+            data = self.serialized(url=f"https://example.com/{name}", preview_image=f"https://cdn.example.com/{name}.png")
+            self.client.get(data["preview_image_proxy"])
+
+        self.assertEqual(StoredImage.objects.count(), 1)
+        self.assertEqual(ImageSource.objects.count(), 2)
+
+    def test_favicons_are_shared_per_host(self):
+        self.files["https://example.com/favicon.ico"] = ("image/x-icon", self.png((32, 32)))
+        first = self.serialized(url="https://example.com/a", favicon="https://example.com/favicon.ico")
+        second = self.serialized(url="https://example.com/b")
+
+        self.assertEqual(self.client.get(first["favicon_proxy"]).status_code, status.HTTP_302_FOUND)
+        self.assertEqual(self.client.get(second["favicon_proxy"]).status_code, status.HTTP_302_FOUND)
+        self.assertEqual(self.requests, ["https://example.com/favicon.ico"])
+        self.assertEqual(ImageSource.objects.get().key, "example.com")
+
+    def test_custom_favicons_are_not_shared(self):
+        self.files["https://example.com/favicon.ico"] = ("image/x-icon", self.png((32, 32)))
+        self.files["https://evil.example.net/icon.png"] = ("image/png", self.png((32, 32), color="blue"))
+        custom = self.serialized(url="https://example.com/a", favicon="https://evil.example.net/icon.png")
+        default = self.serialized(url="https://example.com/b")
+
+        first = self.client.get(custom["favicon_proxy"])["Location"]
+        second = self.client.get(default["favicon_proxy"])["Location"]
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.requests, ["https://evil.example.net/icon.png", "https://example.com/favicon.ico"])
+
+        # A missing custom icon falls back to the host's, stored under its own key
+        fallback = self.serialized(url="https://example.com/c", favicon="https://example.com/missing-icon.png")
+        self.assertEqual(self.client.get(fallback["favicon_proxy"])["Location"], second)
+        self.assertEqual(ImageSource.objects.count(), 3)
+
+    def test_internal_addresses_are_refused(self):
+        self.addresses = {"internal.example.com": "10.0.0.5", "metadata.example.com": "169.254.169.254"}
+        self.files["https://internal.example.com/a.png"] = ("image/png", self.png())
+
+        data = self.serialized(url="https://example.com/a", preview_image="https://internal.example.com/a.png")
+        self.assertEqual(self.client.get(data["preview_image_proxy"]).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.requests, [])
+
+        # Redirects are checked too
+        self.redirects["https://cdn.example.com/redirect.png"] = "https://metadata.example.com/latest"
+        data = self.serialized(url="https://example.com/b", preview_image="https://cdn.example.com/redirect.png")
+        self.assertEqual(self.client.get(data["preview_image_proxy"]).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.requests, ["https://cdn.example.com/redirect.png"])
+        self.assertIn("non public", ImageSource.objects.get(key=hash_url("https://cdn.example.com/redirect.png")).error)
+
+    def test_rebound_hosts_are_refused(self):
+        # Resolves to a public address for the check, the connection then reaches an internal one
+        self.peers = {"rebind.example.com": "10.0.0.5"}
+        self.files["https://rebind.example.com/a.png"] = ("image/png", self.png())
+
+        data = self.serialized(url="https://example.com/a", preview_image="https://rebind.example.com/a.png")
+        self.assertEqual(self.client.get(data["preview_image_proxy"]).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(StoredImage.objects.count(), 0)
+        self.assertIn("non public", ImageSource.objects.get().error)
+
+    def test_failures_are_remembered(self):
+        self.files["https://example.com/icon.svg"] = ("image/svg+xml", b"<svg></svg>")
+        data = self.serialized(url="https://example.com/a", preview_image="https://example.com/icon.svg")
+
+        self.assertEqual(self.client.get(data["preview_image_proxy"]).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(data["preview_image_proxy"]).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_unsigned_urls_are_rejected(self):
+        token = signing.dumps(["preview", "https://internal.example.com/secret.png"])
+        self.assertEqual(self.client.get(f"/api/images/{token}/").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.requests, [])
+        self.assertEqual(self.client.get(f"/api/images/{'0' * 64}/17.webp").status_code, status.HTTP_404_NOT_FOUND)
+
+
+class MetadataStatsAPITest(APITestCase):
+    def test_requires_staff(self):
+        user = User.objects.create_user(username="testuser", password="testpass")
+        self.client.force_authenticate(user)
+        response = self.client.get("/api/bookmarks/metadata_stats/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get("/api/bookmarks/metadata_stats/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("http_pool", response.data)
+        self.assertIn("metadata_cache", response.data)
+
+
+class BookmarkEnrichmentTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.client.force_authenticate(self.user)
+        # Embeddings and tag learning are queued on commit too, there's no broker in tests
+        for target in ("recommendations.signals.enqueue_embeddings", "categorisation.signals.enqueue_tag_changes"):
+            patcher = patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch("bookmarks.views.enrich_bookmark_metadata.delay")
+    def test_create_returns_pending_and_queues_task(self, mock_delay):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/bookmarks/", {"url": "https://example.com"}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["metadata_status"], "pending")
+        mock_delay.assert_called_once_with(response.data["id"])
+
+    @patch("bookmarks.views.enrich_bookmark_metadata.delay")
+    def test_create_with_full_metadata_skips_task(self, mock_delay):
+        data = {
+            "url": "https://example.com",
+            "title": "Example",
+            "description": "Description",
+            "preview_image": "https://example.com/image.png",
+            "favicon": "https://example.com/favicon.ico",
+            "content_type": "article",
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/bookmarks/", data, format="json")
+
+        self.assertEqual(response.data["metadata_status"], "complete")
+        mock_delay.assert_not_called()
+
+    @patch("bookmarks.tasks.extract_url_metadata_sync")
+    def test_task_fills_missing_fields(self, mock_extract):
+        mock_extract.return_value = {
+            "title": "Fetched title",
+            "description": "Fetched description",
+            "preview_image": "https://example.com/image.png",
+            "favicon": "https://example.com/favicon.ico",
+            "content_type": "article",
+        }
+        bookmark = Bookmark.objects.create(url="https://example.com", title="My title", user=self.user)
+
+        enrich_bookmark_metadata.apply(args=[bookmark.id])
+
+        bookmark.refresh_from_db()
+        self.assertEqual(bookmark.title, "My title")  # User value is kept
+        self.assertEqual(bookmark.description, "Fetched description")
+        self.assertEqual(bookmark.favicon, "https://example.com/favicon.ico")
+        self.assertEqual(bookmark.metadata_status, "complete")
+        self.assertIsNotNone(bookmark.metadata_fetched_at)
+
+    @patch("bookmarks.tasks.extract_url_metadata_sync")
+    def test_task_keeps_fields_edited_during_the_fetch(self, mock_extract):
+        bookmark = Bookmark.objects.create(url="https://example.com", user=self.user)
+
+        def fetch(url, bypass_cache=False):
+            Bookmark.objects.filter(pk=bookmark.pk).update(title="My own title")
+            return {"title": "Fetched title", "description": "Fetched description"}
+
+        mock_extract.side_effect = fetch
+        enrich_bookmark_metadata.apply(args=[bookmark.id])
+
+        bookmark.refresh_from_db()
+        self.assertEqual(bookmark.title, "My own title")
+        self.assertEqual(bookmark.description, "Fetched description")
+        self.assertEqual(bookmark.metadata_status, "complete")
+
+    @patch("bookmarks.tasks.extract_url_metadata_sync")
+    def test_task_retries_then_fails(self, mock_extract):
+        mock_extract.return_value = {"title": "Example", "error": "Request timed out"}
+        bookmark = Bookmark.objects.create(url="https://example.com", user=self.user)
+
+        enrich_bookmark_metadata.apply(args=[bookmark.id])
+
+        bookmark.refresh_from_db()
+        self.assertEqual(mock_extract.call_count, enrich_bookmark_metadata.max_retries + 1)
+        self.assertEqual(bookmark.metadata_status, "failed")
+        self.assertEqual(bookmark.metadata_error, "Request timed out")
+        self.assertEqual(bookmark.title, "Example")
+
+    @patch("bookmarks.tasks.extract_url_metadata_sync")
+    def test_task_does_not_retry_client_errors(self, mock_extract):
+        mock_extract.return_value = {"error": "Request failed with status 404", "status_code": 404}
+        bookmark = Bookmark.objects.create(url="https://example.com", user=self.user)
+
+        enrich_bookmark_metadata.apply(args=[bookmark.id])
+
+        bookmark.refresh_from_db()
+        self.assertEqual(mock_extract.call_count, 1)
+        self.assertEqual(bookmark.metadata_status, "failed")
+
+
+NETSCAPE_EXPORT = b"""<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+<TITLE>Bookmarks</TITLE>
+<H1>Bookmarks</H1>
+<DL><p>
+    <DT><H3>Reading</H3>
+    <DL><p>
+        <DT><A HREF="https://example.com/one" ADD_DATE="1700000000" TAGS="python,django">First &amp; best</A>
+        <DD>The first bookmark
+        <DT><A HREF="https://example.com/two">Second</A>
+    </DL><p>
+    <DT><A HREF="not a url">Broken</A>
+</DL><p>
+"""
+
+
+class BookmarkImportTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.client.force_authenticate(self.user)
+        # Embeddings and tag learning are queued on commit too, there's no broker in tests
+        for target in ("recommendations.signals.enqueue_embeddings", "categorisation.signals.enqueue_tag_changes"):
+            patcher = patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_parse_netscape_in_small_chunks(self):
+        rows = list(iter_netscape_bookmarks(io.BytesIO(NETSCAPE_EXPORT), chunk_size=16))
+
+        self.assertEqual([row["url"] for row in rows], ["https://example.com/one", "https://example.com/two", "not a url"])
+        self.assertEqual(rows[0]["title"], "First & best")
+        self.assertEqual(rows[0]["description"], "The first bookmark")
+        self.assertEqual(rows[0]["tag_names"], ["python", "django"])
+        self.assertEqual(rows[1]["description"], "")
+
+    @patch("bookmarks.services.importer.enrich_bookmark_metadata.delay")
+    def test_import_netscape_file(self, mock_delay):
+        upload = SimpleUploadedFile("bookmarks.html", NETSCAPE_EXPORT, content_type="text/html")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/bookmarks/bulk_import/", {"file": upload}, format="multipart")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["created"], 2)
+        self.assertEqual(response.data["errors"], 1)
+        self.assertEqual([result["status"] for result in response.data["results"]], ["created", "created", "error"])
+
+        bookmark = Bookmark.objects.get(url="https://example.com/one")
+        self.assertEqual(bookmark.user, self.user)
+        self.assertEqual(sorted(tag.name for tag in bookmark.tags.all()), ["django", "python"])
+        self.assertEqual(bookmark.metadata_status, "pending")
+        self.assertEqual(mock_delay.call_count, 2)
+
+    @patch("bookmarks.services.importer.enrich_bookmark_metadata.delay")
+    def test_import_json_lines(self, mock_delay):
+        content = b'{"url": "https://example.com/a", "tag_names": ["x"]}\nnot json\n{"url": "https://example.com/b"}\n'
+        upload = SimpleUploadedFile("bookmarks.jsonl", content, content_type="application/json")
+
+        response = self.client.post("/api/bookmarks/bulk_import/", {"file": upload}, format="multipart")
+
+        self.assertEqual(response.data["created"], 2)
+        self.assertEqual(response.data["results"][1]["status"], "error")
+
+    @patch("bookmarks.services.importer.enrich_bookmark_metadata.delay")
+    def test_import_skips_duplicates(self, mock_delay):
+        Bookmark.objects.create(url="https://example.com/a", user=self.user)
+        data = {"bookmarks": [
+            {"url": "https://example.com/a"},
+            {"url": "https://example.com/b"},
+            {"url": "https://example.com/b"},
+            {"url": "http://www.example.com/a/?utm_source=feed"},
+        ]}
+
+        response = self.client.post("/api/bookmarks/bulk_import/", data, format="json")
+
+        self.assertEqual(
+            [result["status"] for result in response.data["results"]],
+            ["duplicate", "created", "duplicate", "duplicate"],
+        )
+        self.assertEqual(Bookmark.objects.filter(user=self.user).count(), 2)
+
+    @patch("bookmarks.services.importer.enrich_bookmark_metadata.delay")
+    def test_url_saved_during_the_import_is_a_duplicate(self, mock_delay):
+        build_bookmark = BookmarkImporter._build_bookmark
+
+        def saved_meanwhile(importer, data, metadata):
+            # Another request saves the URL between the duplicate check and the insert
+            if data["url"] == "https://example.com/c":
+                Bookmark.objects.create(url="https://example.com/c", user=self.user, title="Saved meanwhile")
+            return build_bookmark(importer, data, metadata)
+
+        rows = [{"url": f"https://example.com/{name}"} for name in "abcd"]
+        with patch.object(BookmarkImporter, "_build_bookmark", autospec=True, side_effect=saved_meanwhile):
+            results = BookmarkImporter(self.user, batch_size=2).run(rows)
+
+        self.assertEqual([result["status"] for result in results], ["created", "created", "duplicate", "created"])
+        self.assertEqual(Bookmark.objects.filter(user=self.user).count(), 4)
+        self.assertEqual(Bookmark.objects.get(url="https://example.com/c").title, "Saved meanwhile")
+
+    def test_batches_use_fixed_number_of_queries(self):
+        Tag.objects.create(name="existing")
+        rows = [
+            {
+                "url": f"https://example.com/{i}",
+                "title": f"Bookmark {i}",
+                "description": "Description",
+                "preview_image": "https://example.com/image.png",
+                "favicon": "https://example.com/favicon.ico",
+                "content_type": "article",
+                "tag_names": ["existing", f"new-{i % 3}"],
+            }
+            for i in range(50)
+        ]
+
+        # Duplicate check, bookmark insert, tag select, tag insert, tag reselect, through insert
+        # plus the savepoint for the atomic block
+        with self.assertNumQueries(8):
+            results = BookmarkImporter(self.user, batch_size=100).run(rows)
+
+        self.assertTrue(all(result["status"] == "created" for result in results))
+        self.assertEqual(Bookmark.tags.through.objects.count(), 100)
+
+    @patch("bookmarks.services.importer.fetch_metadata_concurrently")
+    def test_fetch_metadata_inline(self, mock_fetch):
+        mock_fetch.return_value = {"https://example.com/a": {"title": "Fetched", "content_type": "article"}}
+
+        results = BookmarkImporter(self.user, fetch_metadata=True).run([{"url": "https://example.com/a"}])
+
+        bookmark = Bookmark.objects.get(pk=results[0]["id"])
+        self.assertEqual(bookmark.title, "Fetched")
+        self.assertEqual(bookmark.metadata_status, "complete")
+
+
+class TagSyncTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.bookmark = Bookmark.objects.create(url="https://example.com", user=self.user)
+        Tag.objects.create(name="existing")
+
+    def tag_names(self):
+        return sorted(tag.name for tag in self.bookmark.tags.all())
+
+    def test_resolve_tags_creates_missing_in_bulk(self):
+        # Existing lookup, bulk insert of the missing names, lookup of the new rows
+        with self.assertNumQueries(3):
+            tags = resolve_tags(["Existing", " new ", "other", "new"])
+
+        self.assertEqual(sorted(tags), ["existing", "new", "other"])
+        self.assertEqual(Tag.objects.count(), 3)
+
+    def test_add_tags(self):
+        # Current tags, tag lookup, tag insert, tag reselect, through insert
+        with self.assertNumQueries(5):
+            sync_bookmark_tags(self.bookmark, ["existing", "one", "two", "three"])
+
+        self.assertEqual(self.tag_names(), ["existing", "one", "three", "two"])
+
+    def test_unchanged_tags_only_read(self):
+        sync_bookmark_tags(self.bookmark, ["existing", "one"])
+
+        with self.assertNumQueries(1):
+            sync_bookmark_tags(self.bookmark, ["One", "existing"])
+
+        self.assertEqual(self.tag_names(), ["existing", "one"])
+
+    def test_diff_only_touches_changed_rows(self):
+        sync_bookmark_tags(self.bookmark, ["existing", "one"])
+        kept_row = Bookmark.tags.through.objects.get(bookmark=self.bookmark, tag__name="existing")
+        Tag.objects.create(name="two")
+
+        # Current tags, tag lookup, through insert, through delete
+        with self.assertNumQueries(4):
+            sync_bookmark_tags(self.bookmark, ["existing", "two"])
+
+        self.assertEqual(self.tag_names(), ["existing", "two"])
+        self.assertTrue(Bookmark.tags.through.objects.filter(pk=kept_row.pk).exists())
+
+    def test_prefetched_tags_skip_the_read(self):
+        sync_bookmark_tags(self.bookmark, ["existing"])
+        bookmark = Bookmark.objects.prefetch_related("tags").get(pk=self.bookmark.pk)
+
+        with self.assertNumQueries(0):
+            sync_bookmark_tags(bookmark, ["existing"])
+
+    def test_serializer_update_without_tag_changes(self):
+        sync_bookmark_tags(self.bookmark, ["existing"])
+        serializer = BookmarkSerializer(self.bookmark, data={"tag_names": ["existing"]}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+        with CaptureQueriesContext(connection) as queries:
+            serializer.save()
+
+        # No tag rows are cleared and re-added when nothing changed
+        self.assertFalse(any("bookmarks_bookmark_tags" in query["sql"] and "DELETE" in query["sql"] for query in queries))
+        self.assertFalse(any("bookmarks_bookmark_tags" in query["sql"] and "INSERT" in query["sql"] for query in queries))
+
+
+class QueryCountRegressionTest(APITestCase):
+    """
+    Every read endpoint must run the same number of queries no matter how many
+    bookmarks and tags it returns.
+    """
+
+    ENDPOINTS = [
+        "/api/bookmarks/",
+        "/api/bookmarks/?tag=common",
+        "/api/bookmarks/search/?q=example",
+        "/api/bookmarks/by_tag/",
+        "/api/tags/",
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.client.force_authenticate(self.user)
+        self.count = 0
+
+    def add_bookmarks(self, count):
+        for _ in range(count):
+            self.count += 1
+            bookmark = Bookmark.objects.create(
+                url=f"https://example.com/{self.count}",
+                title=f"Example {self.count}",
+                user=self.user
+            )
+            sync_bookmark_tags(bookmark, ["common", f"tag-{self.count}"])
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_results(self):
+        self.add_bookmarks(2)
+        small = {url: self.count_queries(url) for url in self.ENDPOINTS}
+
+        self.add_bookmarks(20)
+        large = {url: self.count_queries(url) for url in self.ENDPOINTS}
+
+        self.assertEqual(small, large)
+
+    def test_retrieve_query_count(self):
+        self.add_bookmarks(1)
+        bookmark = Bookmark.objects.get()
+
+        # Bookmark and its prefetched tags
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/api/bookmarks/{bookmark.id}/")
+
+        self.assertEqual(len(response.data["tags"]), 2)
+
+
+class ByTagTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.client.force_authenticate(self.user)
+
+        # 5 bookmarks tagged "a", the first 3 also tagged "b", the first one also "c"
+        self.bookmarks = []
+        for i in range(5):
+            bookmark = Bookmark.objects.create(url=f"https://example.com/{i}", user=self.user)
+            sync_bookmark_tags(bookmark, ["a", "b", "c"][:3 if i == 0 else 2 if i < 3 else 1])
+            self.bookmarks.append(bookmark)
+
+        other = User.objects.create_user(username="other", email="other@example.com", password="testpass")
+        sync_bookmark_tags(Bookmark.objects.create(url="https://example.com/x", user=other), ["a", "z"])
+
+    def test_counts_only(self):
+        response = self.client.get("/api/bookmarks/by_tag/?counts_only=true")
+        self.assertEqual(response.data, {"a": 5, "b": 3, "c": 1})
+
+    def test_group_limit_keeps_newest(self):
+        response = self.client.get("/api/bookmarks/by_tag/?limit=2")
+        group = response.data["results"]["a"]
+
+        self.assertEqual(group["count"], 5)
+        self.assertEqual([bookmark["id"] for bookmark in group["bookmarks"]], [self.bookmarks[4].id, self.bookmarks[3].id])
+
+    def test_cursor_pagination(self):
+        response = self.client.get("/api/bookmarks/by_tag/?page_size=2")
+        self.assertEqual(list(response.data["results"]), ["a", "b"])
+        self.assertIsNotNone(response.data["next"])
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual(list(response.data["results"]), ["c"])
+        self.assertIsNone(response.data["next"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/bookmarks/by_tag/?cursor=_w")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_query_count_is_constant_in_tags(self):
+        # Tag page, ranked through rows, bookmarks, prefetched tags
+        with self.assertNumQueries(4):
+            self.client.get("/api/bookmarks/by_tag/")
+
+        for i in range(10):
+            sync_bookmark_tags(self.bookmarks[0], [f"extra-{i}"])
+
+        with self.assertNumQueries(4):
+            self.client.get("/api/bookmarks/by_tag/")
+
+
+class FullTextSearchTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.client.force_authenticate(self.user)
+
+        self.django = Bookmark.objects.create(
+            url="https://www.djangoproject.com/",
+            title="Django web framework",
+            description="The web framework for perfectionists with deadlines",
+            user=self.user
+        )
+        self.article = Bookmark.objects.create(
+            url="https://example.com/blog",
+            title="Running a blog",
+            description="Notes on deploying a Django app to production",
+            user=self.user
+        )
+        self.tagged = Bookmark.objects.create(url="https://example.com/other", title="Other", user=self.user)
+        sync_bookmark_tags(self.tagged, ["djangocon"])
+
+    def search(self, query, **params):
+        response = self.client.get("/api/bookmarks/search/", {"q": query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_ranks_title_matches_first(self):
+        data = self.search("django")
+        ids = [result["id"] for result in data["results"]]
+
+        self.assertEqual(ids[0], self.django.id)
+        self.assertEqual(set(ids), {self.django.id, self.article.id, self.tagged.id})
+        self.assertEqual(data["mode"], "fts")
+        self.assertIn("took_ms", data)
+
+    def test_prefix_matching(self):
+        data = self.search("fram")
+        self.assertEqual([result["id"] for result in data["results"]], [self.django.id])
+
+    def test_stemming(self):
+        data = self.search("run")
+        self.assertEqual([result["id"] for result in data["results"]], [self.article.id])
+
+    def test_highlight(self):
+        result = self.search("framework")["results"][0]
+        self.assertEqual(result["highlight"]["title"], "Django web <mark>framework</mark>")
+        self.assertIsNotNone(result["rank"])
+
+    def test_pagination(self):
+        data = self.search("django", page_size=2)
+        self.assertEqual(len(data["results"]), 2)
+        self.assertIsNotNone(data["next"])
+
+        second = self.client.get(data["next"]).data
+        self.assertEqual(len(second["results"]), 1)
+        self.assertIsNone(second["next"])
+        ids = [result["id"] for result in data["results"] + second["results"]]
+        self.assertEqual(len(set(ids)), 3)
+
+    def test_basic_mode(self):
+        data = self.search("deadlines", mode="basic")
+        self.assertEqual([result["id"] for result in data["results"]], [self.django.id])
+        self.assertIsNone(data["results"][0]["highlight"])
+
+    def test_unknown_mode(self):
+        response = self.client.get("/api/bookmarks/search/", {"q": "x", "mode": "nope"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_syntax_is_ignored(self):
+        data = self.search("django & | ! :*")
+        self.assertEqual(len(data["results"]), 3)
+
+    def test_other_users_bookmarks_are_hidden(self):
+        other = User.objects.create_user(username="other", email="other@example.com", password="testpass")
+        Bookmark.objects.create(url="https://example.com/django", title="Django", user=other)
+        self.assertEqual(len(self.search("django")["results"]), 3)
+
+
+class FuzzySearchTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.client.force_authenticate(self.user)
+
+        self.github = Bookmark.objects.create(
+            url="https://github.com/encode/httpx", title="HTTPX client", user=self.user
+        )
+        self.framework = Bookmark.objects.create(
+            url="https://example.com/docs", title="Web framework docs", user=self.user
+        )
+
+    def search(self, query):
+        response = self.client.get("/api/bookmarks/search/", {"q": query, "mode": "fuzzy"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [result["id"] for result in response.data["results"]]
+
+    def test_typo_in_url(self):
+        self.assertEqual(self.search("githib"), [self.github.id])
+
+    def test_typo_in_title(self):
+        self.assertEqual(self.search("framwork"), [self.framework.id])
+
+    def test_substring_of_url(self):
+        self.assertEqual(self.search("encode/ht"), [self.github.id])
+
+    def test_substring_lookups_use_trigram_index(self):
+        queryset = Bookmark.objects.filter(url__icontains="github").only("id")
+
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_seqscan = off")
+            try:
+                plan = queryset.explain()
+            finally:
+                cursor.execute("RESET enable_seqscan")
+
+        self.assertIn("bookmark_url_trgm_idx", plan)
+
+
+class ListIndexTest(TestCase):
+    def test_list_query_uses_composite_index(self):
+        user = User.objects.create_user(username="testuser", password="testpass")
+        Bookmark.objects.bulk_create([
+            Bookmark(url=f"https://example.com/{i}", user=user, source="twitter" if i % 20 == 0 else "web")
+            for i in range(200)
+        ])
+        queryset = Bookmark.objects.filter(user=user, source="twitter").order_by("-created_at")[:50]
+
+        with connection.cursor() as cursor:
+            # Statistics of these rows, not whatever earlier tests left, so the plan
+            # doesn't depend on the order tests run in
+            cursor.execute("ANALYZE bookmarks_bookmark")
+            cursor.execute("SET enable_seqscan = off")
+            try:
+                plan = queryset.explain()
+            finally:
+                cursor.execute("RESET enable_seqscan")
+
+        self.assertIn("bookmark_user_source_idx", plan)
+
+
+class KeysetPaginationTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.client.force_authenticate(user=self.user)
+
+        # Shared timestamps and NULL titles make sure ties and NULLs page correctly
+        now = timezone.now()
+        self.bookmarks = []
+        for i in range(7):
+            bookmark = Bookmark.objects.create(
+                url=f"https://example.com/{i}", title=None if i % 3 == 0 else f"Title {i % 2}", user=self.user
+            )
+            self.bookmarks.append(bookmark)
+        Bookmark.objects.filter(id__in=[b.id for b in self.bookmarks[:4]]).update(created_at=now)
+
+    def walk(self, url):
+        ids = []
+        while url:
+            data = self.client.get(url).data
+            ids.extend(result["id"] for result in data["results"])
+            url = data["next"]
+        return ids
+
+    def expected(self, *ordering):
+        return list(Bookmark.objects.filter(user=self.user).order_by(*ordering).values_list("id", flat=True))
+
+    def test_walks_every_bookmark_once(self):
+        self.assertEqual(self.walk("/api/bookmarks/?page_size=2"), self.expected("-created_at", "-id"))
+
+    def test_ordering_with_nulls(self):
+        self.assertEqual(self.walk("/api/bookmarks/?page_size=2&ordering=title"), self.expected("title", "id"))
+        self.assertEqual(self.walk("/api/bookmarks/?page_size=2&ordering=-title"), self.expected("-title", "-id"))
+
+    def test_previous_link(self):
+        first = self.client.get("/api/bookmarks/?page_size=3").data
+        self.assertIsNone(first["previous"])
+
+        second = self.client.get(first["next"]).data
+        back = self.client.get(second["previous"]).data
+        self.assertEqual(
+            [result["id"] for result in back["results"]],
+            [result["id"] for result in first["results"]]
+        )
+
+    def test_page_query_has_no_offset(self):
+        first = self.client.get("/api/bookmarks/?page_size=2").data
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(first["next"])
+
+        self.assertFalse(any("OFFSET" in query["sql"] for query in queries.captured_queries))
+
+    def test_tags_are_paginated(self):
+        for name in ("b", "a", "c"):
+            self.bookmarks[0].tags.add(Tag.objects.create(name=name))
+
+        data = self.client.get("/api/tags/?page_size=2").data
+        self.assertEqual([tag["name"] for tag in data["results"]], ["a", "b"])
+        self.assertEqual([tag["name"] for tag in self.client.get(data["next"]).data["results"]], ["c"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/bookmarks/?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BenchmarkCommandTest(TransactionTestCase):
+    # The command drops indexes inside its own transaction, which Postgres refuses
+    # while a TestCase transaction has pending foreign key checks
+
+    def test_benchmark_command_runs(self):
+        out = io.StringIO()
+        call_command("benchmark_bookmark_list", rows=200, users=2, iterations=1, stdout=out)
+
+        self.assertIn("list", out.getvalue())
+        self.assertEqual(Bookmark.objects.count(), 200)
+
+    def test_extractor_benchmark_runs(self):
+        out = io.StringIO()
+        call_command("benchmark_extractor", size=64 * 1024, iterations=1, batch=10, latency=0.001, stdout=out)
+
+        self.assertIn("streaming", out.getvalue())
+        self.assertIn("extract_many", out.getvalue())
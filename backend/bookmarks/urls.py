@@ -1,6 +1,6 @@
-from django.urls import path, include
+from django.urls import path, include, re_path
 from rest_framework.routers import DefaultRouter
-from .views import BookmarkViewSet, TagViewSet
+from .views import BookmarkViewSet, TagViewSet, image_content, image_proxy
 
 # DRF router to automatically generate RESTful routes for the viewset
 router = DefaultRouter()
@@ -9,22 +9,34 @@ router.register(r'tags', TagViewSet, basename='tag') # register under tags/ endp
 
 urlpatterns = [
     path('', include(router.urls)),  # Includes all viewset routes
+    re_path(r'^images/(?P<content_hash>[0-9a-f]{64})/(?P<size>[0-9]+)\.webp$', image_content, name='image-content'),
+    path('images/<str:token>/', image_proxy, name='image-proxy'),
 ]
 
 """
 GENERATED ENDPOINTS (prepended by /api/):
 
 Bookmark Endpoints:
-GET /bookmarks/ - Lists bookmarks
+GET /bookmarks/ - Lists bookmarks (cursor paginated, follow "next"/"previous", ?page_size=, ?ordering=, ?topic=)
 POST /bookmarks/ - Create bookmark
 GET /bookmarks/{id} - Get bookmark
 PUT/PATCH /bookmarks/{id} - Update bookmark
 DELETE /bookmarks/{id} - Delete bookmark
-GET /bookmarks/search/?q=keyword - Search bookmarks
+GET /bookmarks/{id}/similar/ - Bookmarks closest in meaning (?limit=)
+GET /bookmarks/{id}/suggested_tags/ - Tags the user's classifier suggests (also returned as suggested_tags on create)
+POST /bookmarks/{id}/refresh_metadata/ - Refetch metadata, conditionally if unchanged (?bypass_cache=true skips the metadata cache)
+GET /bookmarks/search/?q=keyword - Search bookmarks (?mode=fts|fuzzy|basic|hybrid, ?cursor=, ?page_size=)
 POST /bookmarks/bulk_delete/ - Delete multiple bookmarks
-GET /bookmarks/by_tag/ - Get bookmarks grouped by tag
+POST /bookmarks/bulk_import/ - Import bookmarks from JSON or a Netscape bookmark HTML file
+GET /bookmarks/by_tag/ - Get bookmarks grouped by tag (?limit=, ?page_size=, ?cursor=, ?counts_only=true)
+GET /bookmarks/topics/ - Bookmarks grouped into labelled topics (?limit=), list one with /bookmarks/?topic={id}
+GET /bookmarks/metadata_stats/ - Metadata HTTP client pool and cache stats (staff only)
+
+Image proxy (public, bookmarks link to it in preview_image_proxy and favicon_proxy):
+GET /images/{signed token}/?size=64 - Fetch and store the image once, redirect to its thumbnail
+GET /images/{content hash}/{size}.webp - WebP thumbnail, cached forever
 
 Tag Endpoints:
-GET /tags/ - Lists tags used by the current user
+GET /tags/ - Lists tags used by the current user (cursor paginated by name)
 GET /tags/{id} - Get specific tag
 """
@@ -1,19 +1,52 @@
 from rest_framework import viewsets, permissions, status, filters # Viewset provides built in CRUD
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser, MultiPartParser
 from django_filters.rest_framework import DjangoFilterBackend
 
 from .models import Bookmark, Tag
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Count, F, Prefetch, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
 
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponseNotFound, HttpResponseNotModified, HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
 
-from .serializers import BookmarkSerializer, TagSerializer
+from .pagination import KeysetPagination
+from .serializers import BookmarkSearchResultSerializer, BookmarkSerializer, SimilarBookmarkSerializer, TagSerializer
+from .services.fetch_state import get_validators
 from .services.metadata_extractor import extract_url_metadata_sync
+from .services.http_client import get_client_manager
+from .services.images import get_proxy_settings, get_thumbnail, pick_size, read_token, resolve_image
+from .services.metadata_cache import get_metadata_cache
+from .services.importer import BookmarkImporter, iter_uploaded_bookmarks
+from .services.search import SEARCH_MODES, search_bookmarks
+from .services.tags import normalize_tag_names
+from .tasks import METADATA_FIELDS, enrich_bookmark_metadata, metadata_updates, refreshed_values
+from recommendations.services.embeddings import get_recommendation_settings
+from recommendations.services.similar import similar_bookmarks
+from categorisation.services.suggestions import bookmark_suggestions, suggest_tags
 
 import asyncio
 import datetime
+import time
+
+# by_tag pagination defaults
+BY_TAG_PAGE_SIZE = 20
+BY_TAG_MAX_PAGE_SIZE = 100
+BY_TAG_GROUP_LIMIT = 10
+BY_TAG_MAX_GROUP_LIMIT = 100
+TOPIC_MAX_PREVIEW_LIMIT = 20
 
 # Helper function to get a date range from now
 def get_date_range(days=None, months=None, years=None):
@@ -28,9 +61,30 @@ def get_date_range(days=None, months=None, years=None):
         return today - datetime.timedelta(days=365*years)
     return None
 
+class SearchPagination(KeysetPagination):
+    page_size = 20
+    max_page_size = 100
+
+class TagGroupPagination(KeysetPagination):
+    # by_tag pages over aggregated through rows, which have no pk of their own
+    page_size = BY_TAG_PAGE_SIZE
+    max_page_size = BY_TAG_MAX_PAGE_SIZE
+    tiebreaker = 'tag_id'
+
+def parse_int_param(request, name, default, maximum):
+    """
+    Read a positive integer query parameter, falling back to default and capping at maximum
+    """
+    try:
+        value = int(request.query_params.get(name, default))
+    except (TypeError, ValueError):
+        return default
+    return min(max(value, 1), maximum)
+
 class TagViewSet(viewsets.ModelViewSet):
     serializer_class = TagSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         """
@@ -44,18 +98,28 @@ class BookmarkViewSet(viewsets.ModelViewSet):
 
     serializer_class = BookmarkSerializer
     permission_classes = [permissions.IsAuthenticated] # Only authenticated users
+    pagination_class = KeysetPagination # Cursor pages keyed on the ordering field and id
 
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    filterset_fields = ['source', 'content_type']
+    filterset_fields = ['source', 'content_type', 'metadata_status']
     search_fields = ['title', 'description', 'url', 'tags__name']
     
     ordering_fields = ['created_at', 'updated_at', 'title']
     ordering = ['-created_at']  # Default ordering
 
+    def get_base_queryset(self):
+        """
+        The current user's bookmarks with everything the serializer reads loaded up front.
+        Tags are prefetched in one extra query so listing N bookmarks doesn't run N tag queries.
+        The serializer only renders user as a primary key, so no select_related join is needed.
+        """
+        return Bookmark.objects.filter(user=self.request.user).prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.only('id', 'name'))
+        )
+
     def get_queryset(self):
         # Return bookmarks belonging to the current user with optional filtering by source or tag
-        user = self.request.user
-        queryset = Bookmark.objects.filter(user=user)
+        queryset = self.get_base_queryset()
 
         # Filter by source
         source = self.request.query_params.get('source')
@@ -71,6 +135,13 @@ class BookmarkViewSet(viewsets.ModelViewSet):
             for t in tag_list:
                 queryset = queryset.filter(tags__name=t.strip())
         
+        # Filter by topic (see the topics action)
+        topic = self.request.query_params.get('topic')
+        if topic:
+            if not topic.isdigit():
+                return queryset.none()
+            queryset = queryset.filter(topic_assignment__topic_id=int(topic))
+
         # Filter by time period
         time_period = self.request.query_params.get('period')
         if time_period:
@@ -95,80 +166,176 @@ class BookmarkViewSet(viewsets.ModelViewSet):
     
         return queryset
 
-    # Override create to extract metadata from URL
-    def perform_create(self, serializer):
-        url = serializer.validated_data.get('url')
+    def create(self, request, *args, **kwargs):
+        """
+        Create a bookmark, the response adds the tags the user's classifier suggests for it
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
 
-        # Extract metadata from URL
-        metadata = extract_url_metadata_sync(url)
+        bookmark = serializer.instance
+        suggestions = suggest_tags(
+            request.user.id, bookmark.url, bookmark.title, bookmark.description,
+            exclude=normalize_tag_names(serializer.validated_data.get('tag_names', [])),
+        )
 
-        # Only set values that aren't already provided
-        if 'title' not in serializer.validated_data or not serializer.validated_data['title']:
-            serializer.validated_data['title'] = metadata.get('title')
-        
-        if 'description' not in serializer.validated_data or not serializer.validated_data['description']:
-            serializer.validated_data['description'] = metadata.get('description')
-            
-        if 'preview_image' not in serializer.validated_data or not serializer.validated_data['preview_image']:
-            serializer.validated_data['preview_image'] = metadata.get('preview_image')
-            
-        if 'favicon' not in serializer.validated_data or not serializer.validated_data['favicon']:
-            serializer.validated_data['favicon'] = metadata.get('favicon')
-            
-        if 'content_type' not in serializer.validated_data or not serializer.validated_data['content_type']:
-            serializer.validated_data['content_type'] = metadata.get('content_type')
+        data = dict(serializer.data)
+        data['suggested_tags'] = [{"name": name, "score": round(score, 3)} for name, score in suggestions]
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(serializer.data))
+
+    # Override create to queue metadata extraction instead of fetching inline
+    def perform_create(self, serializer):
+        # Skip the fetch when the client already supplied every metadata field
+        needs_metadata = any(not serializer.validated_data.get(field) for field in METADATA_FIELDS)
+
+        if needs_metadata:
+            # Popular URLs are usually cached already, failures are left to the task's retries
+            cached = get_metadata_cache().get(serializer.validated_data['url'])
+            if cached and not cached.get('error'):
+                provided = Bookmark(**{field: serializer.validated_data.get(field) for field in METADATA_FIELDS})
+                serializer.save(
+                    user=self.request.user,
+                    metadata_status='complete',
+                    metadata_fetched_at=timezone.now(),
+                    **metadata_updates(provided, cached)
+                )
+                return
 
         # Save with user
-        serializer.save(user=self.request.user)
+        bookmark = serializer.save(
+            user=self.request.user,
+            metadata_status='pending' if needs_metadata else 'complete'
+        )
+
+        if needs_metadata:
+            # Only queue once the row is committed so the worker can see it
+            transaction.on_commit(lambda: enrich_bookmark_metadata.delay(bookmark.id))
     
     # Add a new action to refresh metadata for existing bookmarks
     @action(detail=True, methods=['post'])
     def refresh_metadata(self, request, pk=None):
         """
-        Refreshes metadata for an existing bookmark
+        Refreshes metadata for an existing bookmark.
+        Cached metadata is used when available, pass ?bypass_cache=true to always refetch.
+
+        Fetches are conditional (If-None-Match / If-Modified-Since, then a content hash)
+        when the bookmark already holds the last fetched content, and nothing is written
+        if the page hasn't changed.
         """
         bookmark = self.get_object() # Get the current bookmark
         
+        validators = None
+        if bookmark.metadata_status == 'complete' and bookmark.metadata_fetched_at:
+            validators = get_validators(bookmark.url, since=bookmark.metadata_fetched_at)
+        
         # Extract new metadata
-        metadata = extract_url_metadata_sync(bookmark.url)
+        bypass_cache = request.query_params.get('bypass_cache') == 'true'
+        metadata = extract_url_metadata_sync(bookmark.url, bypass_cache=bypass_cache, validators=validators)
+        
+        if metadata is None:
+            # Unchanged since the bookmark was last filled in
+            serializer = self.get_serializer(bookmark)
+            return Response(serializer.data)
         
-        # Update bookmark with new metadata
-        if metadata.get('title'):
-            bookmark.title = metadata.get('title')
-        if metadata.get('description'):
-            bookmark.description = metadata.get('description')
-        if metadata.get('preview_image'):
-            bookmark.preview_image = metadata.get('preview_image')
-        if metadata.get('favicon'):
-            bookmark.favicon = metadata.get('favicon')
-        if metadata.get('content_type'):
-            bookmark.content_type = metadata.get('content_type')
+        # Update bookmark with new metadata, truncated to fit. Failed fetches only
+        # return values guessed from the URL, those would replace real ones.
+        error = metadata.get('error')
+        if not error:
+            for field, value in refreshed_values(metadata).items():
+                setattr(bookmark, field, value)
+
+        bookmark.metadata_status = 'failed' if error else 'complete'
+        bookmark.metadata_error = error[:255] if error else None
+        bookmark.metadata_fetched_at = timezone.now()
         
-        bookmark.save()
+        # Only metadata changed, the rest of the row was validated when it was saved
+        bookmark.save(validate=False)
         
         # Return updated bookmark
         serializer = self.get_serializer(bookmark)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """
+        The user's bookmarks closest in meaning to this one, by embeddings of their title,
+        description and tags, with a similarity score each. ?limit= sets how many.
+
+        Bookmarks are embedded in the background shortly after they change, "pending"
+        is true while this one hasn't been yet.
+        """
+        # Only the ids are needed, skip get_object()'s tag prefetch
+        bookmark = get_object_or_404(Bookmark.objects.only('id', 'user_id'), pk=pk, user=request.user)
+        config = get_recommendation_settings()
+        limit = parse_int_param(request, 'limit', config['SIMILAR_LIMIT'], config['MAX_SIMILAR_LIMIT'])
+
+        started = time.perf_counter()
+        try:
+            matches = similar_bookmarks(bookmark, limit)
+        except ImproperlyConfigured as e:
+            return Response({"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        serializer = SimilarBookmarkSerializer(matches or [], many=True, context=self.get_serializer_context())
+        return Response({
+            "results": serializer.data,
+            "pending": matches is None,
+            "took_ms": round((time.perf_counter() - started) * 1000, 2),
+        })
+
+    @action(detail=True, methods=['get'])
+    def suggested_tags(self, request, pk=None):
+        """
+        Tags the user's classifier suggests for this bookmark, most likely first
+        """
+        bookmark = self.get_object()
+        suggestions = bookmark_suggestions(bookmark)
+        return Response({
+            "suggested_tags": [{"name": name, "score": round(score, 3)} for name, score in suggestions],
+        })
+
     # Add a search endpoint allowing users to find bookmarks by title, description, or URL.
     @action(detail= False, methods=["get"])
     def search(self, request):
-        # Allows users to search bookmarks by title, description, URL or tags
+        """
+        Search bookmarks by title, description, URL or tags.
 
+        ?mode=fts (default) runs ranked full text search with prefix matching and highlights,
+        ?mode=fuzzy runs typo tolerant trigram matching on title and url,
+        ?mode=basic runs the original substring search,
+        ?mode=hybrid fuses full text search with a search by meaning over the bookmark
+        embeddings, each result with the keyword and vector score it was ranked from.
+        Results are cursor paginated (follow "next", ?page_size= sets the size) and took_ms
+        reports how long the search took.
+        """
         query = request.query_params.get("q", "") # Will be in the url
 
-        if query:
-            results = Bookmark.objects.filter(user=request.user).filter(
-                Q(title__icontains=query) | 
-                Q(description__icontains=query) |
-                Q(url__icontains=query) |
-                Q(tags__name__icontains=query) 
-            ).distinct()
+        if not query:
+            return Response({"detail": "No search query provided."}, status=status.HTTP_400_BAD_REQUEST)
 
-            serializer = self.get_serializer(results, many=True)
-            return Response(serializer.data)
-        
-        return Response({"detail": "No search query provided."}, status=status.HTTP_400_BAD_REQUEST)
+        mode = request.query_params.get("mode", "fts")
+        if mode not in SEARCH_MODES:
+            return Response(
+                {"detail": f"Unknown search mode. Use one of: {', '.join(SEARCH_MODES)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        started = time.perf_counter()
+
+        try:
+            results = search_bookmarks(self.get_base_queryset(), query, mode, user_id=request.user.id)
+        except ImproperlyConfigured as e:
+            # Hybrid search without faiss or sentence-transformers installed
+            return Response({"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(results, request, view=self)
+        serializer = BookmarkSearchResultSerializer(page, many=True, context=self.get_serializer_context())
+
+        response = paginator.get_paginated_response(serializer.data)
+        response.data["mode"] = mode
+        response.data["took_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return response
     
     @action(detail=False, methods=["post"])
     def bulk_delete(self, request):
@@ -187,19 +354,202 @@ class BookmarkViewSet(viewsets.ModelViewSet):
             "detail": f"Successfully deleted {deleted_count} bookmarks."
         })
     
+    @action(detail=False, methods=["post"], parser_classes=[JSONParser, MultiPartParser])
+    def bulk_import(self, request):
+        """
+        Import many bookmarks at once.
+
+        Accepts either a JSON body ({"bookmarks": [...]} or a bare list) or a multipart
+        upload in the "file" field containing a JSON array, JSON lines or a Netscape
+        bookmark HTML export. Set fetch_metadata=true to fetch metadata during the import,
+        otherwise it is queued for the enrichment task.
+        """
+        upload = request.FILES.get('file')
+
+        if upload is not None:
+            try:
+                rows = iter_uploaded_bookmarks(upload)
+            except ValueError as e:
+                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            options = request.data
+        else:
+            data = request.data
+            rows = data.get('bookmarks') if isinstance(data, dict) else data
+            options = data if isinstance(data, dict) else {}
+
+            if not isinstance(rows, list):
+                return Response({"detail": "No bookmarks provided."}, status=status.HTTP_400_BAD_REQUEST)
+
+        fetch_metadata = str(options.get('fetch_metadata', '')).lower() == 'true'
+
+        results = BookmarkImporter(request.user, fetch_metadata=fetch_metadata).run(rows)
+
+        return Response({
+            "created": sum(1 for result in results if result['status'] == 'created'),
+            "duplicates": sum(1 for result in results if result['status'] == 'duplicate'),
+            "errors": sum(1 for result in results if result['status'] == 'error'),
+            "results": results,
+        })
+    
     @action(detail=False, methods=["get"])
     def by_tag(self, request):
         """
-        Get bookmarks organized by tag
+        Get bookmarks organized by tag.
+
+        Tags are paginated by name (page_size tags per page, follow "next" for more) and each
+        group holds its newest `limit` bookmarks plus the tag's total count. Pass
+        counts_only=true to get just {tag: count} for every tag without any bookmarks.
         """
+        Through = Bookmark.tags.through
+        tag_counts = (
+            Through.objects.filter(bookmark__user=request.user)
+            .values('tag_id', 'tag__name')
+            .annotate(count=Count('bookmark_id'))
+            .order_by('tag__name')
+        )
+
+        if request.query_params.get('counts_only') == 'true':
+            return Response({row['tag__name']: row['count'] for row in tag_counts})
+
+        limit = parse_int_param(request, 'limit', BY_TAG_GROUP_LIMIT, BY_TAG_MAX_GROUP_LIMIT)
+
+        paginator = TagGroupPagination()
+        page = paginator.paginate_queryset(tag_counts, request, view=self)
+
+        # Newest `limit` bookmarks for every tag on the page, in one query over the through table
+        ranked = (
+            Through.objects.filter(bookmark__user=request.user, tag_id__in=[row['tag_id'] for row in page])
+            .annotate(rank=Window(
+                RowNumber(),
+                partition_by=F('tag_id'),
+                order_by=[F('bookmark__created_at').desc(), F('bookmark_id').desc()]
+            ))
+            .filter(rank__lte=limit)
+            .order_by('tag_id', 'rank')
+            .values_list('tag_id', 'bookmark_id')
+        )
+
+        groups = {}
+        for tag_id, bookmark_id in ranked:
+            groups.setdefault(tag_id, []).append(bookmark_id)
+
+        # Serialize each bookmark once even if it appears under several tags
+        bookmark_ids = {bookmark_id for ids in groups.values() for bookmark_id in ids}
+        bookmarks = self.get_base_queryset().filter(id__in=bookmark_ids)
+        serialized = {bookmark['id']: bookmark for bookmark in self.get_serializer(bookmarks, many=True).data}
 
-        user_tags = Tag.objects.filter(bookmarks__user=request.user).distinct()
         result = {}
-        
-        for tag in user_tags:
-            bookmarks = Bookmark.objects.filter(user=request.user, tags=tag)
-            serializer = self.get_serializer(bookmarks, many=True)
-            result[tag.name] = serializer.data
-            
-        return Response(result)
-        
+        for row in page:
+            result[row['tag__name']] = {
+                'count': row['count'],
+                'bookmarks': [serialized[bookmark_id] for bookmark_id in groups.get(row['tag_id'], [])],
+            }
+
+        return paginator.get_paginated_response(result)
+
+    @action(detail=False, methods=["get"])
+    def topics(self, request):
+        """
+        The user's bookmarks grouped by topic, largest first. Each topic has a label made of
+        its most distinctive words, its number of bookmarks and the `limit` bookmarks most
+        typical of it. List a topic's bookmarks with ?topic=<id> on the bookmark list.
+
+        Topics are clustered from the bookmark embeddings and kept up to date as bookmarks
+        are embedded. "pending" is true until the user has enough bookmarks to cluster.
+
+        Responses are cached until the topics next change, which editing a bookmark's text
+        or tags does, or for TOPICS_CACHE_TTL seconds.
+        """
+        # The topics module needs scikit-learn, only imported once topics are asked for
+        from categorisation.services.config import get_categorisation_settings
+        from categorisation.services.topics import topic_overview, topics_version
+
+        config = get_categorisation_settings()
+        limit = parse_int_param(request, 'limit', config['TOPIC_PREVIEW_LIMIT'], TOPIC_MAX_PREVIEW_LIMIT)
+
+        version = topics_version(request.user.id)
+        if version is None:
+            return Response({"topics": [], "pending": True})
+
+        # Keyed on the host too, the previews hold absolute image proxy URLs
+        key = f"topics:{request.user.id}:{version.timestamp()}:{limit}:{request.get_host()}"
+        topics = cache.get(key)
+        if topics is None:
+            overview = topic_overview(request.user.id, limit)
+
+            # Previews of every topic serialized together, in one query
+            bookmark_ids = {bookmark_id for topic in overview for bookmark_id in topic['bookmarks']}
+            bookmarks = self.get_base_queryset().filter(id__in=bookmark_ids)
+            serialized = {bookmark['id']: bookmark for bookmark in self.get_serializer(bookmarks, many=True).data}
+
+            topics = [
+                {**topic, 'bookmarks': [serialized[bookmark_id] for bookmark_id in topic['bookmarks'] if bookmark_id in serialized]}
+                for topic in overview
+            ]
+            cache.set(key, topics, config['TOPICS_CACHE_TTL'])
+
+        return Response({"topics": topics, "pending": False})
+
+    @action(detail=False, methods=["get"], permission_classes=[permissions.IsAdminUser])
+    def metadata_stats(self, request):
+        """
+        Connection pool and metadata cache statistics for this process (staff only)
+        """
+        return Response({
+            "http_pool": get_client_manager().stats(),
+            "metadata_cache": get_metadata_cache().stats(),
+        })
+
+
+# Image proxy. Plain Django views: <img> tags can't send the JWT, so these are public and
+# rely on signed tokens (image_proxy) and unguessable content hashes (image_content)
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@require_GET
+def image_proxy(request, token):
+    """
+    Resolve a signed preview image or favicon reference, fetching and storing the image
+    on first use, and redirect to its content addressed thumbnail (?size= in pixels).
+    """
+    try:
+        kind, url, host = read_token(token)
+    except signing.BadSignature:
+        raise Http404("Unknown image")
+
+    image = resolve_image(kind, url, host)
+    if image is None:
+        response = HttpResponseNotFound()
+        patch_cache_control(response, public=True, max_age=60 * 60)
+        return response
+
+    size = pick_size(request.GET.get('size'), kind)
+    response = HttpResponseRedirect(reverse('image-content', args=[image.content_hash, size]))
+    # The image behind a URL can change, so the redirect is only cached for a day
+    patch_cache_control(response, public=True, max_age=24 * 60 * 60)
+    return response
+
+
+@require_GET
+def image_content(request, content_hash, size):
+    """
+    Serve a WebP thumbnail. The URL includes the content hash so it never changes and
+    can be cached by browsers and CDNs forever.
+    """
+    size = int(size)
+    if size not in get_proxy_settings()['SIZES']:
+        raise Http404("Unsupported size")
+
+    etag = f'"{content_hash}-{size}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    else:
+        path = get_thumbnail(content_hash, size)
+        if path is None:
+            raise Http404("Unknown image")
+        response = FileResponse(default_storage.open(path), content_type='image/webp')
+
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return response
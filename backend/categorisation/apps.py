@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class CategorisationConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "categorisation"
+
+    def ready(self):
+        from config.ml_services import ml_services
+        from . import signals  # noqa: F401
+
+        # Loaded on first use, see config/ml_services.py
+        ml_services.register('tag_models', 'categorisation.services.classifier.ModelCache', setting='CATEGORISATION')
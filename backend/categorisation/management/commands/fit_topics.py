@@ -0,0 +1,56 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from categorisation.models import Topic
+from categorisation.services.config import get_categorisation_settings
+from categorisation.services.topics import fit_topics
+from recommendations.models import BookmarkEmbedding
+from recommendations.services.embeddings import get_recommendation_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Cluster users' bookmarks into topics now, for collections embedded before topics "
+        "existed. Fits every user with enough embedded bookmarks whose topics are missing "
+        "or outgrown, or just --user."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only this user's bookmarks (email)")
+
+    def handle(self, *args, **options):
+        config = get_categorisation_settings()
+        embeddings = BookmarkEmbedding.objects.filter(model=get_recommendation_settings()['MODEL'])
+
+        if options['user']:
+            User = get_user_model()
+            try:
+                user_ids = [User.objects.get(email=options['user']).id]
+            except User.DoesNotExist:
+                raise CommandError(f"No user with email {options['user']}")
+        else:
+            user_ids = list(
+                embeddings.values('user_id').annotate(count=Count('bookmark_id'))
+                .filter(count__gte=config['MIN_TOPIC_BOOKMARKS'])
+                .values_list('user_id', flat=True)
+            )
+
+        fitted = 0
+        for user_id in user_ids:
+            started = time.perf_counter()
+            clusters = fit_topics(user_id, config)
+            if clusters is None:
+                continue
+
+            fitted += 1
+            self.stdout.write(
+                f"User {user_id}: {len(clusters)} topics over {int(clusters.counts.sum())} bookmarks "
+                f"in {time.perf_counter() - started:.1f}s"
+            )
+            for topic in Topic.objects.filter(user_id=user_id):
+                self.stdout.write(f"  {int(clusters.counts[topic.number]):>7}  {topic.label or '-'}")
+
+        self.stdout.write(f"Fitted topics for {fitted} of {len(user_ids)} users")
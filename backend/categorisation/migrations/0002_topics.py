@@ -0,0 +1,103 @@
+# Generated by Django 5.1.6 on 2026-10-17 06:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookmarks", "0012_bookmark_url_validators"),
+        ("categorisation", "0001_initial"),
+        ("users", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TopicModel",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="topic_model",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("artifact", models.BinaryField(default=b"")),
+                ("embedding_model", models.CharField(blank=True, max_length=100)),
+                ("fitted_size", models.PositiveIntegerField(default=0)),
+                ("size", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="Topic",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("number", models.PositiveSmallIntegerField()),
+                ("label", models.CharField(blank=True, max_length=200)),
+                ("terms", models.JSONField(default=list)),
+                ("labelled_size", models.PositiveIntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="topics",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["number"],
+            },
+        ),
+        migrations.CreateModel(
+            name="BookmarkTopic",
+            fields=[
+                (
+                    "bookmark",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="topic_assignment",
+                        serialize=False,
+                        to="bookmarks.bookmark",
+                    ),
+                ),
+                ("similarity", models.FloatField()),
+                (
+                    "topic",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="assignments",
+                        to="categorisation.topic",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="topic",
+            constraint=models.UniqueConstraint(
+                fields=("user", "number"), name="topic_user_number_unique"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bookmarktopic",
+            index=models.Index(
+                fields=["topic", "-similarity"], name="bookmark_topic_similarity_idx"
+            ),
+        ),
+    ]
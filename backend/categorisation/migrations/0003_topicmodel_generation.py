@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("categorisation", "0002_topics"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="topicmodel",
+            name="generation",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
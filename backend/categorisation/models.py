@@ -1,3 +1,110 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class TagClassifier(models.Model):
+    """
+    A user's tag classifier, trained incrementally as they tag bookmarks.
+
+    The artifact holds one sparse linear model per tag, packed by TagModel.to_bytes
+    (see categorisation/services/classifier.py). Training locks the row, so updates
+    from concurrent workers are applied one after the other.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='tag_classifier'
+    )
+    artifact = models.BinaryField(default=b'')
+    # Bookmarks trained on so far, counting each epoch and replay
+    examples = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Tag classifier of user {self.user_id}'
+
+
+class TagSuggestion(models.Model):
+    """
+    A tag the classifier suggests for an untagged bookmark, written by the nightly
+    re-categorisation and dropped once the bookmark is tagged
+    """
+    bookmark = models.ForeignKey('bookmarks.Bookmark', on_delete=models.CASCADE, related_name='tag_suggestions')
+    tag = models.ForeignKey('bookmarks.Tag', on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-score']
+        constraints = [
+            models.UniqueConstraint(fields=['bookmark', 'tag'], name='tag_suggestion_bookmark_tag_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.tag_id} for bookmark {self.bookmark_id} ({self.score:.2f})'
+
+
+class TopicModel(models.Model):
+    """
+    A user's topic clusters, mini-batch k-means over their bookmark embeddings.
+
+    The artifact holds the centroids and how many bookmarks each has absorbed, packed
+    by TopicClusters.to_bytes (see categorisation/services/topics.py). Newly embedded
+    bookmarks update it in place; it's fitted again from every embedding when the
+    collection has grown enough that the number of topics should change.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='topic_model'
+    )
+    artifact = models.BinaryField(default=b'')
+    # Embedding model the centroids live in the space of
+    embedding_model = models.CharField(max_length=100, blank=True)
+    # Bookmarks the last full fit clustered, and clustered in all since then
+    fitted_size = models.PositiveIntegerField(default=0)
+    size = models.PositiveIntegerField(default=0)
+    # Bumped by every full fit, fits run unlocked and only save over the one they started from
+    generation = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Topics of user {self.user_id}'
+
+
+class Topic(models.Model):
+    """
+    One cluster of a user's bookmarks, labelled with its top TF-IDF terms
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='topics')
+    # Row of the topic's centroid in the artifact
+    number = models.PositiveSmallIntegerField()
+    label = models.CharField(max_length=200, blank=True)
+    terms = models.JSONField(default=list)
+    # Bookmarks the topic had absorbed when it was last labelled
+    labelled_size = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['number']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'number'], name='topic_user_number_unique'),
+        ]
+
+    def __str__(self):
+        return self.label or f'Topic {self.number} of user {self.user_id}'
+
+
+class BookmarkTopic(models.Model):
+    """
+    The topic a bookmark belongs to, with the cosine similarity to its centroid
+    """
+    bookmark = models.OneToOneField(
+        'bookmarks.Bookmark', on_delete=models.CASCADE, primary_key=True, related_name='topic_assignment'
+    )
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='assignments')
+    similarity = models.FloatField()
+
+    class Meta:
+        indexes = [
+            # A topic's most representative bookmarks, for labels and previews
+            models.Index(fields=['topic', '-similarity'], name='bookmark_topic_similarity_idx'),
+        ]
+
+    def __str__(self):
+        return f'Bookmark {self.bookmark_id} in topic {self.topic_id}'
@@ -0,0 +1,125 @@
+# categorisation/services/categoriser.py
+import random
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch
+
+from bookmarks.models import Bookmark, Tag
+from ..models import TagClassifier, TagSuggestion
+from .classifier import TagModel, bookmark_document, get_model_cache, vectorize
+from .config import get_categorisation_settings
+
+
+def tagged_bookmarks(user_id):
+    # EXISTS rather than a join, which repeats bookmarks once per tag and needs a DISTINCT
+    tagged = Exists(Bookmark.tags.through.objects.filter(bookmark_id=OuterRef('pk')))
+    return (
+        Bookmark.objects.filter(tagged, user_id=user_id)
+        .only('id', 'url', 'title', 'description')
+        .prefetch_related(Prefetch('tags', queryset=Tag.objects.only('id', 'name')))
+    )
+
+
+def train_user_model(user_id, bookmark_ids=(), config=None):
+    """
+    Update the user's classifier with the current tags of the given bookmarks.
+
+    Each update also replays a few of the user's other tagged bookmarks, so one
+    bookmark doesn't swing its tags' classifiers. A user without a classifier gets one
+    trained over their newest tagged bookmarks first.
+
+    Returns:
+        The updated TagModel, or None if the user has no tagged bookmarks
+    """
+    config = config or get_categorisation_settings()
+    n_features = config['N_FEATURES']
+
+    # A row to lock, so concurrent updates are applied in turn
+    TagClassifier.objects.get_or_create(user_id=user_id)
+
+    with transaction.atomic():
+        record = TagClassifier.objects.select_for_update().get(user_id=user_id)
+        model = TagModel.from_bytes(record.artifact) if record.artifact else None
+
+        if model is None or model.n_features != n_features:
+            model = TagModel(n_features)
+            examples = list(tagged_bookmarks(user_id).order_by('-id')[:config['BOOTSTRAP_EXAMPLES']])
+            epochs = config['BOOTSTRAP_EPOCHS']
+        else:
+            examples = list(tagged_bookmarks(user_id).filter(id__in=bookmark_ids))
+            if not examples:
+                return model
+            # Sampled from the ids, ORDER BY RANDOM() would sort every tagged bookmark
+            others = list(tagged_bookmarks(user_id).exclude(id__in=bookmark_ids).values_list('id', flat=True))
+            replay = random.sample(others, min(len(others), config['REPLAY_EXAMPLES']))
+            examples += list(tagged_bookmarks(user_id).filter(id__in=replay))
+            epochs = 1
+
+        if not examples:
+            return None
+
+        X = vectorize([bookmark_document(bookmark.url, bookmark.title, bookmark.description) for bookmark in examples], n_features)
+        model.partial_fit(X, [{tag.name for tag in bookmark.tags.all()} for bookmark in examples], config['ALPHA'], epochs)
+
+        record.artifact = model.to_bytes()
+        record.examples += len(examples) * epochs
+        record.save(update_fields=['artifact', 'examples', 'updated_at'])
+
+        # Tagged bookmarks don't need suggestions anymore
+        TagSuggestion.objects.filter(bookmark_id__in=[bookmark.id for bookmark in examples]).delete()
+
+    get_model_cache().put(user_id, model)
+    return model
+
+
+def recategorise_user(user_id, config=None):
+    """
+    Replace the stored suggestions of the user's untagged bookmarks with fresh ones from
+    their classifier, RECATEGORISE_BATCH_SIZE bookmarks at a time
+
+    Returns:
+        Number of bookmarks with at least one suggestion
+    """
+    config = config or get_categorisation_settings()
+
+    artifact = TagClassifier.objects.filter(user_id=user_id).values_list('artifact', flat=True).first()
+    if not artifact:
+        return 0
+    model = TagModel.from_bytes(artifact)
+    tag_ids = dict(Tag.objects.filter(name__in=model.tags).values_list('name', 'id'))
+
+    untagged = (
+        Bookmark.objects.filter(user_id=user_id, tags__isnull=True)
+        .only('id', 'url', 'title', 'description')
+        .order_by('id')
+    )
+
+    categorised = 0
+    last_id = 0
+    while True:
+        batch = list(untagged.filter(id__gt=last_id)[:config['RECATEGORISE_BATCH_SIZE']])
+        if not batch:
+            break
+        last_id = batch[-1].id
+
+        X = vectorize([bookmark_document(bookmark.url, bookmark.title, bookmark.description) for bookmark in batch], model.n_features)
+        predictions = model.predict(
+            X,
+            min_examples=config['MIN_TAG_EXAMPLES'],
+            threshold=config['THRESHOLD'],
+            limit=config['MAX_SUGGESTIONS'],
+        )
+
+        suggestions = [
+            TagSuggestion(bookmark_id=bookmark.id, tag_id=tag_ids[name], score=score)
+            for bookmark, predicted in zip(batch, predictions)
+            for name, score in predicted
+            if name in tag_ids
+        ]
+        with transaction.atomic():
+            TagSuggestion.objects.filter(bookmark_id__in=[bookmark.id for bookmark in batch]).delete()
+            TagSuggestion.objects.bulk_create(suggestions)
+
+        categorised += len({suggestion.bookmark_id for suggestion in suggestions})
+
+    return categorised
@@ -0,0 +1,222 @@
+# categorisation/services/classifier.py
+import io
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+from config.ml_services import ml_services
+from ..models import TagClassifier
+from .config import get_categorisation_settings
+
+CLASSES = np.array([0, 1])
+
+
+# Features
+
+@lru_cache(maxsize=4)
+def get_vectorizer(n_features):
+    # Stateless, so nothing has to be fitted or stored and new words need no retraining
+    return HashingVectorizer(n_features=n_features, alternate_sign=False, stop_words='english', norm='l2')
+
+
+def bookmark_document(url, title, description):
+    """
+    The text a bookmark is classified by, its URL adds the site and path words
+    """
+    return ' '.join(part for part in (title, description, url) if part)
+
+
+def vectorize(documents, n_features):
+    return get_vectorizer(n_features).transform(documents)
+
+
+class TagModel:
+    """
+    One binary logistic regression per tag, over hashed terms of the bookmark text.
+
+    The classifiers are scikit-learn SGDClassifiers trained with partial_fit. Between
+    updates only their coefficients are kept, as a sparse (tags x features) matrix:
+    a coefficient stays zero until a word is seen, so a model is about as large as
+    the user's vocabulary times their tags, whatever N_FEATURES is.
+    """
+
+    def __init__(self, n_features, tags=(), coef=None, intercept=None, steps=None, positives=None):
+        self.n_features = n_features
+        self.tags = list(tags)
+        self.coef = coef if coef is not None else sparse.csr_matrix((0, n_features), dtype=np.float32)
+        self.intercept = intercept if intercept is not None else np.zeros(0, dtype=np.float32)
+        # SGD step counts, they set each classifier's learning rate
+        self.steps = steps if steps is not None else np.zeros(0, dtype=np.float64)
+        # Bookmarks seen with each tag
+        self.positives = positives if positives is not None else np.zeros(0, dtype=np.int64)
+        # coef transposed to (features x tags) rows, built on first predict
+        self._weights = None
+
+    def _classifier(self, position, coef, alpha):
+        classifier = SGDClassifier(loss='log_loss', alpha=alpha, random_state=0)
+        if position < len(self.tags):
+            # Carry on from the stored state, as if partial_fit had never stopped
+            classifier.classes_ = CLASSES
+            classifier.coef_ = coef[position].toarray().astype(np.float64)
+            classifier.intercept_ = np.array([self.intercept[position]], dtype=np.float64)
+            classifier.t_ = float(self.steps[position])
+            classifier.n_features_in_ = coef.shape[1]
+        return classifier
+
+    def partial_fit(self, X, label_sets, alpha, epochs=1):
+        """
+        Update every tag's classifier with the bookmarks in X, positive for the tags in
+        their label set and negative for the others. Tags not seen before get a new
+        classifier.
+
+        The classifiers are fitted over the features that X or the model use. The others
+        are zero in both, and SGD keeps them at zero: its L2 decay scales the weights and
+        each step's gradient only touches the features of X. So the fit is the same as
+        over all N_FEATURES, without densifying a row that wide for every tag.
+        """
+        new_tags = sorted({name for labels in label_sets for name in labels} - set(self.tags))
+        tags = self.tags + new_tags
+
+        X = sparse.csr_matrix(X)
+        # A mask rather than np.union1d, which sorts every stored coefficient's index
+        used = np.zeros(self.n_features, dtype=bool)
+        used[X.indices] = True
+        used[self.coef.indices] = True
+        features = np.flatnonzero(used)
+        X = X[:, features]
+        coef = self.coef[:, features]
+
+        rows, intercept, steps = [], [], []
+        for position, tag in enumerate(tags):
+            y = np.array([tag in labels for labels in label_sets], dtype=np.int64)
+            classifier = self._classifier(position, coef, alpha)
+            for _ in range(epochs):
+                classifier.partial_fit(X, y, classes=CLASSES)
+
+            rows.append(sparse.csr_matrix(classifier.coef_, dtype=np.float32))
+            intercept.append(classifier.intercept_[0])
+            steps.append(classifier.t_)
+
+        positives = np.zeros(len(tags), dtype=np.int64)
+        positives[:len(self.tags)] = self.positives
+        for labels in label_sets:
+            for position, tag in enumerate(tags):
+                positives[position] += tag in labels
+
+        coef = sparse.vstack(rows, format='csr', dtype=np.float32)
+        self.tags = tags
+        self.coef = sparse.csr_matrix(
+            (coef.data, features[coef.indices], coef.indptr), shape=(len(tags), self.n_features),
+        )
+        self.intercept = np.array(intercept, dtype=np.float32)
+        self.steps = np.array(steps, dtype=np.float64)
+        self.positives = positives
+        self._weights = None
+
+    def predict(self, X, min_examples=1, threshold=0.5, limit=5, exclude=()):
+        """
+        Returns:
+            One list per row of X of (tag name, probability) pairs, most likely first
+        """
+        if not self.tags:
+            return [[] for _ in range(X.shape[0])]
+
+        if self._weights is None:
+            # A row per feature makes X @ weights only touch the rows of X's words,
+            # several times faster than transposing coef for each call
+            self._weights = self.coef.T.tocsr()
+
+        scores = (X @ self._weights).toarray() + self.intercept
+        probabilities = 1 / (1 + np.exp(-scores))
+        eligible = (self.positives >= min_examples) & ~np.isin(self.tags, list(exclude))
+
+        results = []
+        for row in probabilities:
+            candidates = np.flatnonzero(eligible & (row >= threshold))
+            ranked = candidates[np.argsort(-row[candidates])][:limit]
+            results.append([(self.tags[position], float(row[position])) for position in ranked])
+        return results
+
+    def to_bytes(self):
+        """
+        Compressed npz, coefficients as float16. Nothing is pickled, so artifacts can be
+        read by any version of this code.
+        """
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            n_features=np.array(self.n_features),
+            tags=np.array(self.tags, dtype=str),
+            indptr=self.coef.indptr.astype(np.int32),
+            indices=self.coef.indices.astype(np.int32),
+            data=self.coef.data.astype(np.float16),
+            intercept=self.intercept.astype(np.float32),
+            steps=self.steps,
+            positives=self.positives,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(bytes(data)), allow_pickle=False) as arrays:
+            n_features = int(arrays['n_features'])
+            tags = [str(tag) for tag in arrays['tags']]
+            coef = sparse.csr_matrix(
+                (arrays['data'].astype(np.float32), arrays['indices'], arrays['indptr']),
+                shape=(len(tags), n_features),
+            )
+            return cls(
+                n_features, tags, coef,
+                intercept=arrays['intercept'], steps=arrays['steps'], positives=arrays['positives'],
+            )
+
+
+class ModelCache:
+    """
+    The tag models of this process, least recently used evicted past MAX_MODELS.
+
+    Entries are read again after CACHE_TTL seconds, so training in other processes
+    shows up soon. Users without a classifier are cached too, as None.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_categorisation_settings()
+        self._lock = threading.Lock()
+        self._models = OrderedDict()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._models.get(user_id)
+            if entry is not None and now - entry[1] < self.config['CACHE_TTL']:
+                self._models.move_to_end(user_id)
+                return entry[0]
+
+        artifact = TagClassifier.objects.filter(user_id=user_id).values_list('artifact', flat=True).first()
+        model = TagModel.from_bytes(artifact) if artifact else None
+        self.put(user_id, model)
+        return model
+
+    def put(self, user_id, model):
+        with self._lock:
+            self._models[user_id] = (model, time.monotonic())
+            self._models.move_to_end(user_id)
+            while len(self._models) > self.config['MAX_MODELS']:
+                self._models.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+def get_model_cache():
+    """
+    Return the process-wide tag model cache, the tag_models service (see config/ml_services.py)
+    """
+    return ml_services.get('tag_models')
@@ -0,0 +1,40 @@
+# categorisation/services/config.py
+from django.conf import settings
+
+# Defaults, overridable through settings.CATEGORISATION. Kept apart from the classifier
+# so reading them doesn't import scikit-learn.
+DEFAULT_CATEGORISATION_SETTINGS = {
+    'N_FEATURES': 2 ** 18,          # Hashed term buckets, few collisions within one user's vocabulary
+    'ALPHA': 1e-4,                  # L2 regularization of the per-tag classifiers
+    'MIN_TAG_EXAMPLES': 3,          # Tags are only suggested once this many bookmarks carry them
+    'THRESHOLD': 0.5,               # Minimum probability of a suggestion
+    'MAX_SUGGESTIONS': 5,
+    'SUGGEST_BUDGET_MS': 25,        # Time a create request may spend on suggestions
+    'REPLAY_EXAMPLES': 32,          # Earlier tagged bookmarks mixed into each update
+    'BOOTSTRAP_EXAMPLES': 2000,     # Newest tagged bookmarks a new classifier is trained on
+    'BOOTSTRAP_EPOCHS': 5,
+    'MAX_MODELS': 500,              # Classifiers each process keeps in memory
+    'CACHE_TTL': 60,                # Seconds before a cached classifier is read again
+    'RECATEGORISE_BATCH_SIZE': 1000,
+    'LEARN_WINDOW': 10,             # Seconds tag changes are collected before the classifiers learn them
+    'LEARN_BATCH_SIZE': 500,        # Tag changed bookmarks learned per update
+    'LEARN_RETRY_DELAY': 30,        # Seconds before a batch that failed to learn is tried again
+    # Topics (see categorisation/services/topics.py)
+    'MIN_TOPIC_BOOKMARKS': 50,      # Embedded bookmarks a user needs before they're clustered
+    'MAX_TOPICS': 40,
+    'TOPIC_REFIT_GROWTH': 2.0,      # Fit again once this many times the bookmarks of the last fit are clustered
+    'TOPIC_RELABEL_GROWTH': 0.25,   # Label a topic again once it has grown by this fraction
+    'TOPIC_LABEL_SAMPLE': 200,      # Bookmarks closest to its centroid a topic is labelled from
+    'TOPIC_LABEL_TERMS': 3,
+    'TOPIC_PREVIEW_LIMIT': 5,       # Bookmarks shown under each topic
+    'TOPICS_CACHE_TTL': 600,
+}
+
+
+def get_categorisation_settings():
+    """
+    Merge the configured categorisation settings over the defaults
+    """
+    config = dict(DEFAULT_CATEGORISATION_SETTINGS)
+    config.update(getattr(settings, 'CATEGORISATION', {}))
+    return config
@@ -0,0 +1,35 @@
+# categorisation/services/learning_queue.py
+import threading
+
+from recommendations.services.embedding_queue import PendingEmbeddings
+
+
+class PendingTagChanges(PendingEmbeddings):
+    """
+    Ids of bookmarks whose tags changed since the classifiers last learned from them,
+    in a Redis set with a batch window like the pending embeddings.
+
+    Every update runs partial_fit over each of the user's tags, so a burst of tag
+    edits is learned in one update per user rather than one per edit.
+    """
+
+    def __init__(self, key='categorisation:learn:pending', cache_alias='default'):
+        super().__init__(key, cache_alias)
+
+
+_pending = None
+_pending_lock = threading.Lock()
+
+
+def get_pending_tag_changes():
+    """
+    Return the process-wide pending tag changes set
+    """
+    global _pending
+
+    if _pending is None:
+        with _pending_lock:
+            if _pending is None:
+                _pending = PendingTagChanges()
+
+    return _pending
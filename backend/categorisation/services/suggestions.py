@@ -0,0 +1,69 @@
+# categorisation/services/suggestions.py
+import logging
+import time
+
+from config.ml_services import ml_services
+from ..models import TagClassifier, TagSuggestion
+from .config import get_categorisation_settings
+
+logger = logging.getLogger(__name__)
+
+
+def has_classifier(user_id):
+    return TagClassifier.objects.filter(user_id=user_id).exclude(artifact=b'').exists()
+
+
+def suggest_tags(user_id, url, title=None, description=None, exclude=(), config=None):
+    """
+    Tags the user's classifier suggests for a bookmark, within SUGGEST_BUDGET_MS.
+
+    Suggesting costs well under a millisecond once the classifier is cached. Until this
+    process has loaded the tag_models service, users without a classifier are turned
+    away with one query, before scikit-learn is imported. The budget covers importing
+    it and loading the classifier; if they used it up, nothing is suggested this time
+    and the next request finds both ready.
+
+    Returns:
+        List of (tag name, probability) pairs, most likely first
+    """
+    config = config or get_categorisation_settings()
+    started = time.perf_counter()
+
+    if ml_services.get_loaded('tag_models') is None and not has_classifier(user_id):
+        return []
+
+    from .classifier import bookmark_document, get_model_cache, vectorize
+
+    model = get_model_cache().get(user_id)
+    if model is None:
+        return []
+
+    if (time.perf_counter() - started) * 1000 > config['SUGGEST_BUDGET_MS']:
+        logger.info(f"Skipped tag suggestions for user {user_id}, loading the classifier took too long")
+        return []
+
+    X = vectorize([bookmark_document(url, title, description)], model.n_features)
+    return model.predict(
+        X,
+        min_examples=config['MIN_TAG_EXAMPLES'],
+        threshold=config['THRESHOLD'],
+        limit=config['MAX_SUGGESTIONS'],
+        exclude=exclude,
+    )[0]
+
+
+def bookmark_suggestions(bookmark, config=None):
+    """
+    Suggestions for a saved bookmark: the stored ones from the last re-categorisation,
+    or fresh ones if there are none
+    """
+    stored = list(
+        TagSuggestion.objects.filter(bookmark=bookmark).select_related('tag').values_list('tag__name', 'score')
+    )
+    if stored:
+        return stored
+
+    return suggest_tags(
+        bookmark.user_id, bookmark.url, bookmark.title, bookmark.description,
+        exclude={tag.name for tag in bookmark.tags.all()}, config=config,
+    )
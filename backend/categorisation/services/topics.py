@@ -0,0 +1,372 @@
+# categorisation/services/topics.py
+import datetime
+import io
+import math
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+
+from bookmarks.models import Bookmark
+from recommendations.models import BookmarkEmbedding
+from recommendations.services.embeddings import get_recommendation_settings, vector_from_bytes
+from ..models import BookmarkTopic, Topic, TopicModel
+from .config import get_categorisation_settings
+
+# Assignments written per INSERT when a user's bookmarks are clustered
+WRITE_BATCH_SIZE = 5000
+
+# Embeddings stamped this long before a fit read them may not have been committed yet,
+# they're assigned again when the fit is saved
+READ_OVERLAP = datetime.timedelta(seconds=5)
+
+# Words of three letters or more, numbers and URL fragments make poor labels
+LABEL_TOKEN_PATTERN = r'(?u)\b[^\W\d_]{3,}\b'
+
+
+def normalize(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+class TopicClusters:
+    """
+    Spherical mini-batch k-means over unit bookmark embeddings: a bookmark belongs to
+    the centroid it has the highest cosine similarity to.
+
+    The first fit is scikit-learn's MiniBatchKMeans, seeded with k-means++. Bookmarks
+    embedded later are added with the update its partial_fit applies, each centroid
+    moving toward its new members by 1 / the members it has absorbed. It's done here
+    so only the centroids and counts have to be stored.
+    """
+
+    def __init__(self, centroids, counts):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.counts = np.asarray(counts, dtype=np.int64)
+
+    @classmethod
+    def fit(cls, vectors, k, seed=0):
+        kmeans = MiniBatchKMeans(n_clusters=k, batch_size=1024, n_init=3, random_state=seed)
+        numbers = kmeans.fit_predict(vectors)
+        return cls(kmeans.cluster_centers_, np.bincount(numbers, minlength=k))
+
+    def __len__(self):
+        return len(self.centroids)
+
+    def assign(self, vectors):
+        """
+        Returns:
+            (topic number, cosine similarity to its centroid) arrays, one entry per vector
+        """
+        similarities = vectors @ normalize(self.centroids).T
+        numbers = similarities.argmax(axis=1)
+        return numbers, similarities[np.arange(len(numbers)), numbers]
+
+    def partial_fit(self, vectors):
+        """
+        Assign vectors and move their centroids toward them
+        """
+        numbers, similarities = self.assign(vectors)
+        for number in np.unique(numbers):
+            members = vectors[numbers == number]
+            self.counts[number] += len(members)
+            self.centroids[number] += (members.sum(axis=0) - len(members) * self.centroids[number]) / self.counts[number]
+        return numbers, similarities
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, centroids=self.centroids, counts=self.counts)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(bytes(data)), allow_pickle=False) as arrays:
+            return cls(arrays['centroids'], arrays['counts'])
+
+
+def topic_count(bookmarks, config):
+    """
+    Topics for a collection of the given size, sqrt(n / 2) up to MAX_TOPICS: about 7
+    for 100 bookmarks, 22 for 1000
+    """
+    return min(config['MAX_TOPICS'], max(2, round(math.sqrt(bookmarks / 2))))
+
+
+def embedded_bookmarks(user_id, model, bookmark_ids=None):
+    """
+    Returns:
+        (bookmark ids, (n, dimension) float32 vectors) of the user's embedded bookmarks,
+        or only of the given ones
+    """
+    rows = BookmarkEmbedding.objects.filter(user_id=user_id, model=model)
+    if bookmark_ids is not None:
+        rows = rows.filter(bookmark_id__in=bookmark_ids)
+    rows = rows.values_list('bookmark_id', 'vector', 'dtype')
+
+    ids, vectors = [], []
+    for bookmark_id, vector, dtype in rows.iterator(chunk_size=2000):
+        ids.append(bookmark_id)
+        vectors.append(vector_from_bytes(vector, dtype))
+    if not ids:
+        return np.empty(0, dtype=np.int64), None
+    return np.array(ids, dtype=np.int64), np.vstack(vectors)
+
+
+def needs_fit(record, model, config):
+    return (
+        not record.artifact
+        or record.embedding_model != model
+        or record.size >= config['TOPIC_REFIT_GROWTH'] * record.fitted_size
+    )
+
+
+def write_assignments(user_id, ids, numbers, similarities):
+    """
+    Insert the assignments of a fit, by topic number. One INSERT from arrays per
+    WRITE_BATCH_SIZE bookmarks, bulk_create takes several times longer and runs under
+    the lock update_topics waits on.
+    """
+    table = connection.ops.quote_name(BookmarkTopic._meta.db_table)
+    topics = connection.ops.quote_name(Topic._meta.db_table)
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), WRITE_BATCH_SIZE):
+            end = start + WRITE_BATCH_SIZE
+            cursor.execute(
+                f"INSERT INTO {table} (bookmark_id, topic_id, similarity) "
+                f"SELECT v.bookmark_id, t.id, v.similarity "
+                f"FROM unnest(%s::bigint[], %s::int[], %s::float8[]) AS v(bookmark_id, number, similarity) "
+                f"JOIN {topics} t ON t.user_id = %s AND t.number = v.number",
+                [ids[start:end].tolist(), numbers[start:end].tolist(), similarities[start:end].tolist(), user_id],
+            )
+
+
+def fit_topics(user_id, config=None):
+    """
+    Cluster all of the user's embedded bookmarks, replacing their topics.
+
+    Reading the embeddings and fitting take seconds for large collections, so they run
+    without the lock update_topics waits on. The result is then saved under the lock,
+    with bookmarks embedded or deleted meanwhile added or dropped, unless another fit
+    was saved first.
+
+    Does nothing if the topics don't need fitting, or the user has fewer than
+    MIN_TOPIC_BOOKMARKS embedded bookmarks. Topic ids change with every fit.
+
+    Returns:
+        The fitted TopicClusters, or None if nothing was fitted
+    """
+    config = config or get_categorisation_settings()
+    model = get_recommendation_settings()['MODEL']
+
+    # A row to lock, so fits and updates of one user are applied in turn
+    record, _ = TopicModel.objects.get_or_create(user_id=user_id)
+    if not needs_fit(record, model, config):
+        return None
+
+    generation = record.generation
+    read_at = timezone.now()
+    ids, vectors = embedded_bookmarks(user_id, model)
+    if len(ids) < config['MIN_TOPIC_BOOKMARKS']:
+        return None
+
+    clusters = TopicClusters.fit(vectors, topic_count(len(ids), config), seed=user_id)
+    numbers, similarities = clusters.assign(vectors)
+
+    with transaction.atomic():
+        record = TopicModel.objects.select_for_update().get(user_id=user_id)
+        if record.generation != generation:
+            return None
+
+        # Embeddings stored since they were read are assigned again, deleted bookmarks dropped
+        stored = dict(BookmarkEmbedding.objects.filter(user_id=user_id, model=model).values_list('bookmark_id', 'updated_at'))
+        since = read_at - READ_OVERLAP
+        late = {bookmark_id for bookmark_id, updated_at in stored.items() if updated_at >= since}
+        keep = np.array([bookmark_id in stored and bookmark_id not in late for bookmark_id in ids.tolist()], dtype=bool)
+        fitted = set(ids.tolist())
+        ids, numbers, similarities = ids[keep], numbers[keep], similarities[keep]
+
+        late_ids, late_vectors = embedded_bookmarks(user_id, model, late)
+        if len(late_ids):
+            # Only bookmarks the fit didn't see join their topics, the rest are reassigned
+            late_vectors = normalize(late_vectors)
+            joined = np.array([bookmark_id not in fitted for bookmark_id in late_ids.tolist()], dtype=bool)
+            if joined.any():
+                clusters.partial_fit(late_vectors[joined])
+            late_numbers, late_similarities = clusters.assign(late_vectors)
+            ids = np.concatenate([ids, late_ids])
+            numbers = np.concatenate([numbers, late_numbers])
+            similarities = np.concatenate([similarities, late_similarities])
+
+        # Assignments first, a single DELETE rather than a cascade through every topic
+        BookmarkTopic.objects.filter(topic__user_id=user_id).delete()
+        Topic.objects.filter(user_id=user_id).delete()
+        Topic.objects.bulk_create([Topic(user_id=user_id, number=number) for number in range(len(clusters))])
+        write_assignments(user_id, ids, numbers, similarities)
+
+        record.artifact = clusters.to_bytes()
+        record.embedding_model = model
+        record.fitted_size = record.size = len(ids)
+        record.generation += 1
+        record.save()
+
+    label_topics(user_id, config=config)
+    return clusters
+
+
+def update_topics(user_id, bookmark_ids, vectors, model, config=None):
+    """
+    Add newly embedded bookmarks to the user's topics, moving the centroids toward them.
+
+    Returns:
+        'fit' if the topics should be fitted (again), 'label' if some topic grew by
+        TOPIC_RELABEL_GROWTH since it was labelled, None otherwise
+    """
+    config = config or get_categorisation_settings()
+
+    with transaction.atomic():
+        record = TopicModel.objects.select_for_update().filter(user_id=user_id).first()
+        if record is None or not record.artifact or record.embedding_model != model:
+            embedded = BookmarkEmbedding.objects.filter(user_id=user_id, model=model).count()
+            return 'fit' if embedded >= config['MIN_TOPIC_BOOKMARKS'] else None
+
+        # Bookmarks deleted since they were embedded can't be assigned
+        existing = set(Bookmark.objects.filter(id__in=bookmark_ids).values_list('id', flat=True))
+        positions = [position for position, bookmark_id in enumerate(bookmark_ids) if bookmark_id in existing]
+        if not positions:
+            return None
+
+        # Re-embedded bookmarks move rather than join, they're taken off their old topic
+        previous = dict(
+            BookmarkTopic.objects.filter(bookmark_id__in=[bookmark_ids[position] for position in positions])
+            .values_list('bookmark_id', 'topic__number')
+        )
+
+        clusters = TopicClusters.from_bytes(record.artifact)
+        numbers, similarities = clusters.partial_fit(normalize(np.asarray(vectors, dtype=np.float32)[positions]))
+        for number in previous.values():
+            clusters.counts[number] = max(clusters.counts[number] - 1, 1)
+
+        topics = {number: (topic_id, labelled) for number, topic_id, labelled in (
+            Topic.objects.filter(user_id=user_id).values_list('number', 'id', 'labelled_size')
+        )}
+        BookmarkTopic.objects.bulk_create(
+            [
+                BookmarkTopic(bookmark_id=bookmark_ids[position], topic_id=topics[number][0], similarity=similarity)
+                for position, number, similarity in zip(positions, numbers.tolist(), similarities.tolist())
+            ],
+            update_conflicts=True,
+            unique_fields=['bookmark'],
+            update_fields=['topic', 'similarity'],
+        )
+
+        record.artifact = clusters.to_bytes()
+        record.size += len(positions) - len(previous)
+        record.save(update_fields=['artifact', 'size', 'updated_at'])
+
+    if record.size >= config['TOPIC_REFIT_GROWTH'] * record.fitted_size:
+        return 'fit'
+
+    growth = 1 + config['TOPIC_RELABEL_GROWTH']
+    if any(clusters.counts[number] >= growth * max(labelled, 1) for number, (_, labelled) in topics.items()):
+        return 'label'
+    return None
+
+
+def label_topics(user_id, clusters=None, config=None):
+    """
+    Label each of the user's topics with its top TF-IDF terms.
+
+    Each topic is one document, made of the titles and descriptions of the
+    TOPIC_LABEL_SAMPLE bookmarks closest to its centroid. Terms count for a topic by
+    how often they appear in it and against how many other topics use them too, so
+    words common to the whole collection don't make it into labels.
+    """
+    config = config or get_categorisation_settings()
+    if clusters is None:
+        artifact = TopicModel.objects.filter(user_id=user_id).values_list('artifact', flat=True).first()
+        if not artifact:
+            return
+        clusters = TopicClusters.from_bytes(artifact)
+
+    topics = list(Topic.objects.filter(user_id=user_id))
+    if not topics:
+        return
+
+    sample = (
+        BookmarkTopic.objects.filter(topic__user_id=user_id)
+        .annotate(rank=Window(RowNumber(), partition_by=F('topic_id'), order_by=F('similarity').desc()))
+        .filter(rank__lte=config['TOPIC_LABEL_SAMPLE'])
+        .values_list('topic_id', 'bookmark__title', 'bookmark__description')
+    )
+    documents = {topic.id: [] for topic in topics}
+    for topic_id, title, description in sample:
+        documents[topic_id].extend(part for part in (title, description) if part)
+
+    vectorizer = CountVectorizer(stop_words='english', token_pattern=LABEL_TOKEN_PATTERN)
+    try:
+        counts = vectorizer.fit_transform([' '.join(documents[topic.id]) for topic in topics])
+    except ValueError:
+        # Nothing but stop words and numbers
+        counts = None
+
+    if counts is not None:
+        weights = TfidfTransformer(sublinear_tf=True).fit_transform(counts).toarray()
+        terms = vectorizer.get_feature_names_out()
+
+    for row, topic in enumerate(topics):
+        top = []
+        if counts is not None:
+            top = [str(terms[column]) for column in np.argsort(-weights[row])[:config['TOPIC_LABEL_TERMS']] if weights[row, column] > 0]
+        topic.terms = top
+        topic.label = ', '.join(top)[:200]
+        topic.labelled_size = int(clusters.counts[topic.number])
+
+    Topic.objects.bulk_update(topics, ['terms', 'label', 'labelled_size'])
+    # Cached overviews are keyed on it
+    TopicModel.objects.filter(user_id=user_id).update(updated_at=timezone.now())
+
+
+def topics_version(user_id):
+    """
+    When the user's topics last changed, None if their bookmarks haven't been clustered
+    yet. Cached topic listings are keyed on it.
+    """
+    return (
+        TopicModel.objects.exclude(artifact=b'').filter(user_id=user_id)
+        .values_list('updated_at', flat=True).first()
+    )
+
+
+def topic_overview(user_id, limit):
+    """
+    The user's topics, largest first, each with its id, label, terms, number of
+    bookmarks and the ids of the `limit` bookmarks closest to its centroid.
+
+    Counting and ranking go over every assigned bookmark, callers cache the result
+    under topics_version().
+    """
+    topics = Topic.objects.filter(user_id=user_id).annotate(size=Count('assignments')).filter(size__gt=0)
+    previews = (
+        BookmarkTopic.objects.filter(topic__user_id=user_id)
+        .annotate(rank=Window(RowNumber(), partition_by=F('topic_id'), order_by=F('similarity').desc()))
+        .filter(rank__lte=limit)
+        .order_by('topic_id', 'rank')
+        .values_list('topic_id', 'bookmark_id')
+    )
+    bookmarks = {}
+    for topic_id, bookmark_id in previews:
+        bookmarks.setdefault(topic_id, []).append(bookmark_id)
+
+    return [
+        {
+            'id': topic.id,
+            'label': topic.label,
+            'terms': topic.terms,
+            'count': topic.size,
+            'bookmarks': bookmarks.get(topic.id, []),
+        }
+        for topic in sorted(topics, key=lambda topic: (-topic.size, topic.number))
+    ]
@@ -0,0 +1,29 @@
+# categorisation/signals.py
+from django.db import transaction
+from django.dispatch import receiver
+
+from bookmarks.models import Bookmark
+from bookmarks.signals import bookmark_tags_changed
+from recommendations.services.embeddings import bookmarks_embedded
+from .tasks import enqueue_tag_changes, fit_user_topics, label_user_topics
+
+
+@receiver(bookmark_tags_changed, sender=Bookmark)
+def tags_changed(sender, bookmark_ids, **kwargs):
+    # Added and removed tags both teach the classifier, once the change is committed
+    bookmark_ids = list(bookmark_ids)
+    if bookmark_ids:
+        transaction.on_commit(lambda: enqueue_tag_changes(bookmark_ids))
+
+
+@receiver(bookmarks_embedded)
+def embedded(sender, user_id, bookmark_ids, vectors, model, **kwargs):
+    # Runs in the embedding task, which already holds the vectors, placing them costs
+    # a product with the centroids. Fitting and labelling are left to their own tasks.
+    from .services.topics import update_topics
+
+    action = update_topics(user_id, bookmark_ids, vectors, model)
+    if action == 'fit':
+        transaction.on_commit(lambda: fit_user_topics.delay(user_id))
+    elif action == 'label':
+        transaction.on_commit(lambda: label_user_topics.delay(user_id))
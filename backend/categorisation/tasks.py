@@ -0,0 +1,127 @@
+# categorisation/tasks.py
+import logging
+
+from celery import shared_task
+from redis.exceptions import RedisError
+
+from bookmarks.models import Bookmark
+from .models import TagClassifier
+from .services.config import get_categorisation_settings
+from .services.learning_queue import get_pending_tag_changes
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_tag_changes(bookmark_ids):
+    """
+    Queue bookmarks whose tags changed for their users' classifiers to learn.
+
+    Changes are coalesced like embeddings: the first of a batch schedules a flush
+    LEARN_WINDOW seconds out, and a full batch is flushed straight away. Without Redis
+    every call gets its own task.
+    """
+    config = get_categorisation_settings()
+
+    try:
+        queued = get_pending_tag_changes().add(bookmark_ids)
+    except RedisError as e:
+        logger.warning(f"Tag learning batches unavailable, queueing {len(bookmark_ids)} bookmarks directly: {e}")
+        queued = None
+
+    if queued is None:
+        learn_tags.delay(bookmark_ids)
+        return
+
+    added, pending, opened = queued
+    batch_size = config['LEARN_BATCH_SIZE']
+    if pending // batch_size > (pending - added) // batch_size:
+        flush_tag_changes.delay()
+    elif opened:
+        flush_tag_changes.apply_async(countdown=config['LEARN_WINDOW'])
+
+
+@shared_task
+def flush_tag_changes():
+    """
+    Learn from every pending tag change, LEARN_BATCH_SIZE bookmarks at a time. A batch
+    that fails goes back in the queue and another flush is scheduled LEARN_RETRY_DELAY
+    seconds out.
+    """
+    config = get_categorisation_settings()
+    pending = get_pending_tag_changes()
+    pending.close_window()
+
+    users = 0
+    while bookmark_ids := pending.pop(config['LEARN_BATCH_SIZE']):
+        try:
+            users += learn_tags(bookmark_ids)
+        except Exception:
+            pending.requeue(bookmark_ids)
+            flush_tag_changes.apply_async(countdown=config['LEARN_RETRY_DELAY'])
+            raise
+
+    return users
+
+
+@shared_task
+def learn_tags(bookmark_ids):
+    """
+    Update the classifiers of the bookmarks' users, one update per user
+    """
+    # scikit-learn is only imported by workers that train, see config/ml_services.py
+    from .services.categoriser import train_user_model
+
+    by_user = {}
+    for bookmark_id, user_id in Bookmark.objects.filter(id__in=bookmark_ids).values_list('id', 'user_id'):
+        by_user.setdefault(user_id, []).append(bookmark_id)
+
+    for user_id, ids in by_user.items():
+        train_user_model(user_id, ids)
+
+    return len(by_user)
+
+
+@shared_task
+def recategorise_user_bookmarks(user_id):
+    from .services.categoriser import recategorise_user
+
+    categorised = recategorise_user(user_id)
+    logger.info(f"Suggested tags for {categorised} untagged bookmarks of user {user_id}")
+    return categorised
+
+
+@shared_task
+def recategorise_untagged():
+    """
+    Celery beat job: refresh the tag suggestions of untagged bookmarks, one task per
+    user with a classifier
+    """
+    user_ids = list(TagClassifier.objects.exclude(artifact=b'').values_list('user_id', flat=True))
+    for user_id in user_ids:
+        recategorise_user_bookmarks.delay(user_id)
+
+    logger.info(f"Queued re-categorisation for {len(user_ids)} users")
+    return len(user_ids)
+
+
+@shared_task
+def fit_user_topics(user_id):
+    """
+    Cluster the user's bookmarks into topics from scratch, queued once they have enough
+    embedded bookmarks and again as their collection grows
+    """
+    from .services.topics import fit_topics
+
+    clusters = fit_topics(user_id)
+    if clusters is None:
+        return 0
+
+    logger.info(f"Fitted {len(clusters)} topics over {int(clusters.counts.sum())} bookmarks of user {user_id}")
+    return len(clusters)
+
+
+@shared_task
+def label_user_topics(user_id):
+    from .services.topics import label_topics
+
+    label_topics(user_id)
@@ -1,3 +1,427 @@
-from django.test import TestCase
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+from bookmarks.models import Bookmark
+from bookmarks.services.tags import sync_bookmark_tags
+from config.ml_services import ml_services
+from recommendations.tasks import embed_bookmarks
+from recommendations.tests import FakeRedis
+from .models import BookmarkTopic, TagClassifier, TagSuggestion, TopicModel
+from .services.categoriser import recategorise_user, train_user_model
+from .services.suggestions import suggest_tags
+from .services.classifier import TagModel, get_model_cache, vectorize
+from .services.topics import TopicClusters, fit_topics
+from .tasks import enqueue_tag_changes, fit_user_topics, flush_tag_changes, label_user_topics, learn_tags
+from unittest.mock import patch
+import os
+import subprocess
+import sys
+import numpy as np
+from sklearn.linear_model import SGDClassifier
 
-# Create your tests here.
+User = get_user_model()
+
+PAGES = {
+    "python": [
+        ("https://docs.python.org/3/tutorial/", "The Python tutorial", "Learn python programming step by step"),
+        ("https://realpython.com/django-setup/", "Setting up Django", "A python web framework tutorial"),
+        ("https://example.com/asyncio", "Asyncio in python", "Concurrent python programming with coroutines"),
+        ("https://example.com/pytest", "Testing python code", "Writing python tests with pytest"),
+    ],
+    "cooking": [
+        ("https://example.com/sourdough", "Sourdough bread", "Baking bread at home with a starter"),
+        ("https://example.com/pasta", "Fresh pasta", "Cooking pasta from scratch in your kitchen"),
+        ("https://example.com/curry", "Weeknight curry", "A quick cooking recipe for dinner"),
+        ("https://example.com/cake", "Lemon cake", "Baking a simple cake recipe"),
+    ],
+}
+
+
+class TagModelTest(TestCase):
+    def train(self, epochs=5):
+        documents, labels = [], []
+        for tag, pages in PAGES.items():
+            for url, title, description in pages:
+                documents.append(f"{title} {description} {url}")
+                labels.append({tag})
+
+        model = TagModel(2 ** 12)
+        model.partial_fit(vectorize(documents, 2 ** 12), labels, alpha=1e-4, epochs=epochs)
+        return model
+
+    def test_suggests_the_closest_tag(self):
+        model = self.train()
+        X = vectorize(["Python web programming", "Bread recipe"], 2 ** 12)
+
+        predictions = model.predict(X, threshold=0.5)
+        self.assertEqual([names[0][0] for names in predictions], ["python", "cooking"])
+
+        # Tags already on the bookmark aren't suggested again
+        self.assertNotIn("python", [name for name, _ in model.predict(X, threshold=0, exclude={"python"})[0]])
+
+    def test_artifacts_are_compact_and_keep_training(self):
+        model = self.train()
+        data = model.to_bytes()
+        self.assertLess(len(data), 8 * 1024)
+
+        restored = TagModel.from_bytes(data)
+        X = vectorize(["Python web programming"], 2 ** 12)
+        self.assertAlmostEqual(model.predict(X, threshold=0)[0][0][1], restored.predict(X, threshold=0)[0][0][1], places=2)
+
+        # partial_fit carries on from the stored step count, and picks up new tags
+        steps = restored.steps.copy()
+        restored.partial_fit(vectorize(["Hiking trails in the alps"], 2 ** 12), [{"travel"}], alpha=1e-4)
+        self.assertEqual(restored.tags, ["cooking", "python", "travel"])
+        self.assertTrue((restored.steps[:2] > steps).all())
+
+    def test_updates_are_fitted_over_the_features_in_use(self):
+        model = self.train()
+        X = vectorize(["Python web programming"], 2 ** 12)
+        # The update as made over every feature
+        expected = model._classifier(model.tags.index("python"), model.coef, alpha=1e-4)
+        expected.partial_fit(X, np.array([1]), classes=np.array([0, 1]))
+
+        in_use = len(np.union1d(X.indices, model.coef.indices))
+        with patch.object(SGDClassifier, "partial_fit", autospec=True, side_effect=SGDClassifier.partial_fit) as fit:
+            model.partial_fit(X, [{"python"}], alpha=1e-4)
+
+        # Each tag only densifies the words seen so far, not all N_FEATURES
+        self.assertEqual({call.args[1].shape[1] for call in fit.call_args_list}, {in_use})
+        self.assertLess(in_use, 2 ** 12 // 4)
+        np.testing.assert_allclose(model.coef[model.tags.index("python")].toarray(), expected.coef_, atol=1e-3)
+
+
+@override_settings(CATEGORISATION={'MIN_TAG_EXAMPLES': 2, 'THRESHOLD': 0.3})
+class CategorisationTest(APITestCase):
+    def setUp(self):
+        get_model_cache().clear()
+        self.user = User.objects.create_user(username="testuser", email="test@example.com", password="testpass")
+        self.client.force_authenticate(self.user)
+
+        # Learn from tags as the app would, with the task run inline
+        for target, kwargs in (
+            ("recommendations.signals.enqueue_embeddings", {}),
+            ("categorisation.signals.enqueue_tag_changes", {"side_effect": learn_tags}),
+            ("bookmarks.views.enrich_bookmark_metadata.delay", {}),
+        ):
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def create(self, url, title, description, tag_names=()):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/bookmarks/", {
+                "url": url, "title": title, "description": description, "tag_names": list(tag_names),
+            }, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response
+
+    def tag_pages(self):
+        for tag, pages in PAGES.items():
+            for url, title, description in pages:
+                self.create(url, title, description, [tag])
+
+    def test_tags_are_suggested_on_create(self):
+        response = self.create("https://example.com/first", "A first bookmark", "")
+        self.assertEqual(response.data["suggested_tags"], [])
+
+        self.tag_pages()
+        self.assertGreater(TagClassifier.objects.get(user=self.user).examples, 0)
+
+        response = self.create("https://example.com/flask", "Flask python tutorial", "Small python web apps")
+        self.assertEqual(response.data["suggested_tags"][0]["name"], "python")
+        self.assertNotIn("cooking", [tag["name"] for tag in response.data["suggested_tags"]])
+
+        # Tags given on create aren't suggested back
+        response = self.create("https://example.com/numpy", "Numpy python arrays", "", ["python"])
+        self.assertNotIn("python", [tag["name"] for tag in response.data["suggested_tags"]])
+
+    def test_suggestions_stay_within_budget(self):
+        self.tag_pages()
+        get_model_cache().clear()
+
+        # Loading the classifier alone overruns a zero budget, nothing is suggested
+        with self.settings(CATEGORISATION={'MIN_TAG_EXAMPLES': 2, 'THRESHOLD': 0.3, 'SUGGEST_BUDGET_MS': 0}):
+            response = self.create("https://example.com/flask", "Flask python tutorial", "Small python web apps")
+        self.assertEqual(response.data["suggested_tags"], [])
+
+    def test_users_without_a_classifier_skip_loading(self):
+        # One query turns them away, the classifiers aren't loaded for them
+        ml_services.reset("tag_models")
+        with self.assertNumQueries(1):
+            self.assertEqual(suggest_tags(self.user.id, "https://example.com/first", "A first bookmark"), [])
+        self.assertIsNone(ml_services.get_loaded("tag_models"))
+
+    def test_untagged_bookmarks_are_recategorised(self):
+        self.tag_pages()
+        bread = Bookmark.objects.create(
+            url="https://example.com/focaccia", title="Focaccia bread", description="Baking recipe", user=self.user,
+        )
+
+        self.assertEqual(recategorise_user(self.user.id), 1)
+        suggestion = TagSuggestion.objects.get(bookmark=bread)
+        self.assertEqual(suggestion.tag.name, "cooking")
+
+        response = self.client.get(f"/api/bookmarks/{bread.id}/suggested_tags/")
+        self.assertEqual(response.data["suggested_tags"], [{"name": "cooking", "score": round(suggestion.score, 3)}])
+
+        # Tagging the bookmark teaches the classifier and drops its suggestions
+        with self.captureOnCommitCallbacks(execute=True):
+            sync_bookmark_tags(bread, ["cooking"])
+        self.assertFalse(TagSuggestion.objects.filter(bookmark=bread).exists())
+
+    def test_new_classifier_is_trained_on_existing_tags(self):
+        # Tags imported before the classifier existed are used to bootstrap it
+        for tag, pages in PAGES.items():
+            for url, title, description in pages:
+                bookmark = Bookmark.objects.create(url=url, title=title, description=description, user=self.user)
+                sync_bookmark_tags(bookmark, [tag])
+
+        model = train_user_model(self.user.id)
+        self.assertEqual(model.tags, ["cooking", "python"])
+        self.assertEqual(list(model.positives), [4, 4])
+
+
+class SuggestionImportTest(TestCase):
+    def test_create_without_a_classifier_imports_no_sklearn(self):
+        # A fresh web process creating a bookmark for a user who has no classifier, in
+        # the test database and rolled back. Every metadata field is given so no
+        # enrichment task is queued.
+        code = (
+            "import django, sys\n"
+            "django.setup()\n"
+            "from django.contrib.auth import get_user_model\n"
+            "from django.db import transaction\n"
+            "from django.test.utils import setup_test_environment\n"
+            "from rest_framework.test import APIClient\n"
+            "setup_test_environment()\n"
+            "with transaction.atomic():\n"
+            "    user = get_user_model().objects.create_user(username='fresh', email='fresh@example.com', password='x')\n"
+            "    client = APIClient()\n"
+            "    client.force_authenticate(user)\n"
+            "    response = client.post('/api/bookmarks/', {\n"
+            "        'url': 'https://example.com/a', 'title': 'A page', 'description': 'About it',\n"
+            "        'preview_image': 'https://example.com/a.png', 'favicon': 'https://example.com/favicon.ico',\n"
+            "        'content_type': 'article',\n"
+            "    }, format='json')\n"
+            "    assert response.status_code == 201, response.data\n"
+            "    assert response.data['suggested_tags'] == [], response.data\n"
+            "    transaction.set_rollback(True)\n"
+            "print('loaded:' + ','.join(name for name in ('scipy', 'sklearn') if name in sys.modules))\n"
+        )
+        env = dict(os.environ, DB_NAME=connection.settings_dict['NAME'])
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip().splitlines()[-1], 'loaded:')
+
+
+class TopicClustersTest(TestCase):
+    def test_clusters_grow_incrementally(self):
+        rng = np.random.default_rng(0)
+        centres = np.eye(8, dtype=np.float32)[:2]
+        vectors = np.vstack([centre + 0.05 * rng.normal(size=(20, 8)) for centre in centres]).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        clusters = TopicClusters.fit(vectors, 2)
+        numbers, _ = clusters.assign(vectors)
+        self.assertEqual(len(set(numbers[:20])), 1)
+        self.assertEqual(len(set(numbers[20:])), 1)
+        self.assertEqual(sorted(clusters.counts), [20, 20])
+
+        # New vectors join the closest topic and pull its centroid toward them
+        restored = TopicClusters.from_bytes(clusters.to_bytes())
+        number = numbers[0]
+        before = restored.centroids[number].copy()
+        added, similarities = restored.partial_fit(np.array([centres[0]]))
+        self.assertEqual(added[0], number)
+        self.assertGreater(similarities[0], 0.9)
+        self.assertEqual(restored.counts[number], 21)
+        self.assertGreater(restored.centroids[number] @ centres[0], before @ centres[0])
+
+
+TOPIC_PAGES = {
+    "python": [
+        ("Python tutorial", "Learn python programming"),
+        ("Python web frameworks", "Django and flask python"),
+        ("Testing python", "Python tests with pytest"),
+        ("Python asyncio", "Concurrent python programming"),
+    ],
+    "cooking": [
+        ("Bread recipe", "Baking bread recipe at home"),
+        ("Pasta recipe", "Fresh pasta recipe at home"),
+        ("Curry recipe", "Quick curry recipe at home"),
+        ("Cake recipe", "Lemon cake recipe at home"),
+    ],
+}
+
+
+class TagLearningBatchTest(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch("recommendations.services.embedding_queue.get_redis_connection", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(username="testuser", email="test@example.com", password="testpass")
+        self.ids = []
+        for tag, pages in PAGES.items():
+            for url, title, description in pages:
+                bookmark = Bookmark.objects.create(url=url, title=title, description=description, user=self.user)
+                sync_bookmark_tags(bookmark, [tag])
+                self.ids.append(bookmark.id)
+
+    @patch("categorisation.tasks.flush_tag_changes.delay")
+    @patch("categorisation.tasks.flush_tag_changes.apply_async")
+    def test_changes_are_learned_once_per_user(self, schedule, flush_now):
+        # Each edit would otherwise update every tag's classifier
+        for bookmark_id in self.ids:
+            enqueue_tag_changes([bookmark_id])
+        schedule.assert_called_once_with(countdown=10)
+        flush_now.assert_not_called()
+
+        with patch("categorisation.services.categoriser.train_user_model") as train:
+            self.assertEqual(flush_tag_changes(), 1)
+        train.assert_called_once()
+        self.assertEqual(sorted(train.call_args.args[1]), self.ids)
+        self.assertEqual(self.redis.scard("categorisation:learn:pending"), 0)
+
+    def test_failed_batches_are_requeued(self):
+        with patch("categorisation.tasks.flush_tag_changes.apply_async"):
+            enqueue_tag_changes(self.ids[:2])
+
+        with patch("categorisation.services.categoriser.train_user_model", side_effect=RuntimeError), \
+                patch("categorisation.tasks.flush_tag_changes.apply_async") as schedule:
+            with self.assertRaises(RuntimeError):
+                flush_tag_changes()
+        self.assertEqual(self.redis.scard("categorisation:learn:pending"), 2)
+        schedule.assert_called_once_with(countdown=30)
+
+    @patch("categorisation.tasks.learn_tags.delay")
+    def test_without_redis_each_change_is_queued(self, delay):
+        with patch("recommendations.services.embedding_queue.get_redis_connection", side_effect=NotImplementedError):
+            enqueue_tag_changes(self.ids[:2])
+        delay.assert_called_once_with(self.ids[:2])
+
+
+@override_settings(
+    RECOMMENDATIONS={'ENCODER': 'recommendations.tests.HashingEncoder', 'MODEL': 'test-hashing'},
+    CATEGORISATION={'MIN_TOPIC_BOOKMARKS': 8, 'MAX_TOPICS': 2},
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class TopicsTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", email="test@example.com", password="testpass")
+        self.client.force_authenticate(self.user)
+
+        # Fit and label as the app would, with the tasks run inline
+        for target, kwargs in (
+            ("recommendations.signals.enqueue_embeddings", {}),
+            ("categorisation.signals.enqueue_tag_changes", {}),
+            ("categorisation.signals.fit_user_topics.delay", {"side_effect": fit_user_topics}),
+            ("categorisation.signals.label_user_topics.delay", {"side_effect": label_user_topics}),
+        ):
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def bookmark(self, title, description):
+        return Bookmark.objects.create(
+            url=f"https://example.com/{title.lower().replace(' ', '-')}", title=title, description=description, user=self.user,
+        )
+
+    def embed(self, bookmarks):
+        with self.captureOnCommitCallbacks(execute=True):
+            embed_bookmarks([bookmark.id for bookmark in bookmarks])
+
+    def create_pages(self):
+        pages = {tag: [self.bookmark(title, description) for title, description in items] for tag, items in TOPIC_PAGES.items()}
+        self.embed([bookmark for bookmarks in pages.values() for bookmark in bookmarks])
+        return pages
+
+    def test_bookmarks_are_clustered_and_labelled(self):
+        response = self.client.get("/api/bookmarks/topics/")
+        self.assertEqual(response.data, {"topics": [], "pending": True})
+
+        pages = self.create_pages()
+        record = TopicModel.objects.get(user=self.user)
+        self.assertEqual(record.fitted_size, 8)
+
+        response = self.client.get("/api/bookmarks/topics/", {"limit": 2})
+        self.assertFalse(response.data["pending"])
+        topics = {topic["terms"][0]: topic for topic in response.data["topics"]}
+        self.assertEqual(set(topics), {"python", "recipe"})
+        self.assertEqual(topics["python"]["count"], 4)
+        self.assertEqual(len(topics["python"]["bookmarks"]), 2)
+
+        # A topic's bookmarks through the bookmark list
+        response = self.client.get("/api/bookmarks/", {"topic": topics["recipe"]["id"]})
+        self.assertEqual({result["id"] for result in response.data["results"]}, {bookmark.id for bookmark in pages["cooking"]})
+
+    def test_new_bookmarks_join_existing_topics(self):
+        self.create_pages()
+        python = BookmarkTopic.objects.get(bookmark__title="Python tutorial").topic
+
+        bookmark = self.bookmark("Python packaging", "Publishing python packages")
+        with patch("categorisation.services.topics.TopicClusters.fit") as fit:
+            self.embed([bookmark])
+        fit.assert_not_called()
+
+        self.assertEqual(BookmarkTopic.objects.get(bookmark=bookmark).topic, python)
+        self.assertEqual(TopicModel.objects.get(user=self.user).size, 9)
+
+    def test_reembedded_bookmarks_are_not_counted_again(self):
+        self.create_pages()
+        bookmark = Bookmark.objects.get(title="Python tutorial")
+        Bookmark.objects.filter(pk=bookmark.pk).update(title="Python tutorial for beginners")
+        self.embed([bookmark])
+
+        record = TopicModel.objects.get(user=self.user)
+        self.assertEqual(record.size, 8)
+        self.assertEqual(TopicClusters.from_bytes(record.artifact).counts.sum(), 8)
+
+    def test_fits_run_without_the_lock(self):
+        self.create_pages()
+        TopicModel.objects.filter(user=self.user).update(size=16)
+        late = self.bookmark("Python packaging", "Publishing python packages")
+        fit = TopicClusters.fit
+
+        def fit_while_embedding(*args, **kwargs):
+            # update_topics isn't held up, the saved fit picks up what it assigned
+            self.embed([late])
+            return fit(*args, **kwargs)
+
+        with patch("categorisation.signals.fit_user_topics.delay"), \
+                patch("categorisation.services.topics.TopicClusters.fit", side_effect=fit_while_embedding):
+            self.assertIsNotNone(fit_topics(self.user.id))
+
+        record = TopicModel.objects.get(user=self.user)
+        self.assertEqual((record.fitted_size, record.size, record.generation), (9, 9, 2))
+        self.assertTrue(BookmarkTopic.objects.filter(bookmark=late).exists())
+
+        # A fit that finds another one saved meanwhile leaves it be
+        def fit_after_another(*args, **kwargs):
+            TopicModel.objects.filter(user=self.user).update(generation=F("generation") + 1)
+            return fit(*args, **kwargs)
+
+        TopicModel.objects.filter(user=self.user).update(size=18)
+        with patch("categorisation.services.topics.TopicClusters.fit", side_effect=fit_after_another):
+            self.assertIsNone(fit_topics(self.user.id))
+        self.assertEqual(TopicModel.objects.get(user=self.user).fitted_size, 9)
+
+    def test_overviews_are_cached(self):
+        self.create_pages()
+        self.client.get("/api/bookmarks/topics/")
+
+        # Only the topics' version is read
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/bookmarks/topics/")
+        self.assertEqual(sum(topic["count"] for topic in response.data["topics"]), 8)
+
+        # Changed topics are read again: the version, topics, previews, bookmarks and their tags
+        label_user_topics(self.user.id)
+        with self.assertNumQueries(5):
+            self.client.get("/api/bookmarks/topics/")
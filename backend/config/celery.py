@@ -1,6 +1,7 @@
 from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
+from celery.signals import worker_process_init
 
 # Set default Django settings module
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
@@ -14,6 +15,15 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Auto-discover tasks from installed Django apps
 app.autodiscover_tasks()
 
+@worker_process_init.connect
+def preload_ml_services(**kwargs):
+    # Each prefork child loads its own copy, torch and faiss thread pools don't survive a fork
+    from django.conf import settings
+    from config.ml_services import ml_services
+
+    ml_services.preload(settings.ML_PRELOAD)
+
+
 # Test task
 @app.task(bind=True)
 def debug_task(self):
@@ -0,0 +1,102 @@
+"""
+Registry of the ML-backed services: the sentence encoder, the vector indexes and the
+tag classifiers.
+
+torch, faiss and scikit-learn take seconds and hundreds of MB to import, and most
+processes (web workers serving CRUD, metadata workers) never need them. Apps
+register each service as the dotted path of a factory in AppConfig.ready(), and
+nothing is imported until a service is first asked for. Workers that run the ML
+tasks can preload services as they boot by listing them in settings.ML_PRELOAD
+(see config/celery.py).
+"""
+import logging
+import threading
+import time
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class MLServiceRegistry:
+    """
+    Named process-wide services, created on first use by their factory
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._settings = {}
+        self._services = {}
+        self._load_times = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, factory, setting=None):
+        """
+        Register a service. factory is the dotted path of a callable taking no
+        arguments, setting the name of a setting the service is rebuilt after
+        (in tests, through override_settings).
+        """
+        self._factories[name] = factory
+        self._settings[name] = setting
+
+    @property
+    def names(self):
+        return list(self._factories)
+
+    def get(self, name):
+        """
+        Return the service, importing and creating it on first use
+        """
+        service = self._services.get(name)
+        if service is not None:
+            return service
+
+        with self._lock:
+            if name not in self._services:
+                started = time.perf_counter()
+                self._services[name] = import_string(self._factories[name])()
+                self._load_times[name] = time.perf_counter() - started
+            return self._services[name]
+
+    def get_loaded(self, name):
+        """
+        Return the service if this process already created it, None otherwise
+        """
+        return self._services.get(name)
+
+    def reset(self, name):
+        with self._lock:
+            self._services.pop(name, None)
+
+    def reset_for_setting(self, setting):
+        for name, service_setting in self._settings.items():
+            if service_setting == setting:
+                self.reset(name)
+
+    def preload(self, names):
+        """
+        Create the given services now, rather than on the first request or task that
+        needs them
+        """
+        for name in names:
+            if name not in self._factories:
+                logger.warning(f"Unknown ML service {name!r}, registered services are {', '.join(self.names)}")
+                continue
+            self.get(name)
+            logger.info(f"Preloaded {name} in {self._load_times[name]:.2f}s")
+
+    def stats(self):
+        """
+        Seconds each loaded service took to create
+        """
+        return {name: round(seconds, 3) for name, seconds in self._load_times.items() if name in self._services}
+
+
+ml_services = MLServiceRegistry()
+
+
+@receiver(setting_changed)
+def reset_ml_services(setting, **kwargs):
+    ml_services.reset_for_setting(setting)
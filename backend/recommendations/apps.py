@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class RecommendationsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "recommendations"
+
+    def ready(self):
+        from config.ml_services import ml_services
+        from . import signals  # noqa: F401
+
+        # Loaded on first use, see config/ml_services.py
+        ml_services.register(
+            'embedding_encoder', 'recommendations.services.embeddings.load_encoder', setting='RECOMMENDATIONS',
+        )
+        ml_services.register(
+            'vector_indexes', 'recommendations.services.vector_index.IndexRegistry', setting='RECOMMENDATIONS',
+        )
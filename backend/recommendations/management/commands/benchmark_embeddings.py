@@ -0,0 +1,112 @@
+import os
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from bookmarks.models import Bookmark
+from recommendations.services.embeddings import (
+    VECTOR_DTYPES, bookmark_text, get_recommendation_settings, vector_from_bytes, vector_to_bytes,
+)
+
+WORDS = (
+    'python django web framework tutorial guide database query index performance cache '
+    'server deploy docker kubernetes cloud security login token api design pattern test '
+    'recipe bread baking kitchen travel city museum history music album review film book '
+    'article research paper learning model vector search ranking news weekly notes'
+).split()
+
+
+def synthetic_texts(count, seed=0):
+    """
+    Bookmark shaped texts: a short title, a sentence or two of description and tags
+    """
+    rng = np.random.default_rng(seed)
+    texts = []
+    for _ in range(count):
+        title = ' '.join(rng.choice(WORDS, rng.integers(4, 10))).capitalize()
+        description = ' '.join(rng.choice(WORDS, rng.integers(15, 45))).capitalize() + '.'
+        tags = ', '.join(sorted(set(rng.choice(WORDS, 3))))
+        texts.append(f'{title}\n{description}\nTags: {tags}')
+    return texts
+
+
+def parse_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure embedding throughput in texts/sec for each batch size and torch thread "
+        "count, and the size and accuracy of each vector storage type."
+    )
+
+    def add_arguments(self, parser):
+        config = get_recommendation_settings()
+        parser.add_argument('--texts', type=int, default=1024, help="Texts encoded per run")
+        parser.add_argument('--batch-sizes', default='1,16,64,128,256', help="Comma separated texts per forward pass")
+        parser.add_argument(
+            '--threads', default=','.join(str(n) for n in (1, 2, 4, os.cpu_count() or 1) if n <= (os.cpu_count() or 1)),
+            help="Comma separated torch thread counts",
+        )
+        parser.add_argument('--encoder', default=config['ENCODER'], help="Dotted path of the encoder class")
+        parser.add_argument('--model', default=config['MODEL'])
+        parser.add_argument('--from-db', action='store_true', help="Embed the texts of the newest bookmarks instead of synthetic ones")
+
+    def handle(self, *args, **options):
+        texts = self.load_texts(options['texts'], options['from_db'])
+        batch_sizes = parse_list(options['batch_sizes'])
+
+        started = time.perf_counter()
+        encoder = import_string(options['encoder'])(options['model'])
+        self.stdout.write(f"Loaded {encoder.name} ({encoder.dimension} dimensions) in {time.perf_counter() - started:.1f}s")
+        self.stdout.write(f"{len(texts)} texts, {sum(map(len, texts)) / len(texts):.0f} characters on average")
+
+        self.stdout.write(f"\n{'threads':<10}{'batch':>8}{'texts/sec':>12}{'ms/text':>10}")
+        vectors = None
+        for threads in parse_list(options['threads']):
+            if hasattr(encoder, 'set_threads'):
+                encoder.set_threads(threads)
+            # Warm up, the first forward passes allocate
+            encoder.encode(texts[:max(batch_sizes)], batch_size=max(batch_sizes))
+
+            for batch_size in batch_sizes:
+                started = time.perf_counter()
+                vectors = encoder.encode(texts, batch_size=batch_size)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"{threads:<10}{batch_size:>8}{len(texts) / elapsed:>12.0f}{elapsed * 1000 / len(texts):>10.2f}"
+                )
+
+        self.compare_storage(vectors)
+
+    def load_texts(self, count, from_db):
+        if not from_db:
+            return synthetic_texts(count)
+
+        config = get_recommendation_settings()
+        bookmarks = Bookmark.objects.order_by('-id').prefetch_related('tags')[:count]
+        texts = [
+            bookmark_text(bookmark, [tag.name for tag in bookmark.tags.all()], config['MAX_TEXT_LENGTH'])
+            for bookmark in bookmarks
+        ]
+        return [text for text in texts if text] or synthetic_texts(count)
+
+    def compare_storage(self, vectors):
+        """
+        Bytes per vector and how far decoded vectors drift from the float32 originals
+        """
+        self.stdout.write(f"\n{'dtype':<10}{'bytes':>8}{'mean cos':>12}{'min cos':>12}{'decode':>14}")
+        for dtype in VECTOR_DTYPES:
+            packed = [vector_to_bytes(vector, dtype) for vector in vectors]
+
+            started = time.perf_counter()
+            decoded = np.vstack([vector_from_bytes(data, dtype) for data in packed])
+            elapsed = time.perf_counter() - started
+
+            similarity = np.einsum('ij,ij->i', decoded, vectors)
+            self.stdout.write(
+                f"{dtype:<10}{len(packed[0]):>8}{similarity.mean():>12.6f}{similarity.min():>12.6f}"
+                f"{elapsed * 1e6 / len(packed):>10.2f}us/v"
+            )
@@ -0,0 +1,76 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from bookmarks.services.search import SEARCH_MODES
+from bookmarks.views import BookmarkViewSet
+from recommendations.services.hybrid_search import encode_query
+
+QUERIES = (
+    'python', 'django tutorial', 'web framework', 'machine learning papers', 'bread recipe',
+    'docker deploy', 'search ranking', 'music review', 'cloud security token', 'history museum city',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure search latency (p50 and p95 over whole requests, serialization included) "
+        "for each search mode over one user's bookmarks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', help="Username whose bookmarks are searched")
+        parser.add_argument('--modes', default=','.join(SEARCH_MODES), help="Comma separated search modes")
+        parser.add_argument('--queries', default=','.join(QUERIES), help="Comma separated queries")
+        parser.add_argument('--runs', type=int, default=20, help="Runs of every query per mode")
+        parser.add_argument('--cold-queries', action='store_true', help="Encode hybrid queries on every run rather than once")
+
+    def handle(self, *args, **options):
+        # Requests come from APIRequestFactory's testserver host, which next links are built from
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            self.benchmark(options)
+
+    def benchmark(self, options):
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user named {options['user']!r}")
+
+        queries = [query for query in options['queries'].split(',') if query]
+        view = BookmarkViewSet.as_view({'get': 'search'})
+        factory = APIRequestFactory()
+
+        def search(query, mode):
+            request = factory.get('/api/bookmarks/search/', {'q': query, 'mode': mode})
+            force_authenticate(request, user=user)
+            response = view(request)
+            if response.status_code != 200:
+                raise CommandError(f"{mode} search for {query!r} answered {response.status_code}: {response.data}")
+            return response
+
+        self.stdout.write(f"{'mode':<10}{'p50':>10}{'p95':>10}{'max':>10}{'results':>10}")
+        for mode in options['modes'].split(','):
+            # Warm up: loads the user's index and fills Postgres' buffers
+            for query in queries:
+                search(query, mode)
+
+            timings, results = [], []
+            for _ in range(options['runs']):
+                for query in queries:
+                    if options['cold_queries']:
+                        encode_query.cache_clear()
+                    started = time.perf_counter()
+                    response = search(query, mode)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    results.append(len(response.data['results']))
+
+            timings.sort()
+            self.stdout.write(
+                f"{mode:<10}{statistics.median(timings):>8.1f}ms{timings[int(len(timings) * 0.95)]:>8.1f}ms"
+                f"{timings[-1]:>8.1f}ms{statistics.mean(results):>10.1f}"
+            )
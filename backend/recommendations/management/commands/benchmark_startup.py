@@ -0,0 +1,105 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from config.ml_services import ml_services
+
+HEAVY_MODULES = ('numpy', 'scipy', 'sklearn', 'faiss', 'torch', 'transformers', 'sentence_transformers')
+
+# Each scenario runs in a fresh interpreter, then reports which heavy modules it imported
+SCENARIOS = {
+    'check': (
+        "from django.core.management import execute_from_command_line\n"
+        "execute_from_command_line(['manage.py', 'check'])\n"
+    ),
+    # What a gunicorn worker loads before serving: the WSGI app and the URLconf, with every view
+    'web': (
+        "import importlib\n"
+        "from django.core.wsgi import get_wsgi_application\n"
+        "from django.conf import settings\n"
+        "get_wsgi_application()\n"
+        "importlib.import_module(settings.ROOT_URLCONF)\n"
+    ),
+    # What a Celery worker process loads as it boots: Django, every app's tasks and the
+    # worker_process_init handlers, which preload ML_PRELOAD
+    'worker': (
+        "from celery.signals import worker_process_init\n"
+        "from config import celery_app\n"
+        "celery_app.loader.import_default_modules()\n"
+        "worker_process_init.send(sender=None)\n"
+    ),
+}
+
+REPORT = (
+    "\nimport json, sys\n"
+    "print(json.dumps([name for name in {modules!r} if name in sys.modules]))\n"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the startup time and peak RSS of manage.py check, a web worker and a "
+        "Celery worker process, with and without the ML services preloaded."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help="Runs per scenario, the median is reported")
+        parser.add_argument(
+            '--preload', default=','.join(ml_services.names),
+            help="Comma separated ML services the ML worker scenario preloads",
+        )
+
+    def handle(self, *args, **options):
+        runs = [
+            ('check', SCENARIOS['check'], ''),
+            ('web', SCENARIOS['web'], ''),
+            ('worker', SCENARIOS['worker'], ''),
+            ('ml worker', SCENARIOS['worker'], options['preload']),
+        ]
+
+        self.stdout.write(f"{'scenario':<12}{'time':>10}{'peak RSS':>12}  heavy modules imported")
+        for name, code, preload in runs:
+            timings, peaks, modules = [], [], None
+            for _ in range(options['runs']):
+                elapsed, peak, modules = self.run(code, preload)
+                timings.append(elapsed)
+                peaks.append(peak)
+
+            self.stdout.write(
+                f"{name:<12}{statistics.median(timings) * 1000:>8.0f}ms{statistics.median(peaks) / 1024:>10.0f}MB"
+                f"  {', '.join(modules) or '-'}"
+            )
+
+    def run(self, code, preload):
+        """
+        Returns:
+            (seconds, peak RSS in KB, heavy modules imported) of one run in a new process
+        """
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'backend.settings'))
+        env['ML_PRELOAD'] = preload
+
+        with tempfile.TemporaryFile() as errors:
+            started = time.perf_counter()
+            process = subprocess.Popen(
+                [sys.executable, '-c', code + REPORT.format(modules=HEAVY_MODULES)],
+                cwd=settings.BASE_DIR, env=env, stdout=subprocess.PIPE, stderr=errors,
+            )
+            output = process.stdout.read()
+            # wait4 rather than wait() to get the child's own peak RSS
+            _, status, usage = os.wait4(process.pid, 0)
+            elapsed = time.perf_counter() - started
+            process.returncode = os.waitstatus_to_exitcode(status)
+            process.stdout.close()
+
+            if process.returncode:
+                errors.seek(0)
+                raise CommandError(f"Scenario failed:\n{errors.read().decode()[-2000:]}")
+
+        return elapsed, usage.ru_maxrss, json.loads(output.decode().strip().splitlines()[-1])
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.6 on 2026-10-17 05:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("bookmarks", "0012_bookmark_url_validators"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BookmarkEmbedding",
+            fields=[
+                (
+                    "bookmark",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="embedding",
+                        serialize=False,
+                        to="bookmarks.bookmark",
+                    ),
+                ),
+                ("vector", models.BinaryField()),
+                ("model", models.CharField(max_length=100)),
+                ("text_hash", models.CharField(max_length=64)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "updated_at"], name="embedding_user_updated_idx"
+                    )
+                ],
+            },
+        ),
+    ]
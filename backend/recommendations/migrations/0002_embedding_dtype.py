@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 05:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommendations", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bookmarkembedding",
+            name="dtype",
+            field=models.CharField(default="float32", max_length=8),
+        ),
+    ]
@@ -1,3 +1,34 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class BookmarkEmbedding(models.Model):
+    """
+    Sentence embedding of a bookmark's title, description and tags.
+
+    The vector is stored normalized, packed as `dtype` (see vector_to_bytes). Per-user
+    FAISS indexes are built from these rows (see recommendations/services/vector_index.py),
+    so they never need the encoder to be rebuilt.
+    """
+    bookmark = models.OneToOneField(
+        'bookmarks.Bookmark', on_delete=models.CASCADE, primary_key=True, related_name='embedding'
+    )
+    # Copied from the bookmark so a user's vectors can be read without a join
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+    vector = models.BinaryField()
+    # Rows written before VECTOR_DTYPE existed are float32
+    dtype = models.CharField(max_length=8, default='float32')
+    # Encoder name, vectors from different models can't be compared
+    model = models.CharField(max_length=100)
+    # sha256 of the embedded text, unchanged text isn't embedded again
+    text_hash = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Index loads and the incremental sync read a user's vectors by update time
+            models.Index(fields=['user', 'updated_at'], name='embedding_user_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f'Embedding of bookmark {self.bookmark_id}'
@@ -0,0 +1,90 @@
+# recommendations/services/embedding_queue.py
+import threading
+
+from django_redis import get_redis_connection
+
+# A batch window lasts until its flush task runs. If that task is lost the window
+# expires after this many seconds, and the next bookmark opens a new one.
+WINDOW_TIMEOUT = 60
+
+
+class PendingEmbeddings:
+    """
+    Ids of bookmarks waiting to be embedded, in a Redis set shared by every process.
+
+    Web processes add ids as bookmarks change, and embedding tasks pop them in batches,
+    so a bulk import or a burst of edits is encoded in a few large forward passes
+    rather than one small one per bookmark. The set dedupes ids changed again before
+    their batch ran.
+    """
+
+    def __init__(self, key='embeddings:pending', cache_alias='default'):
+        self.key = key
+        self.window_key = f'{key}:window'
+        self.cache_alias = cache_alias
+
+    @property
+    def connection(self):
+        """
+        The Redis connection, None if the cache isn't a django-redis cache
+        """
+        try:
+            return get_redis_connection(self.cache_alias)
+        except NotImplementedError:
+            return None
+
+    def add(self, bookmark_ids):
+        """
+        Add ids to the pending set, opening a batch window if none is open
+
+        Returns:
+            (ids added that weren't pending yet, pending count, whether a window was opened),
+            or None if the cache isn't Redis
+
+        Raises:
+            RedisError if Redis is unreachable
+        """
+        connection = self.connection
+        if connection is None:
+            return None
+
+        pipeline = connection.pipeline(transaction=False)
+        pipeline.sadd(self.key, *bookmark_ids)
+        pipeline.scard(self.key)
+        pipeline.set(self.window_key, 1, nx=True, ex=WINDOW_TIMEOUT)
+        added, pending, opened = pipeline.execute()
+        return added, pending, bool(opened)
+
+    def requeue(self, bookmark_ids):
+        """
+        Put back ids a failed batch popped, the next flush picks them up
+        """
+        self.connection.sadd(self.key, *bookmark_ids)
+
+    def pop(self, count):
+        return [int(bookmark_id) for bookmark_id in self.connection.spop(self.key, count) or []]
+
+    def close_window(self):
+        """
+        Called as a flush starts: ids added from now on open a new window, and are
+        either popped by this flush or by the one their window schedules
+        """
+        self.connection.delete(self.window_key)
+
+
+_pending = None
+_pending_lock = threading.Lock()
+
+
+def get_pending_embeddings():
+    """
+    Return the process-wide pending embeddings set
+    """
+    global _pending
+
+    if _pending is None:
+        with _pending_lock:
+            if _pending is None:
+                _pending = PendingEmbeddings()
+
+    return _pending
@@ -0,0 +1,174 @@
+# recommendations/services/embeddings.py
+import hashlib
+import struct
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.dispatch import Signal
+from django.utils.module_loading import import_string
+
+from config.ml_services import ml_services
+
+# Defaults, overridable through settings.RECOMMENDATIONS
+DEFAULT_RECOMMENDATION_SETTINGS = {
+    'ENCODER': 'recommendations.services.embeddings.SentenceTransformerEncoder',
+    'MODEL': 'sentence-transformers/all-MiniLM-L6-v2',
+    'MAX_TEXT_LENGTH': 2000,                 # Characters embedded per bookmark
+    'BATCH_SIZE': 256,                       # Bookmarks coalesced into one embedding task
+    'BATCH_WINDOW': 2,                       # Seconds a batch waits to fill up
+    'FLUSH_RETRY_DELAY': 30,                 # Seconds before a batch that failed to embed is tried again
+    'ENCODE_BATCH_SIZE': 64,                 # Texts per forward pass of the model
+    'THREADS': None,                         # Torch threads per worker process, None for torch's default
+    'VECTOR_DTYPE': 'float16',               # How vectors are stored: float32, float16 or int8
+    'FLAT_MAX_VECTORS': 20_000,              # Exact search up to this many vectors per user, IVF above
+    'IVF_NPROBE': 16,
+    'MAX_INDEXES': 200,                      # Per-user indexes each process keeps in memory
+    'MAX_INDEX_BYTES': 1024 ** 3,            # and the most memory their vectors may take
+    'SYNC_INTERVAL': 1,                      # Seconds between reads of vectors other processes stored
+    'SIMILAR_LIMIT': 10,
+    'MAX_SIMILAR_LIMIT': 50,
+    'HYBRID_CANDIDATES': 100,                # Bookmarks each side of a hybrid search contributes
+    'RRF_K': 60,                             # Reciprocal rank fusion constant, higher flattens the ranks
+    'HYBRID_MIN_SIMILARITY': 0.2,            # Vector results less similar than this to the query are dropped
+    'HYBRID_VECTOR_TIMEOUT_MS': 250,         # Hybrid searches fall back to keyword results past this
+    'HYBRID_THREADS': 4,                     # Threads per process running the vector side of hybrid searches
+}
+
+# Sent by embed_bookmarks once per user with user_id, bookmark_ids, their new vectors
+# (an array with a row per id) and the model name, after the vectors are stored
+bookmarks_embedded = Signal()
+
+
+def get_recommendation_settings():
+    """
+    Merge the configured recommendation settings over the defaults
+    """
+    config = dict(DEFAULT_RECOMMENDATION_SETTINGS)
+    config.update(getattr(settings, 'RECOMMENDATIONS', {}))
+    return config
+
+
+class SentenceTransformerEncoder:
+    """
+    Encoder backed by a sentence-transformers model, run on CPU.
+
+    Encoders take the model name plus `threads` and `batch_size` keywords, and expose
+    `name`, `dimension` and `encode(texts, batch_size=None)` returning an
+    (n, dimension) float32 array of unit length rows.
+    """
+
+    def __init__(self, model_name, threads=None, batch_size=64):
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImproperlyConfigured("Embeddings need the sentence-transformers package")
+
+        self.torch = torch
+        self.set_threads(threads)
+
+        self.name = model_name
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name, device='cpu')
+        self.model.eval()
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def set_threads(self, threads):
+        """
+        Torch threads are process wide. Prefork workers should split the cores between
+        them, torch's default of one thread per core oversubscribes the machine.
+        """
+        if not threads:
+            return
+        self.torch.set_num_threads(threads)
+        try:
+            self.torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Can only be set before the first parallel op of the process
+            pass
+
+    def encode(self, texts, batch_size=None):
+        with self.torch.inference_mode():
+            vectors = self.model.encode(
+                list(texts),
+                batch_size=batch_size or self.batch_size,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+            )
+        return vectors.astype(np.float32, copy=False)
+
+
+def load_encoder():
+    """
+    Factory of the embedding_encoder service (see config/ml_services.py)
+    """
+    config = get_recommendation_settings()
+    return import_string(config['ENCODER'])(
+        config['MODEL'], threads=config['THREADS'], batch_size=config['ENCODE_BATCH_SIZE'],
+    )
+
+
+def get_encoder():
+    """
+    Return the process-wide encoder, loading the model on first use. Each worker
+    process loads it once and keeps it for every batch it embeds.
+    """
+    return ml_services.get('embedding_encoder')
+
+
+# Vectors
+
+VECTOR_DTYPES = ('float32', 'float16', 'int8')
+
+
+def vector_to_bytes(vector, dtype='float32'):
+    """
+    Pack a unit vector for storage. float16 halves the size for a cosine error under
+    1e-6, int8 stores a float32 scale and one byte per dimension (about a quarter of
+    float32) for an error under 1e-4.
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    if dtype == 'float32':
+        return vector.tobytes()
+    if dtype == 'float16':
+        return vector.astype(np.float16).tobytes()
+    if dtype == 'int8':
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        codes = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return struct.pack('<f', scale) + codes.tobytes()
+    raise ValueError(f"Unknown vector dtype {dtype!r}")
+
+
+def vector_from_bytes(data, dtype='float32'):
+    """
+    Unpack a stored vector as float32, the only type the indexes take
+    """
+    data = bytes(data)
+    if dtype == 'float32':
+        return np.frombuffer(data, dtype=np.float32)
+    if dtype == 'float16':
+        vector = np.frombuffer(data, dtype=np.float16).astype(np.float32)
+    elif dtype == 'int8':
+        scale, = struct.unpack_from('<f', data)
+        vector = np.frombuffer(data, dtype=np.int8, offset=4).astype(np.float32) * scale
+    else:
+        raise ValueError(f"Unknown vector dtype {dtype!r}")
+    # Rounding shrinks or stretches the vector a little, inner products are only
+    # cosine similarities for unit vectors
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+def bookmark_text(bookmark, tag_names, max_length=None):
+    """
+    The text a bookmark is embedded from: title, description and tags
+    """
+    max_length = max_length or get_recommendation_settings()['MAX_TEXT_LENGTH']
+    parts = [bookmark.title or '', bookmark.description or '']
+    if tag_names:
+        parts.append('Tags: ' + ', '.join(sorted(tag_names)))
+    return '\n'.join(part for part in parts if part)[:max_length]
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
@@ -0,0 +1,141 @@
+# recommendations/services/hybrid_search.py
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import lru_cache
+
+from django.db.models import F, FloatField, Func
+
+from bookmarks.services.search import build_search_query, full_text_search, highlights
+from config.ml_services import ml_services
+from .embeddings import get_encoder, get_recommendation_settings
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(workers):
+    """
+    Threads the vector side of hybrid searches runs on, started on first use so
+    forked workers each get their own
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hybrid-search')
+    return _executor
+
+
+@lru_cache(maxsize=1024)
+def encode_query(model, text):
+    # Every page of a search runs it again, the model is part of the key so a
+    # changed model never serves stale vectors
+    vector = get_encoder().encode([text])[0]
+    vector.setflags(write=False)
+    return vector
+
+
+def vector_candidates(index, model, text, limit, min_similarity):
+    """
+    Runs on the executor. The encoder and faiss release the GIL, so this overlaps with
+    the keyword query on the request thread.
+    """
+    # Nearest neighbours always exist, the cutoff keeps unrelated bookmarks out
+    hits = index.search(encode_query(model, text), limit)
+    return [(bookmark_id, similarity) for bookmark_id, similarity in hits if similarity >= min_similarity]
+
+
+def reciprocal_rank_fusion(rankings, k):
+    """
+    Score each id by the sum of 1 / (k + position) over the rankings it appears in.
+    Only positions count, so ts_rank and cosine similarities never have to be put on
+    one scale, and ids found by several rankings rise to the top.
+
+    Returns:
+        Dict of id to fused score
+    """
+    scores = {}
+    for ranking in rankings:
+        for position, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + position)
+    return scores
+
+
+class ScoreById(Func):
+    """
+    The score of each row's id in an {id: score} dict, NULL for ids not in it.
+
+    Two array parameters and an array_position() lookup, a Case with a When per id
+    takes Django tens of milliseconds to build for a few hundred ids.
+    """
+    output_field = FloatField()
+
+    def __init__(self, scores):
+        super().__init__(F('id'))
+        self.scores = scores
+
+    def as_sql(self, compiler, connection, **extra_context):
+        column, params = compiler.compile(self.source_expressions[0])
+        sql = f'(%s::float8[])[array_position(%s::bigint[], {column})]'
+        return sql, [list(self.scores.values()), list(self.scores), *params]
+
+
+def hybrid_search(queryset, text, user_id, config=None):
+    """
+    Full text search and a nearest neighbour search of the user's bookmark embeddings,
+    fused with reciprocal rank fusion.
+
+    Each side contributes its top HYBRID_CANDIDATES bookmarks, vector results only at
+    HYBRID_MIN_SIMILARITY or above. The vector side (encoding the query and searching
+    the index) runs on another thread while the full text query runs on this one; if it
+    takes longer than HYBRID_VECTOR_TIMEOUT_MS only the keyword results are used.
+
+    Results are annotated with `rank` (the fused score), `keyword_score` (the full text
+    rank) and `vector_score` (cosine similarity), None for the side that didn't find
+    them, plus highlights as in full text search.
+
+    Returns:
+        Queryset ordered by rank, which the keyset pagination pages through
+
+    Raises:
+        ImproperlyConfigured if faiss or sentence-transformers isn't installed
+    """
+    config = config or get_recommendation_settings()
+    limit = config['HYBRID_CANDIDATES']
+
+    # Loading or syncing the index reads the database, keep that on the request's connection
+    index = ml_services.get('vector_indexes').get(user_id)
+    future = get_executor(config['HYBRID_THREADS']).submit(
+        vector_candidates, index, config['MODEL'], text.strip(), limit, config['HYBRID_MIN_SIMILARITY'],
+    )
+
+    keyword_hits = list(full_text_search(queryset, text).values_list('id', 'rank')[:limit])
+
+    try:
+        vector_hits = future.result(timeout=config['HYBRID_VECTOR_TIMEOUT_MS'] / 1000)
+    except TimeoutError:
+        logger.warning(f"Vector search for user {user_id} took over {config['HYBRID_VECTOR_TIMEOUT_MS']}ms, using keyword results only")
+        vector_hits = []
+
+    fused = reciprocal_rank_fusion(
+        [[bookmark_id for bookmark_id, _ in keyword_hits], [bookmark_id for bookmark_id, _ in vector_hits]],
+        config['RRF_K'],
+    )
+    if not fused:
+        return queryset.none()
+
+    # Bookmarks deleted since the index last synced drop out here
+    results = queryset.filter(id__in=fused).annotate(
+        rank=ScoreById(fused),
+        keyword_score=ScoreById(dict(keyword_hits)),
+        vector_score=ScoreById(dict(vector_hits)),
+    )
+
+    query = build_search_query(text)
+    if query is not None:
+        results = results.annotate(**highlights(query))
+
+    return results.order_by('-rank', '-id')
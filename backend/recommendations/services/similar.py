@@ -0,0 +1,46 @@
+# recommendations/services/similar.py
+from django.db.models import Prefetch
+
+from bookmarks.models import Bookmark, Tag
+from config.ml_services import ml_services
+
+
+def similar_bookmarks(bookmark, limit):
+    """
+    The user's bookmarks closest in meaning to bookmark, each with a `similarity`
+    attribute (cosine similarity of their embeddings).
+
+    Costs the index search plus one query for the matches and one for their tags,
+    the bookmark's own vector is read from the index.
+
+    Returns:
+        List of bookmarks, most similar first, or None if the bookmark has no
+        embedding yet
+
+    Raises:
+        ImproperlyConfigured if faiss isn't installed
+    """
+    index = ml_services.get('vector_indexes').get(bookmark.user_id)
+    vector = index.vector(bookmark.id)
+    if vector is None:
+        return None
+
+    hits = index.search(vector, limit, exclude={bookmark.id})
+
+    matches = Bookmark.objects.filter(user_id=bookmark.user_id, id__in=[bookmark_id for bookmark_id, _ in hits])
+    matches = {
+        match.id: match
+        for match in matches.prefetch_related(Prefetch('tags', queryset=Tag.objects.only('id', 'name')))
+    }
+
+    # Bookmarks deleted by another process may linger in this one's index
+    missing = [bookmark_id for bookmark_id, _ in hits if bookmark_id not in matches]
+    if missing:
+        index.remove(missing)
+
+    results = []
+    for bookmark_id, similarity in hits:
+        if bookmark_id in matches:
+            matches[bookmark_id].similarity = similarity
+            results.append(matches[bookmark_id])
+    return results
@@ -0,0 +1,243 @@
+# recommendations/services/vector_index.py
+import datetime
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+from config.ml_services import ml_services
+from ..models import BookmarkEmbedding
+from .embeddings import get_recommendation_settings, vector_from_bytes
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Syncs also read rows stamped this long before the previous sync started, they may
+# have been committed after it by a slow transaction or a worker with a skewed clock
+SYNC_OVERLAP = datetime.timedelta(seconds=5)
+
+
+class UserIndex:
+    """
+    FAISS index over one user's bookmark embeddings, keyed by bookmark id. Vectors are
+    unit length, so inner product is cosine similarity.
+
+    Search is exact up to FLAT_MAX_VECTORS and goes through an IVF index above that,
+    trained on the user's own vectors. Changes are applied in place: the process that
+    writes embeddings upserts them directly, other processes pick up rows updated since
+    their last sync. The index is only rebuilt when it outgrows the
+    flat index, or doubles in size since IVF training.
+    """
+
+    def __init__(self, user_id, config=None):
+        self.user_id = user_id
+        self.config = config or get_recommendation_settings()
+        self.lock = threading.Lock()
+
+        self.index = None
+        self.trained_size = None
+        self.synced_at = None
+
+    @property
+    def size(self):
+        return self.index.ntotal if self.index is not None else 0
+
+    @property
+    def nbytes(self):
+        # The float32 vectors, which dominate the memory an index holds
+        return self.size * self.index.d * 4 if self.index is not None else 0
+
+    def _read(self, since=None):
+        rows = BookmarkEmbedding.objects.filter(user_id=self.user_id, model=self.config['MODEL'])
+        if since is not None:
+            rows = rows.filter(updated_at__gte=since - SYNC_OVERLAP)
+
+        ids, vectors = [], []
+        for bookmark_id, vector, dtype in rows.values_list('bookmark_id', 'vector', 'dtype'):
+            ids.append(bookmark_id)
+            vectors.append(vector_from_bytes(vector, dtype))
+        if not ids:
+            return np.empty(0, dtype=np.int64), None
+        return np.array(ids, dtype=np.int64), np.vstack(vectors)
+
+    def load(self):
+        """
+        Build the index from every stored vector of the user
+        """
+        with self.lock:
+            self.synced_at = timezone.now()
+            self._build(*self._read())
+
+    def sync(self):
+        """
+        Apply vectors stored since the last sync, by this or any other process
+        """
+        with self.lock:
+            since, self.synced_at = self.synced_at, timezone.now()
+            ids, vectors = self._read(since)
+        if len(ids):
+            self.upsert(ids, vectors)
+
+    def _build(self, ids, vectors):
+        if vectors is None:
+            self.index, self.trained_size = None, None
+            return
+
+        dimension = vectors.shape[1]
+        if len(ids) <= self.config['FLAT_MAX_VECTORS']:
+            # IDMap2 keeps an id lookup so vectors can be read back by bookmark id
+            index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+            self.trained_size = None
+        else:
+            # sqrt(n) lists, trained on a sample of 40 vectors a list (what faiss asks for),
+            # keeps building 100k vectors to a few seconds
+            lists = int(math.sqrt(len(ids)))
+            sample = np.random.default_rng(self.user_id).choice(len(ids), min(len(ids), 40 * lists), replace=False)
+            quantizer = faiss.IndexFlatIP(dimension)
+            index = faiss.IndexIVFFlat(quantizer, dimension, lists, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors[sample])
+            index.nprobe = self.config['IVF_NPROBE']
+            index.set_direct_map_type(faiss.DirectMap.Hashtable)
+            self.trained_size = len(ids)
+
+        index.add_with_ids(vectors, ids)
+        self.index = index
+
+    def upsert(self, ids, vectors):
+        """
+        Add or replace vectors, switching to IVF (or retraining it) when the index grew
+        past what it was built for
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+        with self.lock:
+            if self.index is None:
+                self._build(ids, vectors)
+                return
+
+            self.index.remove_ids(ids)
+            self.index.add_with_ids(vectors, ids)
+
+            grown = (
+                self.size > 2 * self.trained_size if self.trained_size
+                else self.size > self.config['FLAT_MAX_VECTORS']
+            )
+        if grown:
+            self.load()
+
+    def remove(self, ids):
+        with self.lock:
+            if self.index is not None:
+                self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+
+    def vector(self, bookmark_id):
+        """
+        The stored vector of a bookmark, None if it isn't in the index
+        """
+        with self.lock:
+            if self.index is None:
+                return None
+            try:
+                return self.index.reconstruct(int(bookmark_id))
+            except RuntimeError:
+                return None
+
+    def search(self, vector, limit, exclude=()):
+        """
+        Returns:
+            List of (bookmark id, similarity) pairs, most similar first
+        """
+        with self.lock:
+            if self.index is None or not self.size:
+                return []
+            query = np.ascontiguousarray(vector, dtype=np.float32).reshape(1, -1)
+            scores, ids = self.index.search(query, min(limit + len(exclude), self.size))
+
+        return [
+            (int(bookmark_id), float(score))
+            for bookmark_id, score in zip(ids[0], scores[0])
+            if bookmark_id != -1 and bookmark_id not in exclude
+        ][:limit]
+
+
+class IndexRegistry:
+    """
+    The per-user indexes of this process, least recently used evicted past MAX_INDEXES
+    indexes or MAX_INDEX_BYTES of vectors
+    """
+
+    def __init__(self, config=None):
+        if faiss is None:
+            raise ImproperlyConfigured("Similar bookmarks need the faiss-cpu package")
+
+        self.config = config or get_recommendation_settings()
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """
+        The user's index, loaded on first use and synced with the stored vectors at
+        most every SYNC_INTERVAL seconds
+        """
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+
+        if index is None:
+            index = UserIndex(user_id, self.config)
+            index.load()
+            with self._lock:
+                # Another thread may have loaded it meanwhile, either copy is current
+                self._indexes[user_id] = index
+                self._evict()
+        elif timezone.now() - index.synced_at >= datetime.timedelta(seconds=self.config['SYNC_INTERVAL']):
+            index.sync()
+
+        return index
+
+    def _evict(self):
+        # Called with the lock held. The most recently used index always stays, even
+        # if it alone is over MAX_INDEX_BYTES.
+        total = sum(index.nbytes for index in self._indexes.values())
+        while len(self._indexes) > 1 and (
+            len(self._indexes) > self.config['MAX_INDEXES'] or total > self.config['MAX_INDEX_BYTES']
+        ):
+            _, index = self._indexes.popitem(last=False)
+            total -= index.nbytes
+
+    def upsert(self, user_id, ids, vectors):
+        # Indexes that aren't loaded read the vectors from the database once they are.
+        # The index has its own lock, the registry's only guards the dict.
+        with self._lock:
+            index = self._indexes.get(user_id)
+        if index is None:
+            return
+
+        index.upsert(ids, vectors)
+        with self._lock:
+            self._evict()
+
+    def remove(self, user_id, ids):
+        with self._lock:
+            index = self._indexes.get(user_id)
+        if index is not None:
+            index.remove(ids)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+def get_index_registry():
+    """
+    Return the process-wide registry of per-user vector indexes, the vector_indexes
+    service (see config/ml_services.py)
+    """
+    return ml_services.get('vector_indexes')
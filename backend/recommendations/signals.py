@@ -0,0 +1,46 @@
+# recommendations/signals.py
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from bookmarks.models import Bookmark
+from bookmarks.signals import bookmarks_updated
+from config.ml_services import ml_services
+from .tasks import enqueue_embeddings
+
+
+def queue_embeddings(bookmark_ids):
+    """
+    Embed bookmarks once the current transaction commits, so the worker sees the rows
+    """
+    bookmark_ids = list(bookmark_ids)
+    if bookmark_ids:
+        transaction.on_commit(lambda: enqueue_embeddings(bookmark_ids))
+
+
+@receiver(post_save, sender=Bookmark)
+def bookmark_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        queue_embeddings([instance.id])
+
+
+@receiver(bookmarks_updated, sender=Bookmark)
+def bookmarks_written(sender, bookmark_ids, **kwargs):
+    queue_embeddings(bookmark_ids)
+
+
+@receiver(m2m_changed, sender=Bookmark.tags.through)
+def bookmark_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # tag.bookmarks.add(...) changes the bookmarks in pk_set
+    queue_embeddings((pk_set or []) if reverse else [instance.pk])
+
+
+@receiver(post_delete, sender=Bookmark)
+def bookmark_deleted(sender, instance, **kwargs):
+    # The embedding row goes with the bookmark, this process' index is updated now,
+    # others drop it when it turns up in a search
+    indexes = ml_services.get_loaded('vector_indexes')
+    if indexes is not None:
+        indexes.remove(instance.user_id, [instance.id])
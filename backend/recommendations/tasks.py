@@ -0,0 +1,151 @@
+# recommendations/tasks.py
+import logging
+
+from celery import shared_task
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from bookmarks.models import Bookmark
+from config.ml_services import ml_services
+from .models import BookmarkEmbedding
+from .services.embeddings import (
+    bookmark_text, bookmarks_embedded, get_encoder, get_recommendation_settings, text_hash, vector_to_bytes,
+)
+from .services.embedding_queue import get_pending_embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def embed_bookmarks(bookmark_ids):
+    """
+    Embed the given bookmarks whose text changed since they were last embedded, and
+    apply the new vectors to the indexes this process holds. Bookmarks without any
+    text are skipped, there is nothing to compare them by.
+
+    Returns:
+        Number of bookmarks embedded
+    """
+    config = get_recommendation_settings()
+
+    bookmarks = list(
+        Bookmark.objects.filter(id__in=bookmark_ids)
+        .only('id', 'user_id', 'title', 'description')
+        .prefetch_related('tags')
+    )
+    known = dict(
+        BookmarkEmbedding.objects
+        .filter(bookmark_id__in=[bookmark.id for bookmark in bookmarks], model=config['MODEL'])
+        .values_list('bookmark_id', 'text_hash')
+    )
+
+    pending = []
+    for bookmark in bookmarks:
+        text = bookmark_text(bookmark, [tag.name for tag in bookmark.tags.all()], config['MAX_TEXT_LENGTH'])
+        digest = text_hash(text)
+        if text and known.get(bookmark.id) != digest:
+            pending.append((bookmark, text, digest))
+
+    if not pending:
+        return 0
+
+    encoder = get_encoder()
+    vectors = encoder.encode([text for _, text, _ in pending])
+    dtype = config['VECTOR_DTYPE']
+
+    now = timezone.now()
+    BookmarkEmbedding.objects.bulk_create(
+        [
+            BookmarkEmbedding(
+                bookmark_id=bookmark.id,
+                user_id=bookmark.user_id,
+                vector=vector_to_bytes(vector, dtype),
+                dtype=dtype,
+                model=encoder.name,
+                text_hash=digest,
+                updated_at=now,
+            )
+            for (bookmark, _, digest), vector in zip(pending, vectors)
+        ],
+        update_conflicts=True,
+        unique_fields=['bookmark'],
+        update_fields=['user', 'vector', 'dtype', 'model', 'text_hash', 'updated_at'],
+    )
+
+    by_user = {}
+    for position, (bookmark, _, _) in enumerate(pending):
+        by_user.setdefault(bookmark.user_id, []).append(position)
+
+    # Indexes this process holds get the vectors now, the others on their next sync
+    indexes = ml_services.get_loaded('vector_indexes')
+    for user_id, positions in by_user.items():
+        ids = [pending[position][0].id for position in positions]
+        if indexes is not None:
+            indexes.upsert(user_id, ids, vectors[positions])
+        bookmarks_embedded.send(
+            sender=BookmarkEmbedding, user_id=user_id, bookmark_ids=ids, vectors=vectors[positions], model=encoder.name,
+        )
+
+    return len(pending)
+
+
+def enqueue_embeddings(bookmark_ids):
+    """
+    Queue bookmarks whose title, description or tags may have changed for embedding.
+
+    Ids are coalesced into batches of up to BATCH_SIZE: the first id of a batch
+    schedules a flush BATCH_WINDOW seconds out, and a full batch is flushed straight
+    away. Without Redis every call gets its own task.
+    """
+    config = get_recommendation_settings()
+
+    try:
+        queued = get_pending_embeddings().add(bookmark_ids)
+    except RedisError as e:
+        logger.warning(f"Embedding batches unavailable, queueing {len(bookmark_ids)} bookmarks directly: {e}")
+        queued = None
+
+    if queued is None:
+        update_embeddings.delay(bookmark_ids)
+        return
+
+    added, pending, opened = queued
+    batch_size = config['BATCH_SIZE']
+    if pending // batch_size > (pending - added) // batch_size:
+        flush_embeddings.delay()
+    elif opened:
+        flush_embeddings.apply_async(countdown=config['BATCH_WINDOW'])
+
+
+@shared_task
+def flush_embeddings():
+    """
+    Embed every pending bookmark, BATCH_SIZE at a time. A batch that fails goes back
+    in the queue and another flush is scheduled FLUSH_RETRY_DELAY seconds out.
+    """
+    config = get_recommendation_settings()
+    pending = get_pending_embeddings()
+    pending.close_window()
+
+    embedded = batches = 0
+    while bookmark_ids := pending.pop(config['BATCH_SIZE']):
+        try:
+            embedded += embed_bookmarks(bookmark_ids)
+        except Exception:
+            pending.requeue(bookmark_ids)
+            flush_embeddings.apply_async(countdown=config['FLUSH_RETRY_DELAY'])
+            raise
+        batches += 1
+
+    if batches:
+        logger.info(f"Embedded {embedded} bookmarks in {batches} batches")
+    return embedded
+
+
+@shared_task
+def update_embeddings(bookmark_ids):
+    """
+    Embed the given bookmarks in one task, used when there's no Redis to batch them in
+    """
+    embedded = embed_bookmarks(bookmark_ids)
+    logger.info(f"Embedded {embedded} of {len(bookmark_ids)} bookmarks")
+    return embedded
@@ -1,3 +1,376 @@
-from django.test import TestCase
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+from bookmarks.models import Bookmark
+from bookmarks.services.tags import sync_bookmark_tags
+from config.ml_services import MLServiceRegistry
+from .models import BookmarkEmbedding
+from .services.hybrid_search import encode_query, reciprocal_rank_fusion
+from .services.embeddings import VECTOR_DTYPES, get_encoder, get_recommendation_settings, vector_from_bytes, vector_to_bytes
+from .services.vector_index import IndexRegistry, UserIndex, get_index_registry
+from .tasks import embed_bookmarks, enqueue_embeddings, flush_embeddings
+from unittest.mock import patch
+import hashlib
+import subprocess
+import sys
+import time
+import numpy as np
 
-# Create your tests here.
+User = get_user_model()
+
+
+class HashingEncoder:
+    """
+    Bag of words hashed into a small vector, stands in for the sentence-transformers model
+    """
+    dimension = 64
+
+    def __init__(self, model_name, threads=None, batch_size=64):
+        self.name = model_name
+
+    def encode(self, texts, batch_size=None):
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().replace(',', ' ').split():
+                vectors[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dimension] += 1
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+TEST_RECOMMENDATIONS = {
+    'ENCODER': 'recommendations.tests.HashingEncoder',
+    'MODEL': 'test-hashing',
+}
+
+
+@override_settings(RECOMMENDATIONS=TEST_RECOMMENDATIONS)
+class SimilarBookmarksTest(APITestCase):
+    def setUp(self):
+        get_index_registry().clear()
+        self.user = User.objects.create_user(username="testuser", email="test@example.com", password="testpass")
+        self.other = User.objects.create_user(username="other", email="other@example.com", password="testpass")
+        self.client.force_authenticate(self.user)
+
+        self.django = self.bookmark("https://example.com/django", "Django tutorial", "Building web apps with python")
+        self.flask = self.bookmark("https://example.com/flask", "Flask tutorial", "Small web apps with python")
+        self.bread = self.bookmark("https://example.com/bread", "Sourdough bread", "Baking at home")
+        self.others = self.bookmark("https://example.com/other", "Django tutorial", "Building web apps with python", self.other)
+
+    def bookmark(self, url, title, description, user=None):
+        return Bookmark.objects.create(url=url, title=title, description=description, user=user or self.user)
+
+    def test_only_changed_text_is_embedded(self):
+        ids = [self.django.id, self.flask.id, self.bread.id]
+        self.assertEqual(embed_bookmarks(ids), 3)
+        self.assertEqual(embed_bookmarks(ids), 0)
+
+        sync_bookmark_tags(self.bread, ["cooking"])
+        self.assertEqual(embed_bookmarks(ids), 1)
+
+        embedding = BookmarkEmbedding.objects.get(bookmark=self.bread)
+        self.assertEqual(embedding.model, "test-hashing")
+        self.assertEqual(embedding.dtype, "float16")
+        self.assertEqual(len(embedding.vector), 2 * get_encoder().dimension)
+
+    def test_similar_endpoint(self):
+        response = self.client.get(f"/api/bookmarks/{self.django.id}/similar/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data["pending"])
+
+        embed_bookmarks(Bookmark.objects.values_list("id", flat=True))
+
+        # The bookmark, the matches and their tags, vectors come from the loaded index
+        with self.assertNumQueries(3):
+            response = self.client.get(f"/api/bookmarks/{self.django.id}/similar/?limit=2")
+        self.assertFalse(response.data["pending"])
+        # The other user's copy of the same page never shows up
+        self.assertEqual([result["id"] for result in response.data["results"]], [self.flask.id, self.bread.id])
+        self.assertGreater(response.data["results"][0]["similarity"], response.data["results"][1]["similarity"])
+
+        response = self.client.get(f"/api/bookmarks/{self.others.id}/similar/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_index_is_updated_in_place(self):
+        embed_bookmarks([self.django.id, self.bread.id])
+        index = get_index_registry().get(self.user.id)
+        self.assertEqual(index.size, 2)
+
+        # Vectors embedded in this process are applied straight away
+        embed_bookmarks([self.flask.id])
+        self.assertEqual(index.size, 3)
+
+        self.bread.delete()
+        self.assertEqual(index.size, 2)
+
+        # Other processes pick up stored changes on their next sync
+        elsewhere = UserIndex(self.user.id)
+        elsewhere.load()
+        Bookmark.objects.filter(pk=self.flask.pk).update(title="Sourdough bread")
+        embed_bookmarks([self.flask.id])
+        elsewhere.sync()
+        hits = elsewhere.search(np.ones(64, dtype=np.float32), 10)
+        self.assertEqual(sorted(bookmark_id for bookmark_id, _ in hits), sorted([self.django.id, self.flask.id]))
+
+    def test_registry_is_capped_by_bytes(self):
+        embed_bookmarks(Bookmark.objects.values_list("id", flat=True))
+        # Three 64 dimension float32 vectors fit, four don't
+        registry = IndexRegistry({**get_recommendation_settings(), 'MAX_INDEX_BYTES': 3 * 64 * 4})
+
+        registry.get(self.other.id)
+        registry.get(self.user.id)
+        self.assertEqual(list(registry._indexes), [self.user.id])
+
+        # The one index left is kept even when it outgrows the cap
+        registry.upsert(self.user.id, [10 ** 9], np.ones((1, 64), dtype=np.float32) / 8)
+        self.assertEqual(registry.get(self.user.id).size, 4)
+        self.assertEqual(list(registry._indexes), [self.user.id])
+
+    @override_settings(RECOMMENDATIONS={**TEST_RECOMMENDATIONS, 'FLAT_MAX_VECTORS': 40})
+    def test_large_indexes_switch_to_ivf(self):
+        bookmarks = [Bookmark(url=f"https://example.com/{i}", user=self.user) for i in range(100)]
+        for bookmark in bookmarks:
+            bookmark.prepare()
+        bookmarks = Bookmark.objects.bulk_create(bookmarks)
+
+        vectors = np.random.default_rng(0).normal(size=(100, 16)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        def store(start, end):
+            BookmarkEmbedding.objects.bulk_create([
+                BookmarkEmbedding(bookmark=bookmark, user=self.user, vector=vector_to_bytes(vector), model="test-hashing")
+                for bookmark, vector in zip(bookmarks[start:end], vectors[start:end])
+            ])
+
+        store(0, 30)
+        index = UserIndex(self.user.id)
+        index.load()
+        self.assertIsNone(index.trained_size)
+
+        store(30, 100)
+        index.sync()
+        self.assertEqual(index.size, 100)
+        self.assertEqual(index.trained_size, 100)
+        self.assertEqual(index.search(vectors[5], 1)[0][0], bookmarks[5].id)
+
+
+@override_settings(RECOMMENDATIONS=TEST_RECOMMENDATIONS)
+class HybridSearchTest(APITestCase):
+    def setUp(self):
+        get_index_registry().clear()
+        encode_query.cache_clear()
+        self.user = User.objects.create_user(username="testuser", email="test@example.com", password="testpass")
+        self.other = User.objects.create_user(username="other", email="other@example.com", password="testpass")
+        self.client.force_authenticate(self.user)
+
+        self.django = Bookmark.objects.create(url="https://example.com/django", title="Django tutorial", description="Building web apps with python", user=self.user)
+        self.flask = Bookmark.objects.create(url="https://example.com/flask", title="Flask tutorial", description="Small web apps with python", user=self.user)
+        self.bread = Bookmark.objects.create(url="https://example.com/bread", title="Sourdough bread", description="Baking at home", user=self.user)
+        self.others = Bookmark.objects.create(url="https://example.com/other", title="Django tutorial", description="Building web apps with python", user=self.other)
+        embed_bookmarks(Bookmark.objects.values_list("id", flat=True))
+
+    def search(self, query, **params):
+        response = self.client.get("/api/bookmarks/search/", {"q": query, "mode": "hybrid", **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_reciprocal_rank_fusion(self):
+        scores = reciprocal_rank_fusion([[1, 2, 3], [3, 4]], k=60)
+        # Found by both rankings beats first place in one
+        self.assertEqual(sorted(scores, key=scores.get, reverse=True), [3, 1, 2, 4])
+        self.assertAlmostEqual(scores[3], 1 / 63 + 1 / 61)
+
+    def test_finds_what_keyword_search_misses(self):
+        # Full text search needs every word, no bookmark mentions recipes
+        self.assertEqual(self.client.get("/api/bookmarks/search/", {"q": "baking bread recipes"}).data["results"], [])
+
+        result, = self.search("baking bread recipes")["results"]
+        self.assertEqual(result["id"], self.bread.id)
+        self.assertIsNone(result["scores"]["keyword"])
+        self.assertGreater(result["scores"]["vector"], 0.2)
+
+    def test_scores_from_both_sides(self):
+        data = self.search("flask")
+        self.assertEqual(data["mode"], "hybrid")
+        result, = data["results"]
+        self.assertEqual(result["id"], self.flask.id)
+        self.assertAlmostEqual(result["rank"], 2 / 61)
+        self.assertGreater(result["scores"]["keyword"], 0)
+        self.assertGreater(result["scores"]["vector"], 0.2)
+        self.assertEqual(result["highlight"]["title"], "<mark>Flask</mark> tutorial")
+
+    def test_pagination(self):
+        data = self.search("web apps", page_size=1)
+        self.assertIsNotNone(data["next"])
+        second = self.client.get(data["next"]).data
+        self.assertIsNone(second["next"])
+
+        # The other user's copy of the same page never shows up
+        ids = [result["id"] for result in data["results"] + second["results"]]
+        self.assertEqual(sorted(ids), sorted([self.django.id, self.flask.id]))
+        self.assertGreaterEqual(data["results"][0]["rank"], second["results"][0]["rank"])
+
+    @override_settings(RECOMMENDATIONS={**TEST_RECOMMENDATIONS, 'HYBRID_VECTOR_TIMEOUT_MS': 10})
+    def test_slow_vector_search_falls_back_to_keywords(self):
+        def slow(*args):
+            time.sleep(0.1)
+            return [(self.bread.id, 1.0)]
+
+        with patch("recommendations.services.hybrid_search.vector_candidates", side_effect=slow):
+            with self.assertLogs("recommendations.services.hybrid_search", "WARNING"):
+                data = self.search("flask")
+        self.assertEqual([result["id"] for result in data["results"]], [self.flask.id])
+        self.assertIsNone(data["results"][0]["scores"]["vector"])
+
+
+class FakeRedis:
+    """
+    The few set commands the pending embeddings queue uses
+    """
+
+    def __init__(self):
+        self.sets = {}
+        self.keys = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def sadd(self, key, *values):
+        members = self.sets.setdefault(key, set())
+        added = len(set(map(str, values)) - members)
+        members.update(map(str, values))
+        return added
+
+    def scard(self, key):
+        return len(self.sets.get(key, ()))
+
+    def spop(self, key, count):
+        members = self.sets.get(key, set())
+        return [members.pop() for _ in range(min(count, len(members)))]
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.keys:
+            return None
+        self.keys[key] = value
+        return True
+
+    def delete(self, key):
+        self.keys.pop(key, None)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+@override_settings(RECOMMENDATIONS={**TEST_RECOMMENDATIONS, 'BATCH_SIZE': 3})
+class EmbeddingBatchTest(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch("recommendations.services.embedding_queue.get_redis_connection", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(username="testuser", email="test@example.com", password="testpass")
+        self.bookmarks = [
+            Bookmark.objects.create(url=f"https://example.com/{i}", title=f"Page {i}", user=self.user)
+            for i in range(5)
+        ]
+        self.ids = [bookmark.id for bookmark in self.bookmarks]
+
+    @patch("recommendations.tasks.flush_embeddings.delay")
+    @patch("recommendations.tasks.flush_embeddings.apply_async")
+    def test_changes_are_coalesced(self, schedule, flush_now):
+        # The first change opens a window, later ones join it
+        enqueue_embeddings(self.ids[:1])
+        enqueue_embeddings(self.ids[:2])
+        schedule.assert_called_once_with(countdown=2)
+        flush_now.assert_not_called()
+
+        # A full batch doesn't wait for the window
+        enqueue_embeddings(self.ids[2:])
+        flush_now.assert_called_once()
+
+        self.assertEqual(flush_embeddings(), 5)
+        self.assertEqual(BookmarkEmbedding.objects.count(), 5)
+        self.assertEqual(self.redis.scard("embeddings:pending"), 0)
+
+        # Flushing closed the window, the next change opens another
+        enqueue_embeddings(self.ids[:1])
+        self.assertEqual(schedule.call_count, 2)
+
+    def test_failed_batches_are_requeued(self):
+        with patch("recommendations.tasks.flush_embeddings.apply_async"):
+            enqueue_embeddings(self.ids[:2])
+
+        with patch("recommendations.tasks.embed_bookmarks", side_effect=RuntimeError), \
+                patch("recommendations.tasks.flush_embeddings.apply_async") as schedule:
+            with self.assertRaises(RuntimeError):
+                flush_embeddings()
+        self.assertEqual(self.redis.scard("embeddings:pending"), 2)
+        # They don't wait for the next change to be retried
+        schedule.assert_called_once_with(countdown=30)
+
+    @patch("recommendations.tasks.update_embeddings.delay")
+    def test_without_redis_each_change_is_queued(self, delay):
+        with patch("recommendations.services.embedding_queue.get_redis_connection", side_effect=NotImplementedError):
+            enqueue_embeddings(self.ids[:2])
+        delay.assert_called_once_with(self.ids[:2])
+
+
+class VectorStorageTest(TestCase):
+    def test_compact_dtypes_keep_the_direction(self):
+        vector = np.random.default_rng(0).normal(size=384).astype(np.float32)
+        vector /= np.linalg.norm(vector)
+
+        sizes = {}
+        for dtype in VECTOR_DTYPES:
+            data = vector_to_bytes(vector, dtype)
+            sizes[dtype] = len(data)
+            decoded = vector_from_bytes(data, dtype)
+            self.assertEqual(decoded.dtype, np.float32)
+            self.assertGreater(float(decoded @ vector), 0.999)
+
+        self.assertEqual(sizes, {"float32": 1536, "float16": 768, "int8": 388})
+
+
+class MLServicesTest(TestCase):
+    def test_services_load_on_first_use(self):
+        registry = MLServiceRegistry()
+        registry.register('indexes', 'recommendations.services.vector_index.IndexRegistry', setting='RECOMMENDATIONS')
+        self.assertIsNone(registry.get_loaded('indexes'))
+
+        indexes = registry.get('indexes')
+        self.assertIs(registry.get('indexes'), indexes)
+        self.assertIs(registry.get_loaded('indexes'), indexes)
+        self.assertEqual(list(registry.stats()), ['indexes'])
+
+        registry.reset_for_setting('RECOMMENDATIONS')
+        self.assertIsNone(registry.get_loaded('indexes'))
+
+        with self.assertLogs('config.ml_services', 'WARNING'):
+            registry.preload(['indexes', 'unknown'])
+        self.assertIsNotNone(registry.get_loaded('indexes'))
+
+    def test_startup_imports_no_ml_libraries(self):
+        # A fresh process loading every URL, view, task and signal module
+        code = (
+            "import django, importlib, sys\n"
+            "django.setup()\n"
+            "from django.conf import settings\n"
+            "importlib.import_module(settings.ROOT_URLCONF)\n"
+            "from config import celery_app\n"
+            "celery_app.loader.import_default_modules()\n"
+            "print('loaded:' + ','.join(name for name in ('scipy', 'sklearn', 'faiss', 'torch') if name in sys.modules))\n"
+        )
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip().splitlines()[-1], 'loaded:')